@@ -0,0 +1,528 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of JPK generation on synthetic ledger.
+
+Synthetic documents are written directly to database tables (without
+document lifecycle), so even millions of documents can be generated in
+reasonable time. All generated names start with benchmark_prefix, so they
+can be removed with delete_ledger.
+
+Usage (see commands.py):
+bench --site {site} jpk-benchmark --company {company} --scale 10k --generate
+"""
+
+from __future__ import unicode_literals
+import frappe
+import json
+import os
+import random
+import tempfile
+import timeit
+from frappe.utils import now
+
+from jpk_v7m.external_tools.JPK_V7M_creator.jpk_v7m_creator import create_jpk
+from jpk_v7m.helpers.evidence_cache import get_cache_name as get_evidence_cache_name
+from jpk_v7m.helpers.metrics import measure_phase, start_metrics, stop_metrics
+from jpk_v7m.helpers.party_cache import reset_party_cache
+from jpk_v7m.helpers.tax_accounts import get_tax_accounts
+from jpk_v7m.helpers.tax_detail import get_item_wise_tax, orjson, parse_item_wise_tax_detail
+
+# Prefix of names of all generated documents
+benchmark_prefix = "JPKBENCH-"
+
+# Number of documents for named scales
+benchmark_scales = {
+	"1k": 1000,
+	"10k": 10000,
+	"100k": 100000,
+	"1m": 1000000
+	}
+
+# Share of documents of each type in generated ledger
+document_shares = {
+	"Sales Invoice": 0.5,
+	"Purchase Invoice": 0.45,
+	"Journal Entry": 0.05
+	}
+
+# Countries of generated parties: (country name, tax id prefix)
+# Poland and other EU countries, and countries outside EU
+party_countries = [
+	("Poland", "PL"),
+	("Poland", "PL"),
+	("Poland", "PL"),
+	("Germany", "DE"),
+	("France", "FR"),
+	("Czech Republic", "CZ"),
+	("China", "CN"),
+	("United States", "US")
+	]
+
+# Number of generated suppliers, customers and addresses
+number_of_parties = 200
+
+# Number of documents inserted with single query
+insert_batch_size = 1000
+
+output_tax_rates = [23.0, 23.0, 8.0, 5.0, 0.0]
+
+
+def generate_ledger(company, year, month, documents, seed = 0):
+	"""
+	Generates synthetic parties, addresses, Sales and Purchase Invoices and
+	customs clearance Journal Entries of given company posted in given month.
+
+	Invoices use first input and output tax accounts of JPK Company Settings
+	of the company (and sometimes other account, not taken into account).
+
+	Returns dict: doctype -> number of generated documents.
+
+	Arguments:
+	- documents: total number of generated documents
+	- seed: seed of random generator (the same seed gives the same ledger)
+	"""
+
+	from jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m import get_period_dates
+
+	rng = random.Random(seed)
+
+	input_tax_accounts, output_tax_accounts = get_tax_accounts(company)
+
+	if not input_tax_accounts or not output_tax_accounts:
+		frappe.throw("JPK Company Settings of {0} have no tax accounts".format(company))
+
+	input_tax_account = sorted(input_tax_accounts)[0]
+	output_tax_account = sorted(output_tax_accounts)[0]
+	# account not taken into account in JPK
+	other_account = frappe.db.get_value("Account", {"company": company, "is_group": 0, "account_type": "Bank"}, "name") or "Bank"
+
+	start_date, end_date = get_period_dates(year, month)
+	days = int(end_date[-2:])
+	period_prefix = start_date[:8]
+
+	parties = generate_parties(rng)
+
+	counts = {}
+
+	for doctype, share in document_shares.items():
+		counts[doctype] = int(documents * share)
+
+	generated_rows = []
+	purchase_invoice_names = []
+
+	for i in range(counts["Purchase Invoice"]):
+		name = benchmark_prefix + "PI-{0:07d}".format(i)
+		supplier = rng.choice(parties["Supplier"])
+		posting_date = period_prefix + "{0:02d}".format(rng.randint(1, days))
+		purchase_invoice_names.append(name)
+
+		generated_rows.append(("Purchase Invoice", {
+			"name": name,
+			"company": company,
+			"posting_date": posting_date,
+			"supplier": supplier["name"],
+			"supplier_name": supplier["supplier_name"],
+			"supplier_address": rng.choice([None, supplier["address"]]),
+			"tax_id": rng.choice([None, supplier["tax_id"]]),
+			"bill_no": "FV/{0}".format(i),
+			"bill_date": posting_date,
+			"is_split_payment": int(rng.random() < 0.1)
+			}))
+
+		generated_rows += generate_invoice_children(
+			rng,
+			"Purchase Invoice",
+			name,
+			[input_tax_account, other_account],
+			[23.0, 8.0, 5.0]
+			)
+
+		generated_rows = insert_generated_rows(generated_rows)
+
+	for i in range(counts["Sales Invoice"]):
+		name = benchmark_prefix + "SI-{0:07d}".format(i)
+		customer = rng.choice(parties["Customer"])
+
+		generated_rows.append(("Sales Invoice", {
+			"name": name,
+			"company": company,
+			"posting_date": period_prefix + "{0:02d}".format(rng.randint(1, days)),
+			"customer": customer["name"],
+			"customer_name": customer["customer_name"],
+			"customer_address": rng.choice([None, customer["customer_primary_address"]]),
+			"shipping_address_name": None,
+			"tax_id": rng.choice([None, customer["tax_id"]]),
+			"is_split_payment": int(rng.random() < 0.1)
+			}))
+
+		generated_rows += generate_invoice_children(
+			rng,
+			"Sales Invoice",
+			name,
+			[output_tax_account, other_account],
+			output_tax_rates
+			)
+
+		generated_rows = insert_generated_rows(generated_rows)
+
+	for i in range(counts["Journal Entry"]):
+		name = benchmark_prefix + "JE-{0:07d}".format(i)
+		tax = round(rng.uniform(10, 5000), 2)
+		posting_date = period_prefix + "{0:02d}".format(rng.randint(1, days))
+
+		generated_rows.append(("Journal Entry", {
+			"name": name,
+			"company": company,
+			"posting_date": posting_date,
+			"voucher_type": "Journal Entry",
+			"jpk_is_imp": 1,
+			"jpk_purchase_invoice": rng.choice(purchase_invoice_names) if purchase_invoice_names else None,
+			"bill_no": "SAD/{0}".format(i),
+			"bill_date": posting_date,
+			"jpk_imp_net": str(round(tax / 0.23, 2))
+			}))
+
+		for idx, (account, debit, credit) in enumerate([(input_tax_account, tax, 0), (other_account, 0, tax)]):
+			generated_rows.append(("Journal Entry Account", {
+				"name": "{0}-{1}".format(name, idx + 1),
+				"parent": name,
+				"parenttype": "Journal Entry",
+				"parentfield": "accounts",
+				"idx": idx + 1,
+				"account": account,
+				"debit": debit,
+				"credit": credit
+				}))
+
+		generated_rows = insert_generated_rows(generated_rows)
+
+	insert_generated_rows(generated_rows, force = True)
+
+	frappe.db.commit()
+
+	return counts
+
+
+def generate_parties(rng):
+	"""
+	Inserts synthetic addresses, suppliers and customers. Returns dict:
+	doctype -> list of dicts with values of generated documents.
+	"""
+
+	parties = {"Supplier": [], "Customer": []}
+	generated_rows = []
+
+	for i in range(number_of_parties):
+		country, tax_id_prefix = rng.choice(party_countries)
+		address = benchmark_prefix + "ADDR-{0:05d}".format(i)
+
+		generated_rows.append(("Address", {
+			"name": address,
+			"address_title": address,
+			"address_type": "Billing",
+			"address_line1": "Street {0}".format(i),
+			"city": "City",
+			"country": country
+			}))
+
+		# party names are the same as document names, because JPK looks
+		# for parties by supplier_name and customer_name
+		supplier_name = benchmark_prefix + "SUP-{0:05d}".format(i)
+		customer_name = benchmark_prefix + "CUST-{0:05d}".format(i)
+
+		supplier = {
+			"name": supplier_name,
+			"supplier_name": supplier_name,
+			"supplier_type": "Company",
+			"country": country,
+			"tax_id": tax_id_prefix + "{0:010d}".format(i)
+			}
+
+		customer = {
+			"name": customer_name,
+			"customer_name": customer_name,
+			"customer_type": "Company",
+			"customer_primary_address": address,
+			"tax_id": tax_id_prefix + "{0:010d}".format(i + number_of_parties)
+			}
+
+		generated_rows += [("Supplier", supplier), ("Customer", customer)]
+
+		parties["Supplier"].append(dict(supplier, address = address))
+		parties["Customer"].append(customer)
+
+	insert_generated_rows(generated_rows, force = True)
+
+	return parties
+
+
+def generate_invoice_children(rng, doctype, parent, tax_accounts, rates):
+	"""
+	Returns list of (doctype, values) of items and tax rows of generated
+	invoice
+	"""
+
+	is_purchase = doctype == "Purchase Invoice"
+	item_doctype = "Purchase Invoice Item" if is_purchase else "Sales Invoice Item"
+	tax_doctype = "Purchase Taxes and Charges" if is_purchase else "Sales Taxes and Charges"
+
+	rows = []
+	item_wise_tax_detail = {}
+
+	for idx in range(1, rng.randint(1, 8) + 1):
+		item_code = "ITEM-{0:04d}".format(rng.randint(0, 999))
+		net_amount = round(rng.uniform(1, 10000), 2)
+		rate = rng.choice(rates)
+
+		item = {
+			"name": "{0}-I{1}".format(parent, idx),
+			"parent": parent,
+			"parenttype": doctype,
+			"parentfield": "items",
+			"idx": idx,
+			"item_code": item_code,
+			"item_name": item_code,
+			"net_amount": net_amount
+			}
+
+		if is_purchase:
+			item["is_fixed_asset"] = int(rng.random() < 0.05)
+
+		rows.append((item_doctype, item))
+		item_wise_tax_detail[item_code] = [rate, round(net_amount * rate / 100, 2)]
+
+	rows.append((tax_doctype, {
+		"name": "{0}-T1".format(parent),
+		"parent": parent,
+		"parenttype": doctype,
+		"parentfield": "taxes",
+		"idx": 1,
+		"charge_type": "On Net Total",
+		"account_head": tax_accounts[0] if rng.random() < 0.95 else tax_accounts[-1],
+		"item_wise_tax_detail": json.dumps(item_wise_tax_detail)
+		}))
+
+	return rows
+
+
+def insert_generated_rows(generated_rows, force = False):
+	"""
+	Inserts generated rows with bulk queries (one query per doctype) if
+	there are at least insert_batch_size rows, or if force is True.
+
+	Returns list of rows not inserted yet.
+	"""
+
+	if not generated_rows or (len(generated_rows) < insert_batch_size and not force):
+		return generated_rows
+
+	rows_by_doctype = {}
+
+	for doctype, values in generated_rows:
+		rows_by_doctype.setdefault(doctype, []).append(values)
+
+	timestamp = now()
+	user = frappe.session.user
+
+	for doctype, rows in rows_by_doctype.items():
+		fields = list(rows[0]) + ["owner", "modified_by", "creation", "modified", "docstatus"]
+
+		# documents and their child rows are submitted, parties are not
+		docstatus = 1 if doctype in document_shares or "parent" in rows[0] else 0
+
+		values = [[row.get(field) for field in fields[:-5]] + [user, user, timestamp, timestamp, docstatus] for row in rows]
+
+		frappe.db.bulk_insert(doctype, fields, values)
+
+	return []
+
+
+def delete_ledger():
+	"""
+	Deletes all generated documents (with names starting with
+	benchmark_prefix)
+	"""
+
+	doctypes = [
+		"Sales Invoice Item", "Sales Taxes and Charges", "Sales Invoice",
+		"Purchase Invoice Item", "Purchase Taxes and Charges", "Purchase Invoice",
+		"Journal Entry Account", "Journal Entry",
+		"Customer", "Supplier", "Address"
+		]
+
+	for doctype in doctypes:
+		frappe.db.sql("delete from `tab{0}` where name like %s".format(doctype), benchmark_prefix + "%")
+
+	frappe.db.commit()
+
+
+def run_benchmark(company, year, month, use_evidence_cache = False, workers = None):
+	"""
+	Runs the full JPK pipeline (without background job and File document)
+	for given company and month, and returns dict with metrics of phases
+	(the same as in JPK_V7M.create_jpk_file):
+	- tax_accounts, load_documents, parties, evidence_cache, processing:
+	  loading and processing of documents
+	- xml: creation of JPK file (streaming mode)
+
+	Arguments:
+	- use_evidence_cache: if False, evidence cache of the month is cleared
+	  first, so every document is processed
+	- workers: number of processes for document processing (overrides
+	  jpk_v7m_workers from site config)
+	"""
+
+	from jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m import get_period_dates, get_tax_documents
+
+	start_date, end_date = get_period_dates(year, month)
+
+	if not use_evidence_cache:
+		for doctype in ["Purchase Invoice", "Sales Invoice", "Journal Entry"]:
+			frappe.cache().delete_key(get_evidence_cache_name(doctype, start_date[:7]))
+
+	# site config is restored after the run
+	previous_workers = frappe.conf.get("jpk_v7m_workers")
+	has_workers = "jpk_v7m_workers" in frappe.conf
+
+	if workers is not None:
+		frappe.conf.jpk_v7m_workers = workers
+
+	metrics = start_metrics()
+	file_path = None
+
+	try:
+		reset_party_cache()
+
+		with measure_phase("tax_accounts"):
+			input_tax_accounts, output_tax_accounts = get_tax_accounts(company)
+
+		input_tax_documents, output_tax_documents = get_tax_documents(
+			year,
+			month,
+			input_tax_accounts,
+			output_tax_accounts,
+			company = company
+			)
+
+		file_descriptor, file_path = tempfile.mkstemp(suffix = ".xml")
+		os.close(file_descriptor)
+
+		with measure_phase("xml") as phase:
+			create_jpk(
+				is_guidance_accepted = "1",
+				purpose = "1",
+				tax_office_code = "1471",
+				year = year,
+				month = month,
+				is_natural_person = "0",
+				full_name = company,
+				tax_number = "5260250274",
+				email = "jpk@example.com",
+				phone = "",
+				forwarded_excess_of_input_tax = "0",
+				input_tax_documents = input_tax_documents,
+				output_tax_documents = output_tax_documents,
+				amendment_reasons = "",
+				system_name = "jpk_v7m benchmark",
+				file_name = file_path,
+				streaming = True
+				)
+
+			phase["rows"] = len(input_tax_documents) + len(output_tax_documents)
+			phase["output_bytes"] = os.path.getsize(file_path)
+	finally:
+		if file_path:
+			os.remove(file_path)
+
+		stop_metrics()
+
+		if workers is not None:
+			if has_workers:
+				frappe.conf.jpk_v7m_workers = previous_workers
+			else:
+				frappe.conf.pop("jpk_v7m_workers", None)
+
+	result = metrics.as_dict()
+	result.update({"company": company, "year": year, "month": month})
+
+	return result
+
+
+def benchmark_parsers(items = 500, rows = 3, number = 200):
+	"""
+	Returns dict: method -> time (in seconds) of processing single invoice
+	with given number of items and tax rows by three functions (like
+	get_output_tax_details, process_input_tax_document and
+	process_eu_purchase_output_tax_document):
+	- "json": each function parses every tax row with json.loads
+	- "parsed once (json)": every tax row parsed once with json.loads
+	- "parsed once (orjson)": the same with orjson (if installed)
+	"""
+
+	detail = {"Item %d" % i: [23.0, round(i * 0.23, 2)] for i in range(items)}
+	text = json.dumps(detail)
+
+	def json_each_time():
+		for function in range(3):
+			for row in range(rows):
+				for item_name, values in json.loads(text).items():
+					values[1]
+
+	def parsed_once(parser):
+		parsed = [parse_item_wise_tax_detail(text, parser) for row in range(rows)]
+		for function in range(3):
+			for row in parsed:
+				for item_name, rate, amount in row:
+					amount
+
+	results = {
+		"json": timeit.timeit(json_each_time, number = number) / number,
+		"parsed once (json)": timeit.timeit(lambda: parsed_once(json.loads), number = number) / number
+		}
+
+	if orjson:
+		results["parsed once (orjson)"] = timeit.timeit(lambda: parsed_once(orjson.loads), number = number) / number
+
+	return results
+
+
+def benchmark_output_tax_details(invoices = 500, items = 8, number = 20):
+	"""
+	Returns dict: method -> time (in seconds) of calculation of tax details
+	of a chunk of sales invoices with given number of items each:
+	- "per invoice": get_output_tax_details called for every invoice
+	- "batch": get_output_tax_details_batch called once for the chunk
+
+	item_wise_tax_detail is parsed before measurement, so only grouping of
+	items by tax rate is compared.
+	"""
+
+	from jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m import InvoiceRecord, get_output_tax_details, get_output_tax_details_batch
+
+	rng = random.Random(0)
+	tax_accounts = ["VAT - B", "VAT 8 - B"]
+	chunk = []
+
+	for i in range(invoices):
+		invoice = InvoiceRecord("Sales Invoice", {"name": benchmark_prefix + "SI-{0:07d}".format(i)})
+		item_wise_tax_detail = {}
+
+		for idx in range(items):
+			item_code = "ITEM-{0:04d}".format(idx)
+			net_amount = round(rng.uniform(1, 10000), 2)
+			rate = rng.choice(output_tax_rates)
+
+			invoice.items.append(frappe._dict(item_code = item_code, net_amount = net_amount))
+			item_wise_tax_detail[item_code] = [rate, round(net_amount * rate / 100, 2)]
+
+		invoice.taxes.append(frappe._dict(account_head = tax_accounts[0], item_wise_tax_detail = json.dumps(item_wise_tax_detail)))
+		chunk.append(invoice)
+
+	for invoice in chunk:
+		for tax in invoice.taxes:
+			get_item_wise_tax(tax)
+
+	return {
+		"per invoice": timeit.timeit(lambda: [get_output_tax_details(invoice, tax_accounts) for invoice in chunk], number = number) / number,
+		"batch": timeit.timeit(lambda: get_output_tax_details_batch(chunk, tax_accounts), number = number) / number
+		}
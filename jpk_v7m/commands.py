@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+
+@click.command("jpk-check-indexes")
+@click.option("--create", is_flag = True, default = False, help = "Create missing indexes")
+@pass_context
+def check_indexes(context, create = False):
+	"""
+	Reports indexes required by JPK queries, which are missing in the site
+	database (and optionally creates them)
+	"""
+
+	from jpk_v7m.install import create_indexes, get_missing_indexes
+
+	site = get_site(context)
+
+	frappe.init(site = site)
+	frappe.connect()
+
+	try:
+		missing_indexes = get_missing_indexes()
+
+		if not missing_indexes:
+			click.echo("All JPK indexes exist")
+			return
+
+		for doctype, index_name, fields in missing_indexes:
+			click.echo("Missing index {0} on {1} ({2})".format(index_name, doctype, ", ".join(fields)))
+
+		if create:
+			create_indexes()
+			frappe.db.commit()
+			click.echo("Created {0} indexes".format(len(missing_indexes)))
+		else:
+			# non-zero exit code for scripts checking the site
+			raise SystemExit(1)
+	finally:
+		frappe.destroy()
+
+
+@click.command("jpk-benchmark")
+@click.option("--company", required = True, help = "Company with JPK Company Settings")
+@click.option("--year", default = "2021", help = "Year of generated documents")
+@click.option("--month", default = "1", help = "Month of generated documents")
+@click.option("--scale", default = "1k", help = "Number of generated documents: 1k, 10k, 100k, 1m or a number")
+@click.option("--generate", is_flag = True, default = False, help = "Generate synthetic ledger before the run")
+@click.option("--cleanup", is_flag = True, default = False, help = "Delete synthetic ledger after the run")
+@click.option("--warm", is_flag = True, default = False, help = "Use evidence cache of previous runs")
+@click.option("--workers", type = int, default = None, help = "Number of processes for documents")
+@click.option("--output", default = None, help = "JSON file for results (appended as one line)")
+@pass_context
+def benchmark(context, company, year, month, scale, generate = False, cleanup = False, warm = False, workers = None, output = None):
+	"""
+	Runs JPK generation on synthetic ledger and reports wall time, number of
+	queries, memory growth and output size of every phase
+	"""
+
+	import json
+	from jpk_v7m.benchmark import benchmark_scales, delete_ledger, generate_ledger, run_benchmark
+
+	site = get_site(context)
+
+	frappe.init(site = site)
+	frappe.connect()
+
+	try:
+		if generate:
+			documents = benchmark_scales.get(scale.lower()) or int(scale)
+			counts = generate_ledger(company, year, month, documents)
+			click.echo("Generated: " + json.dumps(counts))
+
+		result = run_benchmark(company, year, month, use_evidence_cache = warm, workers = workers)
+		result["scale"] = scale
+
+		for phase in result["phases"]:
+			click.echo("{phase:<16}{seconds:>10.3f} s{queries:>10} queries{rows:>10} rows{rss_delta_mb!s:>10} MB".format(**phase))
+
+		click.echo("{0:<16}{1:>10.3f} s{2:>10} queries".format("total", result["seconds"], result["queries"]))
+
+		if output:
+			with open(output, "a") as f:
+				f.write(json.dumps(result) + "\n")
+
+		if cleanup:
+			delete_ledger()
+	finally:
+		frappe.destroy()
+
+
+@click.command("jpk-benchmark-tax-detail")
+def benchmark_tax_detail():
+	"""
+	Compares parsing of item_wise_tax_detail in every function with parsing
+	once per tax row (with json and orjson)
+	"""
+
+	from jpk_v7m.benchmark import benchmark_parsers
+
+	for method, seconds in benchmark_parsers().items():
+		click.echo("{:<24}{:>10.3f} ms".format(method, seconds * 1000))
+
+
+@click.command("jpk-benchmark-output-tax")
+def benchmark_output_tax():
+	"""
+	Compares calculation of output tax details for every sales invoice
+	with calculation for a whole chunk of invoices
+	"""
+
+	from jpk_v7m.benchmark import benchmark_output_tax_details
+
+	for method, seconds in benchmark_output_tax_details().items():
+		click.echo("{:<24}{:>10.3f} ms".format(method, seconds * 1000))
+
+
+commands = [
+	check_indexes,
+	benchmark,
+	benchmark_tax_detail,
+	benchmark_output_tax
+]
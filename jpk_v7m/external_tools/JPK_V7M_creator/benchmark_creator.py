@@ -0,0 +1,397 @@
+# coding=UTF-8
+"""
+Micro-benchmarks of JPK_V7M XML creator
+
+Measures the most time consuming functions of jpk_v7m_creator.py (building
+rows of evidence, validation of values, declaration and writing the file,
+whole or in streaming mode) on generated documents, without ERPNext.
+Documents are generated with fixed seed, so every run processes exactly the
+same data.
+
+Every benchmark is repeated several times, and the best and median times
+are reported (together with peak memory allocated during single run,
+measured separately with tracemalloc).
+
+Usage:
+
+Run all benchmarks with default sizes (100, 1000 and 10000 documents):
+python3 benchmark_creator.py
+
+Save results as a baseline (JSON file):
+python3 benchmark_creator.py --save baseline.json
+
+Compare current code with saved baseline (exit code 1 if some benchmark is
+slower than the baseline by more than the threshold):
+python3 benchmark_creator.py --compare baseline.json --threshold 0.1
+
+Without a file name, --compare uses baseline.json from this folder, saved
+with default sizes and repetitions. Baselines depend on the machine and
+Python version (both are stored in the file), so compare only results from
+the same environment, and save a new baseline on your machine first:
+python3 benchmark_creator.py --save baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from datetime import datetime
+
+try:
+	from . import jpk_v7m_creator as creator
+except ImportError:
+	# called as a script
+	import jpk_v7m_creator as creator
+
+# Seed of random generator of documents
+seed = 2021
+
+# Default numbers of documents
+default_sizes = [100, 1000, 10000]
+
+# Default number of repetitions of every benchmark
+default_repeat = 5
+
+# Baseline used by --compare without a file name
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Values of K_ fields of input documents: numbers and strings (like the
+# data from user)
+input_tax_values = [None, None, "", "12.50", 0.0, 100, 1234.56]
+
+
+def generate_output_tax_documents(count, rng):
+	"""
+	Returns list of dicts with data of output tax documents, similar to
+	documents created by ERPNext app
+	"""
+
+	documents = []
+
+	for i in range(count):
+		document = {
+			"party_country_code": rng.choice(["PL", "PL", "PL", "DE", "CZ"]),
+			"party_tax_id": str(rng.randint(10 ** 9, 10 ** 10 - 1)),
+			"party_name": "Kontrahent {0} & Syn <sp. z o.o.>".format(rng.randint(1, 500)),
+			"document_number": "FV/{0}/07/2021".format(i + 1),
+			"document_date": "2021-07-{0:02d}".format(rng.randint(1, 31)),
+			"sales_date": None,
+			"document_type": rng.choice([None, None, None, "RO", "FP"]),
+			"tax_base_amendment": rng.choice([None] * 9 + ["1"])
+			}
+
+		if rng.random() < 0.1:
+			document["split_payment"] = "1"
+
+		for gtu in range(1, 14):
+			document["gtu_{0:02d}".format(gtu)] = "1" if rng.random() < 0.02 else None
+
+		for k in range(10, 37):
+			document["k_" + str(k)] = None
+
+		# net and tax of one or two rates
+		for net_field in rng.sample([15, 17, 19], rng.randint(1, 2)):
+			net = round(rng.uniform(-500, 20000), 2)
+			document["k_" + str(net_field)] = net
+			document["k_" + str(net_field + 1)] = round(net * 0.23, 2)
+
+		documents.append(document)
+
+	return documents
+
+
+def generate_input_tax_documents(count, rng):
+	"""
+	Returns list of dicts with data of input tax documents, similar to
+	documents created by ERPNext app
+	"""
+
+	documents = []
+
+	for i in range(count):
+		document = {
+			"party_country_code": rng.choice(["PL", "PL", "DE"]),
+			"party_tax_id": str(rng.randint(10 ** 9, 10 ** 10 - 1)),
+			"party_name": "Dostawca {0}".format(rng.randint(1, 500)),
+			"document_number": "Z/{0}/2021".format(i + 1),
+			"document_date": "2021-07-{0:02d}".format(rng.randint(1, 31)),
+			"document_receipt_date": None,
+			"document_type": None,
+			"import": rng.choice([None] * 19 + ["1"])
+			}
+
+		if rng.random() < 0.1:
+			document["split_payment"] = "1"
+
+		for k in range(40, 48):
+			document["k_" + str(k)] = rng.choice(input_tax_values)
+
+		documents.append(document)
+
+	return documents
+
+
+def get_empty_sums():
+	"""
+	Returns initial sums of K_ fields and bad debt relief (like create_jpk)
+	"""
+
+	sum_of_field_k = []
+	creator.initialize_list(sum_of_field_k, 48, 0.0)
+
+	return sum_of_field_k, {"net": 0, "tax": 0}
+
+
+def get_benchmarks(size):
+	"""
+	Returns dict: benchmark name -> function without arguments, running the
+	benchmark for given number of documents.
+
+	Data (documents, sums, elements) is prepared here, so only the tested
+	function is measured.
+	"""
+
+	rng = random.Random(seed)
+	output_tax_documents = generate_output_tax_documents(size, rng)
+	input_tax_documents = generate_input_tax_documents(size, rng)
+	values = [document.get("k_" + str(k)) for document in input_tax_documents for k in range(40, 48)]
+
+	sum_of_field_k, sum_of_bad_debt_relief = get_empty_sums()
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		evidence = creator.create_jpk_evidence(input_tax_documents, output_tax_documents, sum_of_field_k, sum_of_bad_debt_relief)
+
+	def output_tax_rows():
+		sum_of_field_k, sum_of_bad_debt_relief = get_empty_sums()
+
+		for row_number, document in enumerate(output_tax_documents, 1):
+			creator.create_jpk_output_tax_row(row_number, document, sum_of_field_k, sum_of_bad_debt_relief)
+
+	def input_tax_rows():
+		sum_of_field_k, sum_of_bad_debt_relief = get_empty_sums()
+
+		for row_number, document in enumerate(input_tax_documents, 1):
+			creator.create_jpk_input_tax_row(row_number, document, sum_of_field_k)
+
+	def validate_float():
+		for value in values:
+			creator.validate_float(value)
+
+	def declaration():
+		creator.create_jpk_declaration("1", list(sum_of_field_k), dict(sum_of_bad_debt_relief), "0", "")
+
+	def create_file():
+		root = creator.initialize_jpk()
+		root.append(evidence)
+
+		file_descriptor, file_name = tempfile.mkstemp(suffix = ".xml")
+		os.close(file_descriptor)
+
+		try:
+			creator.create_file(root, file_name)
+		finally:
+			os.remove(file_name)
+
+	def create_file_streaming():
+		file_descriptor, file_name = tempfile.mkstemp(suffix = ".xml")
+		os.close(file_descriptor)
+
+		try:
+			creator.create_file_streaming(
+				creator.initialize_jpk(),
+				[],
+				input_tax_documents,
+				output_tax_documents,
+				sum_of_field_k,
+				file_name
+				)
+		finally:
+			os.remove(file_name)
+
+	return {
+		"output_tax_rows": output_tax_rows,
+		"input_tax_rows": input_tax_rows,
+		"validate_float": validate_float,
+		"declaration": declaration,
+		"create_file": create_file,
+		"create_file_streaming": create_file_streaming
+		}
+
+
+def measure(function, repeat):
+	"""
+	Returns dict with the best and median time (in seconds) of given
+	number of runs of the function, and peak memory (in KB) allocated during
+	single run
+	"""
+
+	# warnings about wrong values are printed by tested functions
+	with contextlib.redirect_stdout(io.StringIO()):
+		times = timeit.Timer(function).repeat(repeat = repeat, number = 1)
+
+		# separate run, because tracemalloc slows down the code
+		tracemalloc.start()
+		try:
+			function()
+			peak = tracemalloc.get_traced_memory()[1]
+		finally:
+			tracemalloc.stop()
+
+	return {
+		"min": min(times),
+		"median": statistics.median(times),
+		"peak_kb": round(peak / 1024, 1)
+		}
+
+
+def run_benchmarks(sizes = None, repeat = default_repeat, names = None):
+	"""
+	Runs benchmarks for every number of documents. Returns dict with
+	information about environment and "results": {"name/size": measurement}.
+
+	Arguments:
+	- sizes: list of numbers of documents (default: default_sizes)
+	- repeat: number of runs of every benchmark
+	- names: list of names of benchmarks to run (default: all)
+	"""
+
+	results = {}
+
+	for size in sizes or default_sizes:
+		for name, function in get_benchmarks(size).items():
+			if names and name not in names:
+				continue
+
+			results[name + "/" + str(size)] = measure(function, repeat)
+
+	return {
+		"created": datetime.now().isoformat(timespec = "seconds"),
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"repeat": repeat,
+		"results": results
+		}
+
+
+def compare_results(baseline, current, threshold):
+	"""
+	Returns list of tuples (benchmark, baseline median, current median,
+	ratio, status) for benchmarks existing in both results. Status is
+	"slower" or "faster" if ratio differs from 1 by more than threshold.
+	"""
+
+	comparison = []
+
+	for key, measurement in current["results"].items():
+		baseline_measurement = baseline["results"].get(key)
+
+		if baseline_measurement is None:
+			continue
+
+		ratio = measurement["median"] / baseline_measurement["median"] if baseline_measurement["median"] else 1.0
+
+		if ratio > 1 + threshold:
+			status = "slower"
+		elif ratio < 1 - threshold:
+			status = "faster"
+		else:
+			status = ""
+
+		comparison.append((key, baseline_measurement["median"], measurement["median"], ratio, status))
+
+	return comparison
+
+
+def print_results(results):
+	"""
+	Prints table of results
+	"""
+
+	print("{0:<24}{1:>12}{2:>12}{3:>12}".format("benchmark", "min [ms]", "median [ms]", "peak [KB]"))
+
+	for key, measurement in results["results"].items():
+		print("{0:<24}{1:>12.3f}{2:>12.3f}{3:>12.1f}".format(
+			key,
+			measurement["min"] * 1000,
+			measurement["median"] * 1000,
+			measurement["peak_kb"]
+			))
+
+
+def print_comparison(comparison):
+	"""
+	Prints table of comparison with baseline
+	"""
+
+	print("{0:<24}{1:>14}{2:>14}{3:>8}".format("benchmark", "baseline [ms]", "current [ms]", "ratio"))
+
+	for key, baseline_median, current_median, ratio, status in comparison:
+		print("{0:<24}{1:>14.3f}{2:>14.3f}{3:>8.2f}  {4}".format(
+			key,
+			baseline_median * 1000,
+			current_median * 1000,
+			ratio,
+			status
+			))
+
+
+def get_argument_parser():
+	"""
+	Returns parser of command line arguments
+	"""
+
+	parser = argparse.ArgumentParser(description = "Micro-benchmarks of JPK_V7M XML creator.")
+	parser.add_argument("--sizes", type = int, nargs = "+", default = default_sizes, help = "numbers of documents (default: 100 1000 10000)")
+	parser.add_argument("--repeat", type = int, default = default_repeat, help = "number of runs of every benchmark (default: 5)")
+	parser.add_argument("--only", nargs = "+", default = None, help = "names of benchmarks to run (default: all)")
+	parser.add_argument("--save", default = None, help = "save results as baseline in given JSON file")
+	parser.add_argument("--compare", nargs = "?", const = default_baseline, default = None, help = "compare results with baseline from given JSON file (default: baseline.json in this folder)")
+	parser.add_argument("--threshold", type = float, default = 0.1, help = "allowed relative difference of median time (default: 0.1)")
+
+	return parser
+
+
+def main(argv = None):
+	"""
+	Command line interface. Returns exit code.
+	"""
+
+	args = get_argument_parser().parse_args(argv)
+
+	results = run_benchmarks(args.sizes, args.repeat, args.only)
+
+	print_results(results)
+
+	if args.save:
+		with open(args.save, "w") as f:
+			json.dump(results, f, indent = 2)
+
+		print("")
+		print("Baseline saved: " + args.save)
+
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+
+		comparison = compare_results(baseline, results, args.threshold)
+
+		print("")
+		print("Baseline: " + baseline["created"] + ", Python " + baseline["python"])
+		print_comparison(comparison)
+
+		if any(status == "slower" for key, baseline_median, current_median, ratio, status in comparison):
+			return 1
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -55,7 +55,7 @@ import os
 import gettext
 _ = gettext.gettext
 
-lang = os.environ['LANG']
+lang = os.environ.get('LANG', '')
 
 if lang[:2] == "pl":
 	# relative path doesn't work if you call script from e.g. parent directory
@@ -83,7 +83,10 @@ def create_jpk(
 	output_tax_documents = None,
 	amendment_reasons = None,
 	system_name = "jpk_v7m_creator.py",
-	file_name = None
+	file_name = None,
+	streaming = False,
+	preview_rows = None,
+	progress_callback = None
 	):
 	"""
 	Main function of JPK_V7M XML creator
@@ -129,6 +132,17 @@ def create_jpk(
 	- system_name (string) - name of application creating JPK
 	- file_name (string) - name for output file (with extension), or None if 
 	  file must not be created
+	- streaming (bool) - if True, the file is written row by row (see
+	  create_file_streaming) instead of building whole ElementTree in memory.
+	  Output file is the same, but peak memory doesn't depend on number of
+	  rows. Use for big number of documents.
+	- preview_rows (int) - number of rows of output and input tax evidence
+	  to show in console preview (see show_jpk_preview), -1 to show all rows,
+	  or None (default) if preview must not be shown
+	- progress_callback (function) - optional, used in streaming mode only.
+	  Called as progress_callback(phase, count) for every written row,
+	  where phase is "output_tax_rows" or "input_tax_rows" and count is 1.
+	  Can raise an exception to stop creation of the file.
 	"""
 
 	# ---- Check if guidance about legal consequences is accepted ---------
@@ -208,14 +222,30 @@ def create_jpk(
 		date_of_birth
 		)
 
+	# documents can be read more than once: for sums and rows in streaming
+	# mode, and for preview
+	if output_tax_documents is None:
+		output_tax_documents = get_output_tax_documents()
+
+	if input_tax_documents is None:
+		input_tax_documents = get_input_tax_documents()
+
 	# evidence must be processed before declaration
 	# to get required tax values
-	jpk_evidence = create_jpk_evidence(
-		input_tax_documents,
-		output_tax_documents,
-		sum_of_field_k,
-		sum_of_bad_debt_relief
-		)
+	if streaming:
+		add_jpk_evidence_sums(
+			input_tax_documents,
+			output_tax_documents,
+			sum_of_field_k,
+			sum_of_bad_debt_relief
+			)
+	else:
+		jpk_evidence = create_jpk_evidence(
+			input_tax_documents,
+			output_tax_documents,
+			sum_of_field_k,
+			sum_of_bad_debt_relief
+			)
 
 	jpk_declaration = create_jpk_declaration(
 		is_guidance_accepted,
@@ -235,21 +265,40 @@ def create_jpk(
 		system_name
 		)
 
-	# -------- put the parts of JPK together -----------
-	
-	# append parts to JPK in order defined in government brochure
-	# (I'm not sure if it's important, but it doesn't require any effort)
-	jpk_root.append(jpk_header)
-	jpk_root.append(jpk_entity)
-	jpk_root.append(jpk_declaration)
-	jpk_root.append(jpk_evidence)
+	if streaming:
+		if file_name is not None:
+			create_file_streaming(
+				jpk_root,
+				[jpk_header, jpk_entity, jpk_declaration],
+				input_tax_documents,
+				output_tax_documents,
+				sum_of_field_k,
+				file_name,
+				progress_callback
+				)
+	else:
+		# -------- put the parts of JPK together -----------
+
+		# append parts to JPK in order defined in government brochure
+		# (I'm not sure if it's important, but it doesn't require any effort)
+		jpk_root.append(jpk_header)
+		jpk_root.append(jpk_entity)
+		jpk_root.append(jpk_declaration)
+		jpk_root.append(jpk_evidence)
 
-	# ------- create xml file ------------
-	if file_name is not None:
-		create_file(jpk_root, file_name)
+		# ------- create xml file ------------
+		if file_name is not None:
+			create_file(jpk_root, file_name)
 
 	# just for preview - not required
-	show_xml(ET.tostring(jpk_root))
+	if preview_rows is not None:
+		show_jpk_preview(
+			[jpk_header, jpk_entity, jpk_declaration],
+			input_tax_documents,
+			output_tax_documents,
+			sum_of_field_k,
+			preview_rows
+			)
 
 
 def create_file(root, file_name):
@@ -266,6 +315,83 @@ def create_file(root, file_name):
 	tree.write(file_name, encoding="UTF-8", xml_declaration=True)
 
 
+def create_file_streaming(root, parts, input_tax_documents, output_tax_documents, sum_of_field_k, file_name, progress_callback = None):
+	"""
+	Write JPK into file with given name, element by element.
+
+	Evidence rows are serialized directly to strings (see
+	compile_row_serializer), so memory usage doesn't grow with number of
+	documents. The file is the same as written by create_file() for the
+	whole tree.
+
+	Arguments:
+	- root: empty root Element of JPK (see initialize_jpk)
+	- parts: list of Elements to be written before evidence (header, entity,
+	  declaration)
+	- input_tax_documents: list of dicts (see create_jpk_input_tax_row)
+	- output_tax_documents: list of dicts (see create_jpk_output_tax_row)
+	- sum_of_field_k: list of sums of K_ fields, already calculated for all
+	  documents (see add_jpk_evidence_sums)
+	- file_name: name of output file
+	- progress_callback: optional function called for every written row
+	  (see create_jpk)
+	"""
+
+	# same way of opening file as in ElementTree.write
+	with open(file_name, "w", encoding="UTF-8", errors="xmlcharrefreplace") as f:
+		f.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+
+		root_start, root_end = get_element_tags(root)
+		f.write(root_start)
+
+		for part in parts:
+			f.write(ET.tostring(part, encoding="unicode"))
+
+		# <tns:Ewidencja>
+		evidence_start, evidence_end = get_element_tags(ET.Element("tns:Ewidencja"))
+		f.write(evidence_start)
+
+		# rows in the same order as in create_jpk_evidence()
+		row_number = 0
+		for raw_row in output_tax_documents:
+			row_number += 1
+			f.write(serialize_output_tax_row(row_number, raw_row))
+			if progress_callback:
+				progress_callback("output_tax_rows", 1)
+
+		output_tax_total = get_output_tax_total(sum_of_field_k)
+		control = create_jpk_output_tax_control(row_number, output_tax_total)
+		f.write(ET.tostring(control, encoding="unicode"))
+
+		row_number = 0
+		for raw_row in input_tax_documents:
+			row_number += 1
+			f.write(serialize_input_tax_row(row_number, raw_row))
+			if progress_callback:
+				progress_callback("input_tax_rows", 1)
+
+		input_tax_total = get_input_tax_total(sum_of_field_k)
+		control = create_jpk_input_tax_control(row_number, input_tax_total)
+		f.write(ET.tostring(control, encoding="unicode"))
+
+		f.write(evidence_end)
+		f.write(root_end)
+
+
+def get_element_tags(element):
+	"""
+	Returns tuple of strings: start tag (with attributes) and end tag of given
+	Element without subelements and text.
+
+	Used for writing big elements part by part.
+	"""
+
+	end_tag = "</" + element.tag + ">"
+	xml = ET.tostring(element, encoding="unicode", short_empty_elements=False)
+
+	return xml[:-len(end_tag)], end_tag
+
+
 def get_is_guidance_accepted():
 	"""
 	Get information if the user accepted the guidance about legal
@@ -916,45 +1042,107 @@ def create_jpk_evidence(input_tax_documents, output_tax_documents, sum_of_field_
 
 	output_tax_rows = create_jpk_output_tax_rows(output_tax_documents, sum_of_field_k, sum_of_bad_debt_relief)
 
-	output_tax_total = sum_fields(sum_of_field_k, [16, 18, 20, 24, 26, 28, 30, 32, 33, 34]) - sum_fields(sum_of_field_k, [35, 36]) 
+	output_tax_total = get_output_tax_total(sum_of_field_k)
 
 	for row in output_tax_rows:
 		evidence_element.append(row)
 		output_rows_count += 1
 	else:
 		# <tns:SprzedazCtrl> - output tax control row
-		output_tax_control_element = ET.SubElement(evidence_element, "tns:SprzedazCtrl")
-
-		# <tns:LiczbaWierszySprzedazy>1</tns:LiczbaWierszySprzedazy>
-		output_rows_count_element = ET.SubElement(output_tax_control_element, "tns:LiczbaWierszySprzedazy")
-		output_rows_count_element.text = str(output_rows_count)
-		
-		# <tns:PodatekNalezny>0</tns:PodatekNalezny>
-		output_tax_total_element = ET.SubElement(output_tax_control_element, "tns:PodatekNalezny")
-		output_tax_total_element.text = str(output_tax_total)
+		evidence_element.append(create_jpk_output_tax_control(output_rows_count, output_tax_total))
 	
 	input_rows_count = 0
 
 	input_tax_rows = create_jpk_input_tax_rows(input_tax_documents, sum_of_field_k)
 
-	input_tax_total = sum_fields(sum_of_field_k, [41, 43, 44, 45, 46, 47])
+	input_tax_total = get_input_tax_total(sum_of_field_k)
 
 	for row in input_tax_rows:
 		evidence_element.append(row)
 		input_rows_count += 1
 	else:
 		# <tns:ZakupCtrl>
-		input_tax_control_element = ET.SubElement(evidence_element, "tns:ZakupCtrl")
+		evidence_element.append(create_jpk_input_tax_control(input_rows_count, input_tax_total))
 
-		# <tns:LiczbaWierszyZakupow>1</tns:LiczbaWierszyZakupow>
-		input_rows_count_element = ET.SubElement(input_tax_control_element, "tns:LiczbaWierszyZakupow")
-		input_rows_count_element.text = str(input_rows_count)
+	return evidence_element
 
-		# <tns:PodatekNaliczony>0</tns:PodatekNaliczony>
-		input_tax_total_element = ET.SubElement(input_tax_control_element, "tns:PodatekNaliczony")
-		input_tax_total_element.text = str(input_tax_total)
 
-	return evidence_element
+def add_jpk_evidence_sums(input_tax_documents, output_tax_documents, sum_of_field_k, sum_of_bad_debt_relief):
+	"""
+	Add values of K_ fields of all documents to the sums, without creating
+	any Elements.
+
+	Gives the same sums as create_jpk_evidence(). Used when evidence rows are
+	written directly into file (see create_file_streaming).
+	"""
+
+	for raw_row in output_tax_documents:
+		add_output_tax_row_sums(raw_row, sum_of_field_k, sum_of_bad_debt_relief)
+
+	for raw_row in input_tax_documents:
+		add_input_tax_row_sums(raw_row, sum_of_field_k)
+
+
+def get_output_tax_total(sum_of_field_k):
+	"""
+	Returns total output tax for output tax control row
+	"""
+
+	return sum_fields(sum_of_field_k, [16, 18, 20, 24, 26, 28, 30, 32, 33, 34]) - sum_fields(sum_of_field_k, [35, 36])
+
+
+def get_input_tax_total(sum_of_field_k):
+	"""
+	Returns total input tax for input tax control row
+	"""
+
+	return sum_fields(sum_of_field_k, [41, 43, 44, 45, 46, 47])
+
+
+def create_jpk_output_tax_control(rows_count, output_tax_total):
+	"""
+	Create Element of output tax control row
+
+	Arguments:
+	- rows_count: number of output tax rows
+	- output_tax_total: total output tax (see get_output_tax_total)
+	"""
+
+	# <tns:SprzedazCtrl> - output tax control row
+	output_tax_control_element = ET.Element("tns:SprzedazCtrl")
+
+	# <tns:LiczbaWierszySprzedazy>1</tns:LiczbaWierszySprzedazy>
+	output_rows_count_element = ET.SubElement(output_tax_control_element, "tns:LiczbaWierszySprzedazy")
+	output_rows_count_element.text = str(rows_count)
+	
+	# <tns:PodatekNalezny>0</tns:PodatekNalezny>
+	output_tax_total_element = ET.SubElement(output_tax_control_element, "tns:PodatekNalezny")
+	output_tax_total_element.text = str(output_tax_total)
+
+	return output_tax_control_element
+
+
+def create_jpk_input_tax_control(rows_count, input_tax_total):
+	"""
+	Create Element of input tax control row
+
+	Arguments:
+	- rows_count: number of input tax rows
+	- input_tax_total: total input tax (see get_input_tax_total)
+	"""
+
+	# <tns:ZakupCtrl>
+	input_tax_control_element = ET.Element("tns:ZakupCtrl")
+
+	# <tns:LiczbaWierszyZakupow>1</tns:LiczbaWierszyZakupow>
+	input_rows_count_element = ET.SubElement(input_tax_control_element, "tns:LiczbaWierszyZakupow")
+	input_rows_count_element.text = str(rows_count)
+
+	# <tns:PodatekNaliczony>0</tns:PodatekNaliczony>
+	input_tax_total_element = ET.SubElement(input_tax_control_element, "tns:PodatekNaliczony")
+	input_tax_total_element.text = str(input_tax_total)
+
+	return input_tax_control_element
 
 
 def create_jpk_input_tax_rows(documents, sum_of_field_k):
@@ -1014,8 +1202,8 @@ def get_input_tax_document():
 	Get data of input tax document in form of a dict.
 
 	Return:
-	- data of tax document as dict with keys according to element_names dict
-	  declared in create_jpk_input_tax_row()
+	- data of tax document as dict with keys according to
+	  input_tax_row_fields
 	- None if no more documents
 	"""
 
@@ -1089,6 +1277,97 @@ def get_input_tax_document():
 	return doc
 
 
+# Keys of evidence row dicts and names of corresponding elements, in order
+# required by the schema (JPK_V7M (1), wersjaSchemy 1-2E). Used by row
+# elements and compiled row serializers (see compile_row_serializer).
+
+output_tax_row_fields = (
+	("party_country_code", "tns:KodKrajuNadaniaTIN"),
+	("party_tax_id", "tns:NrKontrahenta"),
+	("party_name", "tns:NazwaKontrahenta"),
+	("document_number", "tns:DowodSprzedazy"),
+	("document_date", "tns:DataWystawienia"),
+	("sales_date", "tns:DataSprzedazy"),
+	("document_type", "tns:TypDokumentu"),
+	("gtu_01", "tns:GTU_01"),
+	("gtu_02", "tns:GTU_02"),
+	("gtu_03", "tns:GTU_03"),
+	("gtu_04", "tns:GTU_04"),
+	("gtu_05", "tns:GTU_05"),
+	("gtu_06", "tns:GTU_06"),
+	("gtu_07", "tns:GTU_07"),
+	("gtu_08", "tns:GTU_08"),
+	("gtu_09", "tns:GTU_09"),
+	("gtu_10", "tns:GTU_10"),
+	("gtu_11", "tns:GTU_11"),
+	("gtu_12", "tns:GTU_12"),
+	("gtu_13", "tns:GTU_13"),
+	("sw", "tns:SW"),
+	("ee", "tns:EE"),
+	("tp", "tns:TP"),
+	("tt_wnt", "tns:TT_WNT"),
+	("tt_d", "tns:TT_D"),
+	("mr_t", "tns:MR_T"),
+	("mr_uz", "tns:MR_UZ"),
+	("i_42", "tns:I_42"),
+	("i_63", "tns:I_63"),
+	("b_spv", "tns:B_SPV"),
+	("b_spv_dostawa", "tns:B_SPV_DOSTAWA"),
+	("b_mpv_prowizja", "tns:B_MPV_PROWIZJA"),
+	("split_payment", "tns:MPP"),
+	("tax_base_amendment", "tns:KorektaPodstawyOpodt"),
+	("k_10", "tns:K_10"),
+	("k_11", "tns:K_11"),
+	("k_12", "tns:K_12"),
+	("k_13", "tns:K_13"),
+	("k_14", "tns:K_14"),
+	("k_15", "tns:K_15"),
+	("k_16", "tns:K_16"),
+	("k_17", "tns:K_17"),
+	("k_18", "tns:K_18"),
+	("k_19", "tns:K_19"),
+	("k_20", "tns:K_20"),
+	("k_21", "tns:K_21"),
+	("k_22", "tns:K_22"),
+	("k_23", "tns:K_23"),
+	("k_24", "tns:K_24"),
+	("k_25", "tns:K_25"),
+	("k_26", "tns:K_26"),
+	("k_27", "tns:K_27"),
+	("k_28", "tns:K_28"),
+	("k_29", "tns:K_29"),
+	("k_30", "tns:K_30"),
+	("k_31", "tns:K_31"),
+	("k_32", "tns:K_32"),
+	("k_33", "tns:K_33"),
+	("k_34", "tns:K_34"),
+	("k_35", "tns:K_35"),
+	("k_36", "tns:K_36"),
+	("vat_margin", "tns:SprzedazVAT_Marza")
+	)
+
+input_tax_row_fields = (
+	("party_country_code", "tns:KodKrajuNadaniaTIN"),
+	("party_tax_id", "tns:NrDostawcy"),
+	("party_name", "tns:NazwaDostawcy"),
+	("document_number", "tns:DowodZakupu"),
+	("document_date", "tns:DataZakupu"),
+	("document_receipt_date", "tns:DataWplywu"),
+	("document_type", "tns:DokumentZakupu"),
+	("split_payment", "tns:MPP"),
+	("import", "tns:IMP"),
+	("k_40", "tns:K_40"),
+	("k_41", "tns:K_41"),
+	("k_42", "tns:K_42"),
+	("k_43", "tns:K_43"),
+	("k_44", "tns:K_44"),
+	("k_45", "tns:K_45"),
+	("k_46", "tns:K_46"),
+	("k_47", "tns:K_47"),
+	("vat_margin", "tns:ZakupVAT_Marza")
+	)
+
+
 def create_jpk_element_if_key_exist(data, key, name):
 	"""
 	Create ElementTree.Element if the given key exists in the given dict and
@@ -1111,9 +1390,69 @@ def create_jpk_element_if_key_exist(data, key, name):
 		return new_element
 
 
+def compile_row_serializer(row_name, row_number_name, fields):
+	"""
+	Returns function serialize_row(row_number, raw_row), which returns XML
+	of evidence row as string - the same as ElementTree.tostring of the
+	element created by create_jpk_{output|input}_tax_row_element.
+
+	Start and end tags of all elements are built once, so serializing a row
+	only joins strings of fields present in the row, without creating
+	Elements.
+
+	Arguments:
+	- row_name: name of row element, e.g. "tns:SprzedazWiersz"
+	- row_number_name: name of row number element, e.g. "tns:LpSprzedazy"
+	- fields: tuple of (key, element name), e.g. output_tax_row_fields
+	"""
+
+	row_start = "<" + row_name + "><" + row_number_name + ">"
+	row_number_end = "</" + row_number_name + ">"
+	row_end = "</" + row_name + ">"
+
+	tags = tuple((key, "<" + name + ">", "</" + name + ">") for key, name in fields)
+
+	def serialize_row(row_number, raw_row):
+		get = raw_row.get
+		parts = [row_start, str(row_number), row_number_end]
+
+		# the same condition as in create_jpk_element_if_key_exist
+		for key, start_tag, end_tag in tags:
+			value = get(key)
+			if value:
+				parts += (start_tag, escape_xml_text(str(value)), end_tag)
+
+		parts.append(row_end)
+
+		return "".join(parts)
+
+	return serialize_row
+
+
+def escape_xml_text(text):
+	"""
+	Escapes text of XML element the same way as ElementTree does
+	"""
+
+	if "&" in text:
+		text = text.replace("&", "&amp;")
+	if "<" in text:
+		text = text.replace("<", "&lt;")
+	if ">" in text:
+		text = text.replace(">", "&gt;")
+
+	return text
+
+
+# Serializers of evidence rows, compiled once (see create_file_streaming)
+serialize_output_tax_row = compile_row_serializer("tns:SprzedazWiersz", "tns:LpSprzedazy", output_tax_row_fields)
+serialize_input_tax_row = compile_row_serializer("tns:ZakupWiersz", "tns:LpZakupu", input_tax_row_fields)
+
+
 def create_jpk_input_tax_row(row_number, raw_row, sum_of_field_k):
 	"""
 	Creates ElementTree.Element containing data of single input tax document
+	and adds its K_ values to the sums.
 
 	Converts data in form of dict in ElementTree.Element with subelements.
 
@@ -1121,41 +1460,50 @@ def create_jpk_input_tax_row(row_number, raw_row, sum_of_field_k):
 	- row_number: consecutive number of row
 	- raw_row: dict containing data of single input tax document
 
+	Returns element containing input tax row data
+	"""
+
+	input_tax_row_element = create_jpk_input_tax_row_element(row_number, raw_row)
+
+	add_input_tax_row_sums(raw_row, sum_of_field_k)
+
+	return input_tax_row_element
+
+
+def create_jpk_input_tax_row_element(row_number, raw_row):
+	"""
+	Creates ElementTree.Element containing data of single input tax document
+
+	Arguments:
+	- row_number: consecutive number of row
+	- raw_row: dict containing data of single input tax document
+
 	Returns element containing input tax row data
 	"""
 	
 	input_tax_row_element = ET.Element("tns:ZakupWiersz")
 
-	element_names = {
-		"party_country_code": "tns:KodKrajuNadaniaTIN",
-		"party_tax_id": "tns:NrDostawcy",
-		"party_name": "tns:NazwaDostawcy",
-		"document_number": "tns:DowodZakupu",
-		"document_date": "tns:DataZakupu",
-		"document_receipt_date": "tns:DataWplywu",
-		"document_type": "tns:DokumentZakupu",
-		"split_payment": "tns:MPP",
-		"import": "tns:IMP",
-		"k_40": "tns:K_40",
-		"k_41": "tns:K_41",
-		"k_42": "tns:K_42",
-		"k_43": "tns:K_43",
-		"k_44": "tns:K_44",
-		"k_45": "tns:K_45",
-		"k_46": "tns:K_46",
-		"k_47": "tns:K_47",
-		"vat_margin": "tns:ZakupVAT_Marza"
-	}
-		
 	# <tns:LpZakupu>1</tns:LpZakupu>
 	row_number_element = ET.SubElement(input_tax_row_element, "tns:LpZakupu")
 	row_number_element.text = str(row_number)
 
-	for key in element_names:
-		el = create_jpk_element_if_key_exist(raw_row, key, element_names[key])
+	for key, name in input_tax_row_fields:
+		el = create_jpk_element_if_key_exist(raw_row, key, name)
 		if el is not None:
 			input_tax_row_element.append(el)
 
+	return input_tax_row_element
+
+
+def add_input_tax_row_sums(raw_row, sum_of_field_k):
+	"""
+	Adds values of K_40 - K_47 fields of single input tax document to the sums
+
+	Arguments:
+	- raw_row: dict containing data of single input tax document
+	- sum_of_field_k: list of sums of K_ fields
+	"""
+
 	for i in range(40, 48):
 		tax = raw_row.get("k_" + str(i), 0.0)
 
@@ -1165,13 +1513,11 @@ def create_jpk_input_tax_row(row_number, raw_row, sum_of_field_k):
 		elif isinstance(tax, int) or isinstance(tax, float):
 			sum_of_field_k[i] += tax
 
-	return input_tax_row_element
-
 
 def create_jpk_output_tax_row(row_number, raw_row, sum_of_field_k, sum_of_bad_debt_relief):
 	"""
 	Creates ElementTree.Element containing data of single output tax
-	document.
+	document and adds its K_ values to the sums.
 
 	Converts data in form of dict into ElementTree.Element with subelements.
 
@@ -1179,84 +1525,52 @@ def create_jpk_output_tax_row(row_number, raw_row, sum_of_field_k, sum_of_bad_de
 	- row_number: consecutive number of row
 	- raw_row: data of single output tax document as dict
 
+	Returns element containing output tax row data
+	"""
+
+	output_tax_row_element = create_jpk_output_tax_row_element(row_number, raw_row)
+
+	add_output_tax_row_sums(raw_row, sum_of_field_k, sum_of_bad_debt_relief)
+
+	return output_tax_row_element
+
+
+def create_jpk_output_tax_row_element(row_number, raw_row):
+	"""
+	Creates ElementTree.Element containing data of single output tax
+	document.
+
+	Arguments:
+	- row_number: consecutive number of row
+	- raw_row: data of single output tax document as dict
+
 	Returns element containing output tax row data
 	"""
 	
 	output_tax_row_element = ET.Element("tns:SprzedazWiersz")
 
-	element_names = {
-		"party_country_code": "tns:KodKrajuNadaniaTIN",
-		"party_tax_id": "tns:NrKontrahenta",
-		"party_name": "tns:NazwaKontrahenta",
-		"document_number": "tns:DowodSprzedazy",
-		"document_date": "tns:DataWystawienia",
-		"sales_date": "tns:DataSprzedazy",
-		"document_type": "tns:TypDokumentu",
-		"gtu_01": "tns:GTU_01",
-		"gtu_02": "tns:GTU_02",
-		"gtu_03": "tns:GTU_03",
-		"gtu_04": "tns:GTU_04",
-		"gtu_05": "tns:GTU_05",
-		"gtu_06": "tns:GTU_06",
-		"gtu_07": "tns:GTU_07",
-		"gtu_08": "tns:GTU_08",
-		"gtu_09": "tns:GTU_09",
-		"gtu_10": "tns:GTU_10",
-		"gtu_11": "tns:GTU_11",
-		"gtu_12": "tns:GTU_12",
-		"gtu_13": "tns:GTU_13",
-		"sw": "tns:SW",
-		"ee": "tns:EE",
-		"tp": "tns:TP",
-		"tt_wnt": "tns:TT_WNT",
-		"tt_d": "tns:TT_D",
-		"mr_t": "tns:MR_T",
-		"mr_uz": "tns:MR_UZ",
-		"i_42": "tns:I_42",
-		"i_63": "tns:I_63",
-		"b_spv": "tns:B_SPV",
-		"b_spv_dostawa": "tns:B_SPV_DOSTAWA",
-		"b_mpv_prowizja": "tns:B_MPV_PROWIZJA",
-		"split_payment": "tns:MPP",
-		"tax_base_amendment": "tns:KorektaPodstawyOpodt",
-		"k_10": "tns:K_10",
-		"k_11": "tns:K_11",
-		"k_12": "tns:K_12",
-		"k_13": "tns:K_13",
-		"k_14": "tns:K_14",
-		"k_15": "tns:K_15",
-		"k_16": "tns:K_16",
-		"k_17": "tns:K_17",
-		"k_18": "tns:K_18",
-		"k_19": "tns:K_19",
-		"k_20": "tns:K_20",
-		"k_21": "tns:K_21",
-		"k_22": "tns:K_22",
-		"k_23": "tns:K_23",
-		"k_24": "tns:K_24",
-		"k_25": "tns:K_25",
-		"k_26": "tns:K_26",
-		"k_27": "tns:K_27",
-		"k_28": "tns:K_28",
-		"k_29": "tns:K_29",
-		"k_30": "tns:K_30",
-		"k_31": "tns:K_31",
-		"k_32": "tns:K_32",
-		"k_33": "tns:K_33",
-		"k_34": "tns:K_34",
-		"k_35": "tns:K_35",
-		"k_36": "tns:K_36",
-		"vat_margin": "tns:SprzedazVAT_Marza"
-	}
-		
 	row_number_element = ET.SubElement(output_tax_row_element, "tns:LpSprzedazy")
 	row_number_element.text = str(row_number)
 
-	for key in element_names:
-		el = create_jpk_element_if_key_exist(raw_row, key, element_names[key])
+	for key, name in output_tax_row_fields:
+		el = create_jpk_element_if_key_exist(raw_row, key, name)
 		if el is not None:
 			output_tax_row_element.append(el)
 
+	return output_tax_row_element
+
+
+def add_output_tax_row_sums(raw_row, sum_of_field_k, sum_of_bad_debt_relief):
+	"""
+	Adds values of K_10 - K_36 fields of single output tax document to the
+	sums, including sums for bad debt relief.
+
+	Arguments:
+	- raw_row: data of single output tax document as dict
+	- sum_of_field_k: list of sums of K_ fields
+	- sum_of_bad_debt_relief: dict with sums of amended net and tax
+	"""
+
 	bad_debt_relief = False
 	if raw_row.get("tax_base_amendment") == "1":
 		bad_debt_relief = True
@@ -1286,8 +1600,6 @@ def create_jpk_output_tax_row(row_number, raw_row, sum_of_field_k, sum_of_bad_de
 				elif i in [16, 18, 20]:
 					sum_of_bad_debt_relief["tax"] += tax_as_float
 
-	return output_tax_row_element
-
 
 def validate_float(data):
 	"""
@@ -1373,8 +1685,8 @@ def get_output_tax_document():
 	Get data of output tax document in form of dict.
 
 	Return:
-	- data of tax document as dict with keys according to element_names dict
-	  declared in create_jpk_output_tax_row()
+	- data of tax document as dict with keys according to
+	  output_tax_row_fields
 	- None if no more documents
 	"""
 
@@ -1514,6 +1826,54 @@ def create_jpk_declaration(is_guidance_accepted, sum_of_field_k, sum_of_bad_debt
 	Return Element containing all required declaration data
 	"""
 
+	# <tns:Deklaracja>
+	declaration_element = ET.Element("tns:Deklaracja")
+
+	declaration_header_element = create_jpk_declaration_header()
+	declaration_element.append(declaration_header_element)
+
+	declaration_details_element = ET.SubElement(declaration_element, "tns:PozycjeSzczegolowe")
+
+	p_value = calculate_declaration_fields(sum_of_field_k, sum_of_bad_debt_relief, forwarded_excess_of_input_tax)
+
+	# create P_{number} elements with calculated values
+	# IMPORTANT! Government server does not accept xml if elements are in
+	# different order. They have to be sorted ascending.
+	for number, value in sorted(p_value.items()):
+		p = create_p_element(number, value)
+		if p is not None:
+			declaration_details_element.append(p)
+
+	# P_ORDZU - optional, description of reasons for amendments
+	if amendment_reasons:
+		p = create_p_element("ORDZU", amendment_reasons)
+		if p is not None:
+			declaration_details_element.append(p)
+
+	# <tns:Pouczenia>1</tns:Pouczenia>
+	guidance_element = ET.SubElement(declaration_element, "tns:Pouczenia")
+	guidance_element.text = is_guidance_accepted
+
+	return declaration_element
+
+
+def calculate_declaration_fields(sum_of_field_k, sum_of_bad_debt_relief, forwarded_excess_of_input_tax = "0"):
+	"""
+	Calculates values of declaration fields P_{number}
+
+	Doesn't depend on evidence rows, only on their sums, so it can be used
+	for preview of declaration (without creating JPK).
+
+	Arguments:
+	- sum_of_field_k - list containing sum of values of fields named
+	  tns:K_{number}
+	- sum_of_bad_debt_relief: dict with sums of amended net and tax
+	- forwarded_excess_of_input_tax (string) - amount of excess of input tax
+	  over output tax carried forward from previous period
+
+	Return dict: number of P_ field -> value (integer)
+	"""
+
 	# TODO: Add code for fields:
 	# P_49, P_50, P_52, P_54 up to P_61, P_63 up to P_69, P_ORDZU
 
@@ -1528,14 +1888,6 @@ def create_jpk_declaration(is_guidance_accepted, sum_of_field_k, sum_of_bad_debt
 	# so 0.001 should be good enough
 	
 	
-	# <tns:Deklaracja>
-	declaration_element = ET.Element("tns:Deklaracja")
-
-	declaration_header_element = create_jpk_declaration_header()
-	declaration_element.append(declaration_header_element)
-
-	declaration_details_element = ET.SubElement(declaration_element, "tns:PozycjeSzczegolowe")
-
 	# fields P_10-P_36 and P_40-P_47 are sum of K_ fields with the same number (P_10 = sum of all K_10, etc.)
 	p_from_k = list(range(10, 37)) + list(range(40,48))
 	p_value = {}
@@ -1609,25 +1961,7 @@ def create_jpk_declaration(is_guidance_accepted, sum_of_field_k, sum_of_bad_debt
 	# (using fix for "banker's rounding" issue as previously)
 	p_value[69] = round(sum_of_bad_debt_relief["tax"] + 0.00001)
 
-	# create P_{number} elements with calculated values
-	# IMPORTANT! Government server does not accept xml if elements are in
-	# different order. They have to be sorted ascending.
-	for number, value in sorted(p_value.items()):
-		p = create_p_element(number, value)
-		if p is not None:
-			declaration_details_element.append(p)
-
-	# P_ORDZU - optional, description of reasons for amendments
-	if amendment_reasons:
-		p = create_p_element("ORDZU", amendment_reasons)
-		if p is not None:
-			declaration_details_element.append(p)
-
-	# <tns:Pouczenia>1</tns:Pouczenia>
-	guidance_element = ET.SubElement(declaration_element, "tns:Pouczenia")
-	guidance_element.text = is_guidance_accepted
-
-	return declaration_element
+	return p_value
 
 
 def create_p_element(number, value):
@@ -1691,6 +2025,50 @@ def initialize_list(list_name, number_of_fields, value):
 		list_name.append(value)
 
 
+def show_jpk_preview(parts, input_tax_documents, output_tax_documents, sum_of_field_k, preview_rows):
+	"""
+	Show formatted JPK in console, with limited number of evidence rows.
+
+	Preview is built separately from the JPK written to the file, so only
+	the shown rows are created and serialized again.
+
+	Arguments:
+	- parts: list of Elements before evidence (header, entity, declaration)
+	- input_tax_documents: list of dicts (see create_jpk_input_tax_row)
+	- output_tax_documents: list of dicts (see create_jpk_output_tax_row)
+	- sum_of_field_k: list of sums of K_ fields for all documents
+	- preview_rows: max number of shown rows of output and input tax
+	  evidence, or -1 to show all rows
+	"""
+
+	if preview_rows < 0:
+		preview_rows = None
+
+	preview_root = initialize_jpk()
+
+	for part in parts:
+		preview_root.append(part)
+
+	evidence_element = ET.SubElement(preview_root, "tns:Ewidencja")
+
+	row_number = 0
+	for raw_row in output_tax_documents[:preview_rows]:
+		row_number += 1
+		evidence_element.append(create_jpk_output_tax_row_element(row_number, raw_row))
+
+	# control rows contain values for all documents, not only shown
+	evidence_element.append(create_jpk_output_tax_control(len(output_tax_documents), get_output_tax_total(sum_of_field_k)))
+
+	row_number = 0
+	for raw_row in input_tax_documents[:preview_rows]:
+		row_number += 1
+		evidence_element.append(create_jpk_input_tax_row_element(row_number, raw_row))
+
+	evidence_element.append(create_jpk_input_tax_control(len(input_tax_documents), get_input_tax_total(sum_of_field_k)))
+
+	show_xml(ET.tostring(preview_root))
+
+
 def show_xml(element_to_show):
 	"""
 	Show formatted XML in console
@@ -1729,6 +2107,6 @@ create_jpk(
 
 # for release
 if __name__ == '__main__':
-    create_jpk()
+    create_jpk(preview_rows = -1)
 
 #'''
@@ -0,0 +1,146 @@
+# coding=UTF-8
+"""
+Tests of JPK_V7M XML creator, without ERPNext
+
+Run from this folder:
+python3 -m unittest test_jpk_v7m_creator
+"""
+
+import contextlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+try:
+	from . import jpk_v7m_creator as creator
+	from .benchmark_creator import generate_input_tax_documents, generate_output_tax_documents
+except ImportError:
+	# called as a script
+	import jpk_v7m_creator as creator
+	from benchmark_creator import generate_input_tax_documents, generate_output_tax_documents
+
+# Seed of random generator of documents
+seed = 2021
+
+# Text with characters escaped in XML
+special_text = "A & B <sp. z o.o.> \"C\" 'D' ąę & &amp;"
+
+
+class TestStreaming(unittest.TestCase):
+
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+	def create_files(self, count):
+		"""
+		Writes the same JPK for count generated documents of every kind with
+		create_file and create_file_streaming, and returns contents of both
+		files (bytes)
+		"""
+
+		rng = random.Random(seed)
+		output_tax_documents = generate_output_tax_documents(count, rng)
+		input_tax_documents = generate_input_tax_documents(count, rng)
+
+		sum_of_field_k = []
+		creator.initialize_list(sum_of_field_k, 48, 0.0)
+		sum_of_bad_debt_relief = {"net": 0, "tax": 0}
+
+		streaming_sum_of_field_k = []
+		creator.initialize_list(streaming_sum_of_field_k, 48, 0.0)
+		streaming_sum_of_bad_debt_relief = {"net": 0, "tax": 0}
+
+		# warnings about wrong values are printed
+		with contextlib.redirect_stdout(io.StringIO()):
+			evidence = creator.create_jpk_evidence(input_tax_documents, output_tax_documents, sum_of_field_k, sum_of_bad_debt_relief)
+			creator.add_jpk_evidence_sums(input_tax_documents, output_tax_documents, streaming_sum_of_field_k, streaming_sum_of_bad_debt_relief)
+
+		self.assertEqual(streaming_sum_of_field_k, sum_of_field_k)
+		self.assertEqual(streaming_sum_of_bad_debt_relief, sum_of_bad_debt_relief)
+
+		parts = [
+			creator.create_jpk_header("1", "1471", "7", "2021", special_text, datetime(2021, 8, 10, 12, 30)),
+			creator.create_jpk_entity("0", "5260250274", "jpk@example.com", full_name = special_text),
+			creator.create_jpk_declaration("1", sum_of_field_k, sum_of_bad_debt_relief, "0", "")
+			]
+
+		streaming_file_name = os.path.join(self.folder, "streaming.xml")
+		creator.create_file_streaming(
+			creator.initialize_jpk(),
+			parts,
+			input_tax_documents,
+			output_tax_documents,
+			sum_of_field_k,
+			streaming_file_name
+			)
+
+		root = creator.initialize_jpk()
+		for part in parts:
+			root.append(part)
+		root.append(evidence)
+
+		file_name = os.path.join(self.folder, "tree.xml")
+		creator.create_file(root, file_name)
+
+		with open(streaming_file_name, "rb") as f:
+			streaming_content = f.read()
+
+		with open(file_name, "rb") as f:
+			content = f.read()
+
+		return streaming_content, content
+
+	def test_streaming_file_is_the_same(self):
+		for count in (0, 1, 500):
+			streaming_content, content = self.create_files(count)
+			self.assertEqual(streaming_content, content, "{0} documents".format(count))
+
+
+class TestRowSerializers(unittest.TestCase):
+
+	def assert_same_xml(self, serialize_row, create_row_element, documents):
+		for row_number, document in enumerate(documents, 1):
+			expected = ET.tostring(create_row_element(row_number, document), encoding = "unicode")
+			self.assertEqual(serialize_row(row_number, document), expected)
+
+	def get_special_documents(self, documents, fields):
+		"""
+		Returns copies of documents with special_text in every field (one
+		field at a time)
+		"""
+
+		special_documents = []
+
+		for document in documents:
+			for key, name in fields:
+				document = dict(document)
+				document[key] = special_text
+				special_documents.append(document)
+
+		return special_documents
+
+	def test_output_tax_row(self):
+		documents = generate_output_tax_documents(200, random.Random(seed))
+		documents += self.get_special_documents(documents[:3], creator.output_tax_row_fields)
+		documents += [{}, {"party_name": 0, "k_10": 0.0, "k_11": "", "document_number": 12}]
+
+		self.assert_same_xml(creator.serialize_output_tax_row, creator.create_jpk_output_tax_row_element, documents)
+
+	def test_input_tax_row(self):
+		documents = generate_input_tax_documents(200, random.Random(seed))
+		documents += self.get_special_documents(documents[:3], creator.input_tax_row_fields)
+		documents += [{}, {"party_name": 0, "k_40": 0.0, "k_41": "", "document_number": 12}]
+
+		self.assert_same_xml(creator.serialize_input_tax_row, creator.create_jpk_input_tax_row_element, documents)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,167 @@
+# coding=UTF-8
+"""
+Tests of MF XSD Extractor
+
+Run from this folder:
+python3 -m unittest test_xsd_extractor
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+import xsd_extractor
+
+
+# XSD similar to files of Ministry of Finance: named types in two
+# namespaces, nested named types, documentation in pl & en, enumerations
+# without documentation and restrictions without enumerations
+sample_xsd = """<?xml version="1.0" encoding="UTF-8"?>
+<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:etd="http://crd.gov.pl/xml/schematy/dziedzinowe/mf/2020/03/11/eD/DefinicjeTypy/" targetNamespace="http://crd.gov.pl/xml/schematy/dziedzinowe/mf/2020/03/11/eD/DefinicjeTypy/">
+        <xsd:simpleType name="TKodKraju">
+                <xsd:annotation>
+                        <xsd:documentation>Słownik kodów krajów</xsd:documentation>
+                </xsd:annotation>
+                <xsd:restriction base="xsd:normalizedString">
+                        <xsd:enumeration value="PL">
+                                <xsd:annotation>
+                                        <xsd:documentation>POLSKA</xsd:documentation>
+                                        <xsd:documentation xml:lang="en">POLAND</xsd:documentation>
+                                </xsd:annotation>
+                        </xsd:enumeration>
+                        <xsd:enumeration value="BA">
+                                <xsd:annotation>
+                                        <xsd:documentation>BOŚNIA I HERCEGOWINA</xsd:documentation>
+                                </xsd:annotation>
+                        </xsd:enumeration>
+                        <xsd:enumeration value="XX"/>
+                </xsd:restriction>
+        </xsd:simpleType>
+        <xsd:simpleType name="TNrNIP">
+                <xsd:restriction base="xsd:token">
+                        <xsd:pattern value="[1-9]((\\d[1-9])|([1-9]\\d))\\d{7}"/>
+                </xsd:restriction>
+        </xsd:simpleType>
+        <xsd:complexType name="TUrzad">
+                <xsd:sequence>
+                        <xsd:element name="KodUrzedu">
+                                <xsd:simpleType>
+                                        <xsd:restriction base="xsd:string">
+                                                <xsd:enumeration value="0202">
+                                                        <xsd:annotation>
+                                                                <xsd:documentation>URZĄD SKARBOWY W BIELAWIE</xsd:documentation>
+                                                        </xsd:annotation>
+                                                </xsd:enumeration>
+                                        </xsd:restriction>
+                                </xsd:simpleType>
+                        </xsd:element>
+                        <xsd:element name="Rodzaj">
+                                <xsd:simpleType name="TRodzaj">
+                                        <xsd:restriction base="xsd:byte">
+                                                <xsd:enumeration value="1">
+                                                        <xsd:annotation>
+                                                                <xsd:documentation>pierwszy</xsd:documentation>
+                                                        </xsd:annotation>
+                                                </xsd:enumeration>
+                                                <xsd:enumeration value="2">
+                                                        <xsd:annotation>
+                                                                <xsd:documentation>drugi</xsd:documentation>
+                                                        </xsd:annotation>
+                                                </xsd:enumeration>
+                                        </xsd:restriction>
+                                </xsd:simpleType>
+                        </xsd:element>
+                </xsd:sequence>
+        </xsd:complexType>
+        <etd:simpleType name="TCelZlozenia">
+                <etd:restriction base="xsd:byte">
+                        <etd:enumeration value="1">
+                                <etd:annotation>
+                                        <etd:documentation>złożenie deklaracji</etd:documentation>
+                                </etd:annotation>
+                        </etd:enumeration>
+                </etd:restriction>
+        </etd:simpleType>
+</xsd:schema>
+"""
+
+expected_restrictions = {
+        "TKodKraju": {"PL": "POLSKA", "BA": "BOŚNIA I HERCEGOWINA"},
+        "TRodzaj": {"1": "pierwszy", "2": "drugi"},
+        "TCelZlozenia": {"1": "złożenie deklaracji"}
+        }
+
+
+def reference_extract_documented_restrictions(file_name, polish_title_case = False):
+        """
+        Returns restrictions extracted by searching the whole tree for every
+        namespace (implementation used before single-pass extraction)
+        """
+
+        tree = ET.parse(file_name)
+        ns_dict = xsd_extractor.get_xmlns_dict(file_name)
+
+        restrictions = {}
+
+        for restricted_node in xsd_extractor.find_ns_subelements(tree, "restriction/..", ns_dict):
+                if "name" not in restricted_node.attrib:
+                        continue
+
+                type_restrictions = {}
+
+                for restriction_node in xsd_extractor.find_ns_subelements(restricted_node, "restriction", ns_dict):
+                        for r in restriction_node:
+                                doc_nodes = xsd_extractor.find_ns_subelements(r, "documentation", ns_dict)
+                                if doc_nodes:
+                                        doc = doc_nodes[0].text
+                                        if polish_title_case:
+                                                doc = xsd_extractor.change_case(doc)
+
+                                        type_restrictions[r.attrib["value"]] = doc
+
+                if len(type_restrictions):
+                        restrictions[restricted_node.attrib["name"]] = type_restrictions
+
+        return restrictions
+
+
+class TestExtraction(unittest.TestCase):
+
+        def setUp(self):
+                self.folder = tempfile.mkdtemp()
+                self.file_name = os.path.join(self.folder, "sample.xsd")
+
+                with open(self.file_name, "w", encoding = "UTF-8") as f:
+                        f.write(sample_xsd)
+
+        def tearDown(self):
+                shutil.rmtree(self.folder)
+
+        def test_restrictions(self):
+                restrictions = xsd_extractor.extract_documented_restrictions(self.file_name)
+
+                self.assertEqual(restrictions, expected_restrictions)
+                self.assertEqual(list(restrictions), list(expected_restrictions))
+
+        def test_same_as_reference(self):
+                for polish_title_case in (False, True):
+                        restrictions = xsd_extractor.extract_documented_restrictions(self.file_name, polish_title_case)
+                        reference = reference_extract_documented_restrictions(self.file_name, polish_title_case)
+
+                        self.assertEqual(restrictions, reference)
+                        self.assertEqual(list(restrictions), list(reference))
+
+        def test_cache(self):
+                cache_dir = os.path.join(self.folder, "cache")
+
+                for polish_title_case in (False, True, False):
+                        restrictions = xsd_extractor.xsd_extract_documented_restrictions(self.file_name, polish_title_case, cache_dir)
+                        self.assertEqual(restrictions, xsd_extractor.extract_documented_restrictions(self.file_name, polish_title_case))
+
+                self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+
+if __name__ == '__main__':
+        unittest.main()
@@ -36,6 +36,12 @@ If you want to save the results in some file (e.g. results.txt), type:
 python3 xsd_extractor.py > results.txt
 You can use any other name for output file
 
+To process other folder, and write JSON (or CSV) file for every type name
+instead of displaying the results, type e.g.:
+python3 xsd_extractor.py my_xsd_folder --format json --output results
+Files are processed in parallel. For all options type:
+python3 xsd_extractor.py --help
+
 INSTRUCTIONS FOR SOFTWARE DEVELOPERS
 
 Instructions for developers are included in comments.
@@ -47,15 +53,87 @@ Licence: MIT
 """
 
 import xml.etree.ElementTree as ET
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
 import os
 import os.path
+import sys
+
 
+# Version of extracted data format. Change it if the extraction changes,
+# so cached results of older version are not used.
+cache_format_version = "1"
 
-def xsd_extract_documented_restrictions(file_name, polish_title_case = False):
+
+def xsd_extract_documented_restrictions(file_name, polish_title_case = False, cache_dir = None):
         """
         Returns nested dict containing value restrictions and corresponding
         descriptions extracted from XSD provided by Polish Mininstry of Finance.
 
+        If cache_dir is given, results are kept there as JSON files named by
+        hash of the XSD content and options, so the same XSD is parsed only
+        once (see extract_documented_restrictions for the format).
+
+        Arguments:
+        - file_name (string): name (and path if needed) of XSD file
+        - polish_title_case (bool): changes letter cases if True
+        - cache_dir (string): directory for cached results (optional)
+        """
+
+        if not cache_dir:
+                return extract_documented_restrictions(file_name, polish_title_case)
+
+        cache_file = os.path.join(cache_dir, get_cache_file_name(file_name, polish_title_case))
+
+        if os.path.isfile(cache_file):
+                try:
+                        with open(cache_file, encoding = "UTF-8") as f:
+                                return json.load(f)
+                except ValueError:
+                        # damaged file will be written again
+                        pass
+
+        restrictions = extract_documented_restrictions(file_name, polish_title_case)
+
+        os.makedirs(cache_dir, exist_ok = True)
+
+        # write to temporary file first, so other process never reads
+        # incomplete file
+        temporary_file = cache_file + "." + str(os.getpid()) + ".tmp"
+        with open(temporary_file, "w", encoding = "UTF-8") as f:
+                json.dump(restrictions, f, ensure_ascii = False, separators = (",", ":"))
+        os.replace(temporary_file, cache_file)
+
+        return restrictions
+
+
+def get_cache_file_name(file_name, polish_title_case = False):
+        """
+        Returns name of cache file for given XSD file and options: hash of
+        file content, options and cache format version
+        """
+
+        file_hash = hashlib.sha256()
+
+        with open(file_name, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                        file_hash.update(block)
+
+        return "{0}-{1}-v{2}.json".format(file_hash.hexdigest(), int(bool(polish_title_case)), cache_format_version)
+
+
+def extract_documented_restrictions(file_name, polish_title_case = False):
+        """
+        Returns nested dict containing value restrictions and corresponding
+        descriptions extracted from XSD (without cache).
+
+        The file is read once, with iterparse, and every named type is
+        processed when its end tag is reached, so time is linear in file size
+        and only one top-level element is kept in memory.
+
         Arguments:
         - file_name (string): name (and path if needed) of XSD file
         - polish_title_case (bool): changes letter cases if True
@@ -69,55 +147,98 @@ def xsd_extract_documented_restrictions(file_name, polish_title_case = False):
          - value: restriction documentation (e.g. country name)
         """
 
-        # Parse XSD file
-        tree = ET.parse(file_name)
+        # list of (position of type in file, type name, restrictions)
+        found_types = []
+
+        # stack of open elements: (element, position)
+        stack = []
+        position = 0
+
+        for event, element in ET.iterparse(file_name, events = ("start", "end")):
+                if event == "start":
+                        stack.append((element, position))
+                        position += 1
+                        continue
 
-        # Get dict of namespace prefixes and corresponding namespaces
-        ns_dict = get_xmlns_dict(file_name)
+                element, element_position = stack.pop()
+
+                # Get only named types, which have restriction as subelement.
+                # The name will be used as a key in a dict.
+                if "name" in element.attrib and any(is_ns_element(child, "restriction") for child in element):
+                        type_restrictions = get_type_restrictions(element, polish_title_case)
+
+                        if len(type_restrictions):
+                                found_types.append((element_position, element.attrib["name"], type_restrictions))
+
+                # top-level element is processed, so it can be removed
+                # (it can't be removed earlier, because named types can be
+                # nested)
+                if len(stack) == 1:
+                        stack[0][0].clear()
 
         # Dict to collect all restrictions for all types defined in XSD
         restrictions = {}
 
-        # Find parent elements (/..) of restriction elements in all namespaces
-        restricted_nodes = find_ns_subelements(tree, "restriction/..", ns_dict)
+        for element_position, type_name, type_restrictions in sorted(found_types, key = lambda found_type: found_type[0]):
+                restrictions[type_name] = type_restrictions
+
+        return restrictions
 
-        for restricted_node in restricted_nodes:
 
-                # Get only named types. The name will be used as a key in a dict.
-                if "name" not in restricted_node.attrib:
+def get_type_restrictions(type_element, polish_title_case = False):
+        """
+        Returns dict of documented restrictions of given type element:
+        - key: restriction value from XSD (e.g. country code)
+        - value: restriction documentation (e.g. country name)
+        """
+
+        # Dict to collect restrictions only for current node
+        type_restrictions = {}
+
+        # type node (restricted) can include some other nodes
+        # not only restriction, so let's filter restrictions only
+        for restriction_node in type_element.iter():
+                if restriction_node is type_element or not is_ns_element(restriction_node, "restriction"):
                         continue
-                
-                type_name = restricted_node.attrib["name"]
 
-                # Dict to collect restrictions only for current node
-                type_restrictions = {}
+                # restriction node includes enumerations
+                for r in restriction_node:
 
-                # type node (restricted) can include some other nodes
-                # not only restriction, so let's filter restrictions only
-                restriction_nodes = find_ns_subelements(restricted_node, "restriction", ns_dict)
+                        #some xsd files include documentation in pl & en
+                        #TODO: option to choose langauge or sth
+                        #below code uses first version only
 
-                for restriction_node in restriction_nodes:
+                        doc_node = find_ns_subelement(r, "documentation")
+                        if doc_node is not None:
+                                doc = doc_node.text
+                                if polish_title_case:
+                                        doc = change_case(doc)
+                                value = r.attrib['value']
 
-                        # restriction node includes enumerations
-                        for r in restriction_node:
+                                type_restrictions[value] = doc
 
-                                #some xsd files include documentation in pl & en
-                                #TODO: option to choose langauge or sth
-                                #below code uses first version only
+        return type_restrictions
 
-                                doc_nodes = find_ns_subelements(r, "documentation", ns_dict)
-                                if doc_nodes:
-                                        doc = doc_nodes[0].text
-                                        if polish_title_case:
-                                                doc = change_case(doc)
-                                        value = r.attrib['value']
 
-                                        type_restrictions[value] = doc
-                                        
-                if len(type_restrictions):
-                        restrictions[type_name] = type_restrictions
+def is_ns_element(element, name):
+        """
+        Returns True if element has given name in any namespace
+        """
 
-        return restrictions
+        return element.tag.startswith("{") and element.tag.endswith("}" + name)
+
+
+def find_ns_subelement(element, subelement_name):
+        """
+        Returns first subelement (at any level) with given name in any
+        namespace, or None
+        """
+
+        for subelement in element.iter():
+                if subelement is not element and is_ns_element(subelement, subelement_name):
+                        return subelement
+
+        return None
 
 
 def get_xmlns_dict(xml):
@@ -224,36 +345,135 @@ def print_formatted(dicts, separator = " - ", swap = False):
                                 print(key + separator + subdict[key])
 
 
-if __name__ == '__main__':
+def extract_file(task):
+        """
+        Returns tuple (file path, restrictions) for task (file path,
+        polish_title_case, cache_dir). Used by process pool in batch mode.
+        """
+
+        file_path, polish_title_case, cache_dir = task
+
+        return file_path, xsd_extract_documented_restrictions(file_path, polish_title_case, cache_dir)
+
+
+def extract_folder(xsd_folder, polish_title_case = False, cache_dir = None, workers = None):
+        """
+        Returns list of tuples (file path, restrictions) for all files in
+        given folder, sorted by file name.
+
+        Files are processed in parallel by process pool, if workers > 1
+        (default: number of CPUs).
+        """
+
+        file_paths = []
+        for f in sorted(os.listdir(xsd_folder)):
+                file_path = os.path.join(xsd_folder, f)
+                if os.path.isfile(file_path):
+                        file_paths.append(file_path)
+
+        tasks = [(file_path, polish_title_case, cache_dir) for file_path in file_paths]
+
+        if workers is None:
+                workers = os.cpu_count() or 1
+
+        workers = min(workers, len(tasks))
+
+        if workers < 2:
+                return [extract_file(task) for task in tasks]
+
+        # imap keeps order of files
+        with multiprocessing.Pool(workers) as pool:
+                return list(pool.imap(extract_file, tasks))
+
+
+def write_results(results, output_dir, output_format):
+        """
+        Writes restrictions of every type to separate file:
+        output_dir/{XSD file name without extension}/{type name}.{json|csv}
+
+        JSON file contains object: value -> documentation, CSV file contains
+        header "value,documentation" and one row per restriction.
+
+        Returns number of written files.
+        """
+
+        written_files = 0
+
+        for file_path, restrictions in results:
+                file_dir = os.path.join(output_dir, os.path.splitext(os.path.basename(file_path))[0])
+                os.makedirs(file_dir, exist_ok = True)
+
+                for type_name in restrictions:
+                        type_file = os.path.join(file_dir, type_name + "." + output_format)
 
-        # TODO: add command line options for:
-        # - user-defined xsd folder
-        # - changing separator
-        # - swapping displayed values
-        # - converting XSD restriction documentations to "Polish" title case
+                        if output_format == "json":
+                                with open(type_file, "w", encoding = "UTF-8") as f:
+                                        json.dump(restrictions[type_name], f, ensure_ascii = False, indent = 1)
+                        else:
+                                with open(type_file, "w", encoding = "UTF-8", newline = "") as f:
+                                        writer = csv.writer(f)
+                                        writer.writerow(["value", "documentation"])
+                                        writer.writerows(restrictions[type_name].items())
+
+                        written_files += 1
+
+        return written_files
+
+
+def get_argument_parser():
+        """
+        Returns parser of command line arguments
+        """
+
+        parser = argparse.ArgumentParser(description = "Extracts documented restrictions from XSD files created by Polish Ministry of Finance.")
+        parser.add_argument("xsd_folder", nargs = "?", default = "./xsd", help = "folder with XSD files (default: ./xsd)")
+        parser.add_argument("--format", choices = ["text", "json", "csv"], default = "text", help = "text (console) or file per type name (default: text)")
+        parser.add_argument("--output", default = "./xsd_output", help = "folder for json/csv files (default: ./xsd_output)")
+        parser.add_argument("--cache", default = "./xsd_cache", help = "folder for cached results (default: ./xsd_cache)")
+        parser.add_argument("--no-cache", action = "store_true", help = "don't use cached results")
+        parser.add_argument("--workers", type = int, default = None, help = "number of processes (default: number of CPUs)")
+        parser.add_argument("--separator", default = " - ", help = "separator of value and documentation in text format")
+        parser.add_argument("--swap", action = "store_true", help = "display documentation before value in text format")
+        parser.add_argument("--polish-title-case", action = "store_true", help = "convert documentations to \"Polish\" title case")
+
+        return parser
+
+
+def main(argv = None):
+        """
+        Command line interface. Returns exit code.
+        """
 
-        xsd_folder = "./xsd"
-        separator = " - "
-        swap = False
-        polish_title_case = False
+        args = get_argument_parser().parse_args(argv)
+
+        xsd_folder = args.xsd_folder
+        cache_folder = None if args.no_cache else args.cache
 
-        # TODO: keep messages in line with xsd_folder variable
         if not os.path.isdir(xsd_folder):
-                print("Error: xsd directory missing!")
+                print("Error: " + xsd_folder + " directory missing!")
                 print("")
-                print("Please create a folder named xsd and copy the XSD files into it.")
-        else:
-                files = os.listdir(xsd_folder)
-                if len(files) < 1:
-                        print("Error: xsd directory contains no files!")
-                        print("")
-                        print("Please copy the selected XSD files to the xsd directory.")
-                        
-                for f in files:
+                print("Please create a folder named " + xsd_folder + " and copy the XSD files into it.")
+                return 1
+
+        if len(os.listdir(xsd_folder)) < 1:
+                print("Error: " + xsd_folder + " directory contains no files!")
+                print("")
+                print("Please copy the selected XSD files to the " + xsd_folder + " directory.")
+                return 1
+
+        results = extract_folder(xsd_folder, args.polish_title_case, cache_folder, args.workers)
+
+        if args.format == "text":
+                for file_path, restrictions in results:
                         print("")
-                        print(f)
-                        file_path = xsd_folder + "/" + f
-                        if os.path.isfile(file_path):
-                                restrictions = xsd_extract_documented_restrictions(file_path, polish_title_case)
-                                print_formatted(restrictions, separator, swap)
-                        #input("Press Enter for next file")
+                        print(os.path.basename(file_path))
+                        print_formatted(restrictions, args.separator, args.swap)
+        else:
+                written_files = write_results(results, args.output, args.format)
+                print("Files processed: " + str(len(results)) + ", written: " + str(written_files) + " (" + args.output + ")")
+
+        return 0
+
+
+if __name__ == '__main__':
+        sys.exit(main())
@@ -34,6 +34,10 @@ eu_codes = [
 	]
 
 
+# Key of site cache containing EU countries (see get_eu_country_codes)
+eu_countries_cache_key = "jpk_v7m_eu_countries"
+
+
 def get_eu_countries(omit_pl = False):
 	"""
 	Returns list of names of Country doctypes for EU countries
@@ -43,20 +47,65 @@ def get_eu_countries(omit_pl = False):
 	  Use case: purchase of goods from EU to PL
 	"""
 
-	codes = eu_codes.copy()
+	return [name for name in get_eu_country_codes() if is_eu_country(name, omit_pl)]
+
+
+def is_eu_country(country_name, omit_pl = False):
+	"""
+	Returns True if Country with given name is in EU.
+
+	Arguments:
+	- country_name: name of Country doctype
+	- omit_pl: if set, returns False for Poland.
+	  Use case: purchase of goods from EU to PL
+	"""
+
+	code = get_eu_country_codes().get(country_name)
+
+	if code is None:
+		return False
+
+	if omit_pl and code == "PL":
+		return False
+
+	return True
+
+
+def get_eu_country_codes():
+	"""
+	Returns dict of EU countries: name of Country doctype -> uppercase code
+
+	The dict is computed on first use and kept in site cache, so it's not
+	calculated at import time and lookups don't query the database.
+	The cache is cleared when any Country is changed (see hooks.py).
+	"""
+
+	return frappe.cache().get_value(eu_countries_cache_key, generator = build_eu_country_codes)
+
+
+def build_eu_country_codes():
+	"""
+	Returns dict of EU countries: name of Country doctype -> uppercase code
 
-	if omit_pl:
-		codes.remove("PL")
+	Reads all countries with single query. Use get_eu_country_codes() to get
+	cached version.
+	"""
 
-	all_countries = frappe.db.get_all("Country")
-	eu_countries = []
+	eu_countries = {}
 
-	for country_name in all_countries:
-		country = frappe.get_doc("Country", country_name)
+	for country in frappe.get_all("Country", fields = ["name", "code"]):
 		if country.code:
 			# country codes in ERPNext are lowercase as standard
-			if country.code.upper() in codes:
-				eu_countries.append(country.name)
+			code = country.code.upper()
+			if code in eu_codes:
+				eu_countries[country.name] = code
 
 	return eu_countries
-	
+
+
+def clear_eu_countries_cache(doc = None, method = None):
+	"""
+	Clears cached EU countries. Used as doc_events hook for Country.
+	"""
+
+	frappe.cache().delete_value(eu_countries_cache_key)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import frappe
+import hashlib
+import json
+import pickle
+import redis
+
+# Prefix of redis hashes with processed documents. There is one hash for
+# every doctype and month: prefix::doctype::YYYY-MM
+evidence_cache_prefix = "jpk_v7m_evidence"
+
+# Version of processing code and format of cached results, part of every
+# fingerprint. Change it when process_* functions or their results change,
+# so results of older code are not used.
+evidence_cache_version = "2"
+
+# Time (in seconds) after which unused hash of a month expires. Every write
+# to the hash sets it again.
+evidence_cache_expiry = 90 * 24 * 60 * 60
+
+
+def get_cached_results(doctype, period, documents, fingerprint, parties = None, linked = None):
+	"""
+	Returns dict: document name -> cached result of processing (output of
+	process_* functions) for documents which didn't change since caching.
+
+	Cached result is valid if the document has the same "modified" value,
+	it was processed with the same arguments (fingerprint) and, if given,
+	the same party data and "modified" values of linked documents.
+
+	Arguments:
+	- doctype: doctype of documents
+	- period: month of posting date as string YYYY-MM
+	- documents: list of documents (or records) with name and modified
+	- fingerprint: string identifying processing arguments
+	  (see get_fingerprint)
+	- parties: optional list of party data, in order of documents
+	- linked: optional list of "modified" values of documents used in
+	  processing (e.g. Purchase Invoice of Journal Entry), in order of
+	  documents
+	"""
+
+	# single request for all cached documents of the month
+	entries = frappe.cache().hgetall(get_cache_name(doctype, period))
+
+	if not entries:
+		return {}
+
+	entries = {get_text(key): value for key, value in entries.items()}
+
+	results = {}
+
+	for i, document in enumerate(documents):
+		entry = entries.get(document.name)
+
+		if not entry:
+			continue
+
+		if entry["modified"] != str(document.modified) or entry["fingerprint"] != fingerprint:
+			continue
+
+		if parties is not None and entry["party"] != parties[i]:
+			continue
+
+		if linked is not None and entry.get("linked") != str(linked[i]):
+			continue
+
+		results[document.name] = entry["result"]
+
+	return results
+
+
+def set_cached_results(doctype, period, documents, results, fingerprint, parties = None, linked = None):
+	"""
+	Stores results of processing of given documents.
+
+	All results are written in single request (redis pipeline), pickled like
+	in frappe.cache().hset, so they can be read with hgetall. Expiry of the
+	hash is set again (see evidence_cache_expiry).
+
+	Arguments are the same as in get_cached_results, and:
+	- results: list of results, in order of documents
+	"""
+
+	if not documents:
+		return
+
+	cache = frappe.cache()
+	cache_key = cache.make_key(get_cache_name(doctype, period))
+	pipeline = cache.pipeline()
+
+	for i, document in enumerate(documents):
+		pipeline.hset(cache_key, document.name, pickle.dumps({
+			"modified": str(document.modified),
+			"fingerprint": fingerprint,
+			"party": parties[i] if parties is not None else None,
+			"linked": str(linked[i]) if linked is not None else None,
+			"result": results[i]
+			}))
+
+	pipeline.expire(cache_key, evidence_cache_expiry)
+
+	try:
+		pipeline.execute()
+	except redis.exceptions.ConnectionError:
+		# like frappe.cache().hset, work without cache if redis is down
+		pass
+
+
+def invalidate_evidence_cache(doc, method = None):
+	"""
+	Removes given document from evidence cache.
+
+	Used as doc_events hook for Sales Invoice, Purchase Invoice and Journal
+	Entry (on submit, cancel, update after submit and trash).
+	"""
+
+	if not doc.get("posting_date"):
+		return
+
+	period = str(doc.posting_date)[:7]
+
+	frappe.cache().hdel(get_cache_name(doc.doctype, period), doc.name)
+
+
+def get_fingerprint(*arguments):
+	"""
+	Returns string identifying given arguments of processing (e.g. lists of
+	tax accounts) and version of processing code (evidence_cache_version).
+	Result processed with other arguments or code is not valid.
+	"""
+
+	text = json.dumps([evidence_cache_version, arguments], sort_keys = True, default = get_json_value)
+
+	return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def get_json_value(value):
+	"""
+	Returns JSON serializable value of given object (sets are sorted, so
+	the fingerprint doesn't depend on order of elements)
+	"""
+
+	if isinstance(value, (set, frozenset)):
+		return sorted(value)
+
+	return str(value)
+
+
+def get_cache_name(doctype, period):
+	"""
+	Returns name of redis hash for given doctype and month (YYYY-MM)
+	"""
+
+	return evidence_cache_prefix + "::" + doctype + "::" + period
+
+
+def get_text(key):
+	"""
+	Returns redis hash key as string (redis returns bytes)
+	"""
+
+	if isinstance(key, bytes):
+		return key.decode("utf-8")
+
+	return key
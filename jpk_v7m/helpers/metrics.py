@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import frappe
+import os
+import time
+from contextlib import contextmanager
+
+try:
+	import resource
+except ImportError:
+	# not available on Windows
+	resource = None
+
+
+class PhaseMetrics(object):
+	"""
+	Collects metrics of phases of JPK generation: wall time, number of
+	database queries, number of processed rows, and memory (RSS) of the
+	process at the end of the phase together with its growth during the
+	phase (rss_delta_mb). Memory freed and reused within the phase isn't
+	visible in RSS, so the growth shows which phase keeps the memory.
+
+	Phase measured more than once (e.g. for Purchase and Sales Invoices) is
+	reported once, with summed values.
+
+	Usage:
+	metrics = PhaseMetrics()
+	with metrics.phase("documents") as phase:
+		...
+		phase["rows"] = len(documents)
+	"""
+
+	def __init__(self):
+		self.phases = []
+		install_query_counter()
+
+
+	@contextmanager
+	def phase(self, name):
+		"""
+		Context manager measuring given phase. Yields dict of the phase, in
+		which "rows" (and other values) can be set.
+		"""
+
+		entry = {"phase": name, "rows": 0}
+
+		queries = get_query_count()
+		rss = get_rss_mb()
+		start = time.perf_counter()
+
+		try:
+			yield entry
+		finally:
+			entry["seconds"] = time.perf_counter() - start
+			entry["queries"] = get_query_count() - queries
+			entry["rss_mb"] = get_rss_mb()
+			entry["rss_delta_mb"] = None if rss is None else round(entry["rss_mb"] - rss, 1)
+			self.add_entry(entry)
+
+
+	def add_entry(self, entry):
+		"""
+		Adds measured phase, or sums its values with the phase of the same
+		name measured before
+		"""
+
+		for phase in self.phases:
+			if phase["phase"] == entry["phase"]:
+				for key, value in entry.items():
+					if key in ("seconds", "queries", "rows", "output_bytes"):
+						phase[key] = phase.get(key, 0) + value
+					elif key == "rss_delta_mb" and value is not None:
+						phase[key] = round(phase[key] + value, 1)
+					elif key == "rss_mb" and value is not None:
+						phase[key] = max(phase[key], value)
+					elif key != "phase":
+						phase[key] = value
+
+				phase["seconds"] = round(phase["seconds"], 3)
+				return
+
+		entry["seconds"] = round(entry["seconds"], 3)
+		self.phases.append(entry)
+
+
+	def as_dict(self):
+		"""
+		Returns dict with list of phases and totals. process_peak_rss_mb is
+		the peak since start of the process (also from earlier jobs of the
+		same worker), not of the measured phases.
+		"""
+
+		return {
+			"phases": self.phases,
+			"seconds": round(sum(entry["seconds"] for entry in self.phases), 3),
+			"queries": sum(entry["queries"] for entry in self.phases),
+			"process_peak_rss_mb": get_peak_rss_mb()
+			}
+
+
+def start_metrics():
+	"""
+	Starts collecting metrics of phases measured with measure_phase (in
+	current request or job). Returns PhaseMetrics object.
+	"""
+
+	frappe.local.jpk_metrics = PhaseMetrics()
+
+	return frappe.local.jpk_metrics
+
+
+def stop_metrics():
+	"""
+	Stops collecting metrics started with start_metrics, and restores
+	original frappe.db.sql (see install_query_counter)
+	"""
+
+	frappe.local.jpk_metrics = None
+	uninstall_query_counter()
+
+
+@contextmanager
+def measure_phase(name):
+	"""
+	Context manager measuring given phase in metrics started with
+	start_metrics. Does nothing (yields dict, which is ignored) if metrics
+	are not started, so it can be used in functions called also outside of
+	JPK generation.
+
+	Should not be nested, and not used in functions run in other processes
+	(see process_in_chunks), because such phases would be counted twice or
+	lost.
+	"""
+
+	metrics = getattr(frappe.local, "jpk_metrics", None)
+
+	if metrics is None:
+		yield {}
+		return
+
+	with metrics.phase(name) as entry:
+		yield entry
+
+
+def install_query_counter():
+	"""
+	Wraps frappe.db.sql of current connection, so every query (including
+	get_all, get_value, etc.) is counted in frappe.local.jpk_query_count.
+	"""
+
+	db = frappe.db
+
+	if getattr(db, "jpk_counted_sql", None):
+		return
+
+	sql = db.sql
+
+	def counted_sql(*args, **kwargs):
+		frappe.local.jpk_query_count = get_query_count() + 1
+		return sql(*args, **kwargs)
+
+	db.jpk_counted_sql = sql
+	db.sql = counted_sql
+
+
+def uninstall_query_counter():
+	"""
+	Restores frappe.db.sql wrapped by install_query_counter
+	"""
+
+	db = frappe.db
+	sql = getattr(db, "jpk_counted_sql", None)
+
+	if not sql:
+		return
+
+	db.sql = sql
+	del db.jpk_counted_sql
+
+
+def get_query_count():
+	"""
+	Returns number of queries counted since install_query_counter
+	"""
+
+	return getattr(frappe.local, "jpk_query_count", 0)
+
+
+def get_rss_mb():
+	"""
+	Returns current resident memory of the process in MB (or None if not
+	available - only Linux /proc is supported)
+	"""
+
+	try:
+		with open("/proc/self/statm") as f:
+			pages = int(f.read().split()[1])
+	except (IOError, OSError, ValueError, IndexError):
+		return None
+
+	return round(pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024, 1)
+
+
+def get_peak_rss_mb():
+	"""
+	Returns peak resident memory of the process in MB (or None if not
+	available)
+	"""
+
+	if resource is None:
+		return None
+
+	# ru_maxrss is in kilobytes on Linux
+	return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
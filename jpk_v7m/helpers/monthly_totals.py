@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import frappe
+
+from jpk_v7m.helpers.evidence_cache import get_text
+
+# Prefix of redis hashes with K_ sums of submitted documents. There is one
+# hash for every company and month: prefix::company::YYYY-MM
+monthly_totals_prefix = "jpk_v7m_totals"
+
+# Key of hash entry marking that the hash contains all documents of the month
+complete_key = "__complete__"
+
+# Number of K_ fields (the same as sum_of_field_k in jpk_v7m_creator)
+number_of_k_fields = 48
+
+
+def get_monthly_totals(company, period, builder):
+	"""
+	Returns tuple (sum_of_field_k, sum_of_bad_debt_relief) for submitted
+	documents of given company and month, in the format used by
+	jpk_v7m_creator.
+
+	Sums of single documents are kept in redis and updated by doc_events
+	hooks, so only the cached sums are added. If cache for the month is not
+	complete (e.g. after clearing cache), it's built once with builder.
+
+	Arguments:
+	- company: name of the company
+	- period: month of posting date as string YYYY-MM
+	- builder: function returning dict: document key (see get_document_key)
+	  -> document totals (see get_document_totals), for all submitted
+	  documents of the month
+	"""
+
+	cache_name = get_cache_name(company, period)
+
+	entries = frappe.cache().hgetall(cache_name)
+
+	if not any(get_text(key) == complete_key for key in entries):
+		entries = builder()
+
+		for key, totals in entries.items():
+			frappe.cache().hset(cache_name, key, totals)
+
+		frappe.cache().hset(cache_name, complete_key, 1)
+
+	sum_of_field_k = [0.0] * number_of_k_fields
+	sum_of_bad_debt_relief = {"net": 0, "tax": 0}
+
+	for key, totals in entries.items():
+		if get_text(key) == complete_key:
+			continue
+
+		for i, value in totals["k"].items():
+			sum_of_field_k[i] += value
+
+		sum_of_bad_debt_relief["net"] += totals["net"]
+		sum_of_bad_debt_relief["tax"] += totals["tax"]
+
+	return sum_of_field_k, sum_of_bad_debt_relief
+
+
+def get_document_totals(sum_of_field_k, sum_of_bad_debt_relief):
+	"""
+	Returns compact totals of a single document (only K_ fields other than
+	zero) to be kept in cache.
+
+	Arguments:
+	- sum_of_field_k: list of sums of K_ fields of the document rows
+	- sum_of_bad_debt_relief: dict with sums of amended net and tax
+	"""
+
+	return {
+		"k": {i: value for i, value in enumerate(sum_of_field_k) if value},
+		"net": sum_of_bad_debt_relief["net"],
+		"tax": sum_of_bad_debt_relief["tax"]
+		}
+
+
+def set_document_totals(company, period, key, totals):
+	"""
+	Stores totals of a submitted document.
+
+	Nothing is stored if totals of the month were not built yet, because
+	the document will be included when they are built.
+	"""
+
+	cache_name = get_cache_name(company, period)
+
+	if frappe.cache().hget(cache_name, complete_key) is None:
+		return
+
+	frappe.cache().hset(cache_name, key, totals)
+
+
+def delete_document_totals(company, period, key):
+	"""
+	Removes totals of a cancelled or deleted document
+	"""
+
+	frappe.cache().hdel(get_cache_name(company, period), key)
+
+
+def delete_monthly_totals(company, period):
+	"""
+	Removes totals of given company and month, so they are built again on
+	next use
+	"""
+
+	frappe.cache().delete_key(get_cache_name(company, period))
+
+
+def clear_monthly_totals(company):
+	"""
+	Removes totals of all months of given company (e.g. when tax accounts
+	of the company are changed)
+	"""
+
+	frappe.cache().delete_keys(monthly_totals_prefix + "::" + company + "::")
+
+
+def get_document_key(doctype, name):
+	"""
+	Returns key of the document in monthly totals hash
+	"""
+
+	return doctype + "::" + name
+
+
+def get_cache_name(company, period):
+	"""
+	Returns name of redis hash for given company and month (YYYY-MM)
+	"""
+
+	return monthly_totals_prefix + "::" + company + "::" + period
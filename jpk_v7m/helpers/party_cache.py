@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import frappe
+from frappe import _
+
+# Fields of documents required to resolve party data (name is always added).
+# Only these values are cached, not the whole documents.
+party_fields = {
+	"Address": ["country"],
+	"Company": ["country"],
+	"Country": ["code"],
+	"Customer": ["customer_primary_address", "customer_type", "tax_id"],
+	"Supplier": ["country", "supplier_type", "tax_id"]
+	}
+
+# Name of redis hash used as cross-run cache (shared by all workers)
+shared_cache_key = "jpk_v7m_party_cache"
+
+
+def reset_party_cache(use_shared_cache = False):
+	"""
+	Starts new cache for a JPK run and resets hit/miss counters.
+
+	Per-run cache is kept in frappe.local, so it lives as long as the current
+	request or background job.
+
+	Arguments:
+	- use_shared_cache: if True, values missing in per-run cache are looked
+	  for in redis cache shared between runs. The shared cache is invalidated
+	  by doc_events hooks (see invalidate_party_cache)
+	"""
+
+	frappe.local.jpk_party_cache = {}
+	frappe.local.jpk_party_cache_stats = {"hits": 0, "shared_hits": 0, "misses": 0}
+	frappe.local.jpk_use_shared_party_cache = use_shared_cache
+
+
+def get_party_cache_stats():
+	"""
+	Returns dict with number of cache hits (per-run and shared) and misses
+	since last reset_party_cache()
+	"""
+
+	if getattr(frappe.local, "jpk_party_cache_stats", None) is None:
+		reset_party_cache()
+
+	return dict(frappe.local.jpk_party_cache_stats)
+
+
+def get_cached_party_values(doctype, name):
+	"""
+	Returns frappe._dict with values of fields listed in party_fields for
+	document with given doctype and name.
+
+	Database is queried only once for every document during a run (and
+	only once between runs, if shared cache is used).
+
+	Arguments:
+	- doctype: one of the doctypes from party_fields
+	- name: name of the document
+	"""
+
+	if getattr(frappe.local, "jpk_party_cache", None) is None:
+		reset_party_cache()
+
+	cache = frappe.local.jpk_party_cache
+	stats = frappe.local.jpk_party_cache_stats
+
+	key = get_cache_key(doctype, name)
+
+	values = cache.get(key)
+
+	if values is not None:
+		stats["hits"] += 1
+		return values
+
+	if frappe.local.jpk_use_shared_party_cache:
+		values = frappe.cache().hget(shared_cache_key, key)
+
+		if values is not None:
+			stats["shared_hits"] += 1
+			cache[key] = values
+			return values
+
+	stats["misses"] += 1
+
+	values = frappe.db.get_value(doctype, name, ["name"] + party_fields[doctype], as_dict = True)
+
+	if values is None:
+		frappe.throw(_("{0} {1} not found").format(_(doctype), name), frappe.DoesNotExistError)
+
+	cache[key] = values
+
+	if frappe.local.jpk_use_shared_party_cache:
+		frappe.cache().hset(shared_cache_key, key, values)
+
+	return values
+
+
+def invalidate_party_cache(doc, method = None):
+	"""
+	Removes given document from party cache.
+
+	Used as doc_events hook for doctypes listed in party_fields.
+	"""
+
+	key = get_cache_key(doc.doctype, doc.name)
+
+	frappe.cache().hdel(shared_cache_key, key)
+
+	cache = getattr(frappe.local, "jpk_party_cache", None)
+	if cache:
+		cache.pop(key, None)
+
+
+def get_cache_key(doctype, name):
+	"""
+	Returns key of the document in party cache
+	"""
+
+	return doctype + "::" + name
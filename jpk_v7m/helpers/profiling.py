@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import cProfile
+import frappe
+import io
+import pstats
+import tracemalloc
+from frappe.utils import now_datetime
+
+# Number of frames stored by tracemalloc for every allocation
+traceback_frames = 10
+
+# Number of lines in reports of allocations and functions
+report_size = 30
+
+
+def run_profiled(doc, function, *args, **kwargs):
+	"""
+	Calls function(*args, **kwargs) under cProfile and tracemalloc, and
+	attaches to the document (as private Files):
+	- {name}-{time}.prof: cProfile statistics (for pstats, snakeviz etc.)
+	- {name}-{time}-profile.txt: top allocations and functions
+
+	Returns result of the function. Nothing is attached if the function
+	raises an exception.
+
+	The code runs a few times slower when profiled, and only the current
+	process is profiled (not the workers of process_in_chunks).
+
+	Arguments:
+	- doc: document to attach the files to
+	"""
+
+	profiler = cProfile.Profile()
+
+	tracemalloc.start(traceback_frames)
+	profiler.enable()
+
+	try:
+		result = function(*args, **kwargs)
+	finally:
+		profiler.disable()
+		snapshot = tracemalloc.take_snapshot()
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+
+	file_name = "{0}-{1}".format(doc.name, now_datetime().strftime("%Y%m%d-%H%M%S"))
+
+	profile_path = frappe.get_site_path("private", "files", file_name + ".prof")
+	profiler.dump_stats(profile_path)
+	attach_private_file(doc, file_name + ".prof")
+
+	report_path = frappe.get_site_path("private", "files", file_name + "-profile.txt")
+	with open(report_path, "w") as f:
+		f.write(get_profile_report(profiler, snapshot, peak))
+	attach_private_file(doc, file_name + "-profile.txt")
+
+	return result
+
+
+def get_profile_report(profiler, snapshot, peak):
+	"""
+	Returns text report with peak of traced memory, lines of code with the
+	biggest allocations still alive at the end of the run, and functions
+	with the biggest cumulative time.
+
+	Arguments:
+	- profiler: cProfile.Profile (disabled)
+	- snapshot: tracemalloc snapshot taken at the end of the run
+	- peak: peak size of traced memory (in bytes)
+	"""
+
+	# frames of tracemalloc itself are not interesting
+	snapshot = snapshot.filter_traces([
+		tracemalloc.Filter(False, tracemalloc.__file__),
+		tracemalloc.Filter(False, "<frozen importlib._bootstrap>")
+		])
+
+	lines = [
+		"Peak traced memory: {0:.1f} MB".format(peak / 1024 / 1024),
+		"",
+		"Top {0} allocations (by line):".format(report_size)
+		]
+
+	for statistic in snapshot.statistics("lineno")[:report_size]:
+		lines.append(str(statistic))
+
+	stream = io.StringIO()
+	pstats.Stats(profiler, stream = stream).sort_stats("cumulative").print_stats(report_size)
+
+	lines += ["", "Top {0} functions (by cumulative time):".format(report_size), stream.getvalue()]
+
+	return "\n".join(lines)
+
+
+def attach_private_file(doc, file_name):
+	"""
+	Creates private File document for existing file in private files folder
+	of the site, attached to given document
+	"""
+
+	new_file = frappe.get_doc({
+		"doctype": "File",
+		"attached_to_doctype": doc.doctype,
+		"attached_to_name": doc.name,
+		"file_url": "/private/files/" + file_name,
+		"file_name": file_name,
+		"is_private": 1
+		})
+
+	new_file.insert()
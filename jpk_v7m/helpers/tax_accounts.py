@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import frappe
+
+from jpk_v7m.helpers.monthly_totals import clear_monthly_totals
+
+# Name of redis hash with resolved tax accounts: company -> accounts
+tax_accounts_cache_key = "jpk_v7m_tax_accounts"
+
+
+def get_tax_accounts(company):
+	"""
+	Returns tuple of frozensets (input tax accounts, output tax accounts)
+	of given company, for O(1) checks of tax rows.
+
+	Accounts are resolved from JPK Company Settings (groups are expanded to
+	leaf accounts) once and kept in cache until settings or an account of
+	the company are changed (see clear_tax_accounts_cache).
+
+	Arguments:
+	- company: name of the company (the same as name of JPK Company Settings)
+	"""
+
+	accounts = frappe.cache().hget(
+		tax_accounts_cache_key,
+		company,
+		generator = lambda: resolve_tax_accounts(company)
+		)
+
+	return frozenset(accounts["input"]), frozenset(accounts["output"])
+
+
+def resolve_tax_accounts(company):
+	"""
+	Returns dict with lists of leaf accounts ("input" and "output") from
+	tax accounts tables of JPK Company Settings of given company
+	"""
+
+	from jpk_v7m.jpk_v7m.doctype.jpk_company_settings.jpk_company_settings import get_leaf_accounts_of
+
+	settings = frappe.get_doc("JPK Company Settings", company)
+
+	return {
+		"input": get_leaf_accounts_of([row.account_name for row in settings.input_tax_accounts]),
+		"output": get_leaf_accounts_of([row.account_name for row in settings.output_tax_accounts])
+		}
+
+
+def clear_tax_accounts_cache(doc, method = None, *args):
+	"""
+	Removes resolved tax accounts of the company from cache, together with
+	monthly sums (see monthly_totals), which depend on tax accounts.
+
+	Used as doc_events hook for Account, and called when JPK Company
+	Settings are saved. after_rename hook is called with additional
+	arguments (old name, new name, merge), which are not used.
+	"""
+
+	company = doc.company if doc.doctype == "Account" else doc.name
+
+	if not company:
+		return
+
+	frappe.cache().hdel(tax_accounts_cache_key, company)
+	clear_monthly_totals(company)
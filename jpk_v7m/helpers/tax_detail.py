@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import json
+
+# orjson is much faster for long item_wise_tax_detail strings, but optional
+try:
+	import orjson
+	loads = orjson.loads
+except ImportError:
+	orjson = None
+	loads = json.loads
+
+# Name of attribute of tax row with parsed item_wise_tax_detail
+parsed_field = "parsed_item_wise_tax_detail"
+
+
+def get_item_wise_tax(tax):
+	"""
+	Returns item_wise_tax_detail of tax row (Sales/Purchase Taxes and
+	Charges) as tuple of tuples (item name, rate, tax amount).
+
+	The field is parsed only once for every tax row, and the result is kept
+	in the row, so it's shared by all functions processing the invoice.
+
+	Arguments:
+	- tax: tax row (document or dict) with item_wise_tax_detail field
+	"""
+
+	parsed = tax.get(parsed_field)
+
+	if parsed is None:
+		parsed = parse_item_wise_tax_detail(tax.item_wise_tax_detail)
+		setattr(tax, parsed_field, parsed)
+
+	return parsed
+
+
+def parse_item_wise_tax_detail(text, parser = None):
+	"""
+	Returns tuple of tuples (item name, rate, tax amount) in the order of
+	items in item_wise_tax_detail.
+
+	Entries without rate and amount (null or empty, found in older
+	invoices) are skipped, like an empty or missing field.
+
+	Arguments:
+	- text: JSON string: {item name: [rate, tax amount], ...}
+	- parser: function parsing JSON (default: orjson if installed)
+	"""
+
+	if not text:
+		return ()
+
+	details = (parser or loads)(text)
+
+	return tuple(
+		(item_name, detail[0], detail[1])
+		for item_name, detail in details.items()
+		if detail and isinstance(detail, (list, tuple)) and len(detail) > 1
+		)
@@ -60,6 +60,7 @@ app_license = "MIT"
 
 # before_install = "jpk_v7m.install.before_install"
 after_install = "jpk_v7m.install.after_install"
+after_migrate = ["jpk_v7m.install.after_migrate"]
 
 # Desk Notifications
 # ------------------
@@ -99,6 +100,97 @@ after_install = "jpk_v7m.install.after_install"
 #	}
 # }
 
+doc_events = {
+	"Account": {
+		"on_update": "jpk_v7m.helpers.tax_accounts.clear_tax_accounts_cache",
+		"on_trash": "jpk_v7m.helpers.tax_accounts.clear_tax_accounts_cache",
+		"after_rename": "jpk_v7m.helpers.tax_accounts.clear_tax_accounts_cache"
+	},
+	"Address": {
+		"on_update": "jpk_v7m.helpers.party_cache.invalidate_party_cache",
+		"on_trash": "jpk_v7m.helpers.party_cache.invalidate_party_cache"
+	},
+	"Company": {
+		"on_update": "jpk_v7m.helpers.party_cache.invalidate_party_cache",
+		"on_trash": "jpk_v7m.helpers.party_cache.invalidate_party_cache"
+	},
+	"Country": {
+		"on_update": [
+			"jpk_v7m.helpers.party_cache.invalidate_party_cache",
+			"jpk_v7m.helpers.eu.clear_eu_countries_cache"
+		],
+		"on_trash": [
+			"jpk_v7m.helpers.party_cache.invalidate_party_cache",
+			"jpk_v7m.helpers.eu.clear_eu_countries_cache"
+		]
+	},
+	"Customer": {
+		"on_update": "jpk_v7m.helpers.party_cache.invalidate_party_cache",
+		"on_trash": "jpk_v7m.helpers.party_cache.invalidate_party_cache"
+	},
+	"Supplier": {
+		"on_update": "jpk_v7m.helpers.party_cache.invalidate_party_cache",
+		"on_trash": "jpk_v7m.helpers.party_cache.invalidate_party_cache"
+	},
+	"Sales Invoice": {
+		"on_update": "jpk_v7m.helpers.evidence_cache.invalidate_evidence_cache",
+		"on_submit": [
+			"jpk_v7m.helpers.evidence_cache.invalidate_evidence_cache",
+			"jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m.update_monthly_totals"
+		],
+		"on_cancel": [
+			"jpk_v7m.helpers.evidence_cache.invalidate_evidence_cache",
+			"jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m.update_monthly_totals"
+		],
+		"on_update_after_submit": [
+			"jpk_v7m.helpers.evidence_cache.invalidate_evidence_cache",
+			"jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m.update_monthly_totals"
+		],
+		"on_trash": [
+			"jpk_v7m.helpers.evidence_cache.invalidate_evidence_cache",
+			"jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m.update_monthly_totals"
+		]
+	},
+	"Purchase Invoice": {
+		"on_update": "jpk_v7m.helpers.evidence_cache.invalidate_evidence_cache",
+		"on_submit": [
+			"jpk_v7m.helpers.evidence_cache.invalidate_evidence_cache",
+			"jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m.update_monthly_totals"
+		],
+		"on_cancel": [
+			"jpk_v7m.helpers.evidence_cache.invalidate_evidence_cache",
+			"jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m.update_monthly_totals"
+		],
+		"on_update_after_submit": [
+			"jpk_v7m.helpers.evidence_cache.invalidate_evidence_cache",
+			"jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m.update_monthly_totals"
+		],
+		"on_trash": [
+			"jpk_v7m.helpers.evidence_cache.invalidate_evidence_cache",
+			"jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m.update_monthly_totals"
+		]
+	},
+	"Journal Entry": {
+		"on_update": "jpk_v7m.helpers.evidence_cache.invalidate_evidence_cache",
+		"on_submit": [
+			"jpk_v7m.helpers.evidence_cache.invalidate_evidence_cache",
+			"jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m.update_monthly_totals"
+		],
+		"on_cancel": [
+			"jpk_v7m.helpers.evidence_cache.invalidate_evidence_cache",
+			"jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m.update_monthly_totals"
+		],
+		"on_update_after_submit": [
+			"jpk_v7m.helpers.evidence_cache.invalidate_evidence_cache",
+			"jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m.update_monthly_totals"
+		],
+		"on_trash": [
+			"jpk_v7m.helpers.evidence_cache.invalidate_evidence_cache",
+			"jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m.update_monthly_totals"
+		]
+	}
+}
+
 # Scheduled Tasks
 # ---------------
 
@@ -4,6 +4,16 @@ import frappe
 from frappe import _
 from frappe.custom.doctype.custom_field.custom_field import create_custom_field
 
+# Indexes for JPK queries: (doctype, index name, fields).
+# Fields compared with "=" are first, the range of posting_date is last,
+# so documents of a month are read with index range scan.
+jpk_indexes = [
+	("Purchase Invoice", "jpk_company_posting_date", ["company", "docstatus", "posting_date"]),
+	("Sales Invoice", "jpk_company_posting_date", ["company", "docstatus", "posting_date"]),
+	("Journal Entry", "jpk_imp_posting_date", ["jpk_is_imp", "company", "docstatus", "posting_date"])
+	]
+
+
 def after_install():
 
 	create_custom_field("Journal Entry", {
@@ -47,4 +57,32 @@ def after_install():
 		"insert_after": "set_posting_time"
 		})
 
-	
+	create_indexes()
+
+
+def after_migrate():
+	# indexes can be removed by schema changes of ERPNext doctypes
+	create_indexes()
+
+
+def create_indexes():
+	"""
+	Creates indexes from jpk_indexes, if they don't exist
+	"""
+
+	for doctype, index_name, fields in get_missing_indexes():
+		frappe.db.add_index(doctype, fields, index_name)
+
+
+def get_missing_indexes():
+	"""
+	Returns list of indexes from jpk_indexes, which don't exist in database
+	"""
+
+	missing_indexes = []
+
+	for doctype, index_name, fields in jpk_indexes:
+		if not frappe.db.has_index("tab" + doctype, index_name):
+			missing_indexes.append((doctype, index_name, fields))
+
+	return missing_indexes
@@ -4,10 +4,20 @@
 
 from __future__ import unicode_literals
 import frappe
+from frappe import _
 from frappe.model.document import Document
+from jpk_v7m.helpers.tax_accounts import clear_tax_accounts_cache
 
 class JPKCompanySettings(Document):
 
+	def on_update(self):
+		"""
+		Tax accounts (and sums of K_ fields depending on them) are resolved
+		again on next use
+		"""
+
+		clear_tax_accounts_cache(self)
+
 	@frappe.whitelist()
 	def fill_tax_accounts_lists(self):
 		"""
@@ -28,67 +38,78 @@ class JPKCompanySettings(Document):
 		- source_table: child table with names of accounts, both leaf and group
 		- list_table_name: name of the table to be filled with leaf account names
 		"""
-	
-		for account in source_table:
-			account_names = get_leaf_accounts(account.account_name)
-			for account_name in account_names:
-				if not self.table_contains_account_name(list_table_name, account_name):
-					row = self.append(list_table_name, {})
-					row.account_name = account_name
+
+		# set of names already in the table, to avoid duplicate rows
+		account_names = {item.account_name for item in self.get(list_table_name)}
+
+		for account_name in get_leaf_accounts_of([account.account_name for account in source_table]):
+			if account_name not in account_names:
+				account_names.add(account_name)
+				row = self.append(list_table_name, {})
+				row.account_name = account_name
 		return
-	
-	def table_contains_account_name(self, list_table_name, account_name):
-		"""
-		Returns True if the table already contains given account name.
-		
-		Used to avoid duplicate rows.
-		
-		Arguments:
-		- list_table_name (string): the name of the table with account names
-		- account_name (string): the name to be checked if alredy exists in the table
-		"""
-	
-		for item in self.get(list_table_name):
-			if item.account_name == account_name:
-				return True
-		return False
-	
+
 
 def get_leaf_accounts(account_name):
 	"""
 	Returns list of all leaf accounts (not groups) of the account with given name.
 
-	Uses recursive function to walk through the chart of accounts tree.
-
 	Arguments:
 	- account_name (string): the name of account. Can be group, or leaf.
 	"""
 
-	account = frappe.get_doc("Account", account_name)
-
-	if account.is_group:
-		leafs = []
-		return get_leaf_accounts_recursive(account.name, leafs)
-	else:
-		# string would be iterated as single letters
-		return [account_name]
+	return get_leaf_accounts_of([account_name])
 
 
-def get_leaf_accounts_recursive(account_name, leafs):
+def get_leaf_accounts_of(account_names):
 	"""
-	Returns list of all leaf accounts (not groups) of the group account with given name.
+	Returns list of all leaf accounts (not groups) of the accounts with given
+	names, in order of given accounts (and chart of accounts). Can contain
+	duplicates, if given groups overlap.
+
+	Uses nested set of Account (lft, rgt), so the leafs of all groups are
+	found with one query, instead of walking through the tree.
 
 	Arguments:
-	- account_name (string): the name of group account
-	- leafs (list of strings): list of leaf accounts collected in previous recursion
+	- account_names (list of strings): names of accounts, groups or leafs
 	"""
 
-	subaccount_names = frappe.get_all("Account", filters = {'parent_account': account_name}, pluck = 'name')
+	if not account_names:
+		return []
+
+	accounts = frappe.get_all("Account",
+		fields = ["name", "lft", "rgt", "is_group"],
+		filters = {"name": ["in", list(set(account_names))]}
+	)
+
+	accounts_by_name = {account.name: account for account in accounts}
 
-	for subaccount_name in subaccount_names:
-		subaccount = frappe.get_doc("Account", subaccount_name)
-		if subaccount.is_group:
-			get_leaf_accounts_recursive(subaccount.name, leafs)
+	for account_name in account_names:
+		if account_name not in accounts_by_name:
+			frappe.throw(_("Account {0} not found").format(account_name), frappe.DoesNotExistError)
+
+	groups = [account for account in accounts if account.is_group]
+	group_leafs = []
+
+	if groups:
+		conditions = " or ".join(["(lft > %s and rgt < %s)"] * len(groups))
+		values = []
+		for group in groups:
+			values += [group.lft, group.rgt]
+
+		group_leafs = frappe.db.sql("""
+			select name, lft
+			from `tabAccount`
+			where is_group = 0 and ({0})
+			order by lft""".format(conditions), values, as_dict = True)
+
+	leafs = []
+
+	for account_name in account_names:
+		account = accounts_by_name[account_name]
+		if account.is_group:
+			leafs += [leaf.name for leaf in group_leafs if account.lft < leaf.lft < account.rgt]
 		else:
-			leafs.append(subaccount.name)
+			leafs.append(account.name)
+
 	return leafs
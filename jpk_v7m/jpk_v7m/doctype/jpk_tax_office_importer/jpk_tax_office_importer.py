@@ -4,6 +4,7 @@
 from __future__ import unicode_literals
 import frappe
 from frappe.model.document import Document
+from frappe.utils import cint, now
 
 from jpk_v7m.external_tools.mf_xsd_extractor.xsd_extractor import *
 
@@ -15,12 +16,25 @@ class JPKTaxOfficeImporter(Document):
 			    xsd,
 			    type_name = "TKodUS",
 			    update_existing = True,
-			    change_case = True
+			    change_case = True,
+			    bulk = True
 			    ):
-		
+		"""
+		Imports tax office codes and names from XSD file.
+
+		In bulk mode (default) all existing tax offices are loaded once,
+		changes are computed in memory and applied with batched statements.
+		Otherwise every tax office is inserted or saved as a document.
+
+		Returns html report with numbers of added and updated tax offices.
+		"""
+
+		# parsed XSD files are cached in site's private folder, so the same
+		# file is parsed only once
 		restrictions = xsd_extract_documented_restrictions(
 			frappe.get_site_path() + xsd,
-			polish_title_case = change_case
+			polish_title_case = change_case,
+			cache_dir = frappe.get_site_path("private", "xsd_cache")
 			)
 
 		if type_name not in restrictions:
@@ -28,32 +42,144 @@ class JPKTaxOfficeImporter(Document):
 
 		codes = restrictions[type_name]
 
-		new_codes = 0
-		updated_codes = 0
-		updated_names = 0
-
-		for code in codes:
-			# can be only one (or zero), because code is unique
-			existing_tax_office = frappe.db.get_list("JPK Tax Office", filters = {'code': code})
-
-			if len(existing_tax_office):
-				current_name = existing_tax_office[0].name
-				new_name = codes[code]
-				
-				if update_existing and current_name != new_name:
-					updated_names += 1
-					frappe.rename_doc("JPK Tax Office", current_name, new_name)
-			else:
-				if not frappe.db.exists("JPK Tax Office", codes[code]):
-					new_codes += 1
-					# create new "JPK Tax Office" type document
-					tax_office = frappe.get_doc({'doctype': 'JPK Tax Office', "code": code, "tax_office": codes[code]})
-					# save the document
-					tax_office.insert()
-				elif update_existing:
-					updated_codes += 1
-					tax_office = frappe.get_doc("JPK Tax Office", codes[code])
-					tax_office.code = code
-					tax_office.save()
+		if cint(bulk):
+			new_codes, updated_codes, updated_names = import_tax_offices_bulk(codes, cint(update_existing))
+		else:
+			new_codes, updated_codes, updated_names = import_tax_offices(codes, cint(update_existing))
 
 		return "<p>Number of tax offices added: " + str(new_codes) + "<br>Updated codes: " + str(updated_codes) + "<br>Updated names: " + str(updated_names) + "</p><p>Number of tax offices found in XSD: " + str(len(codes)) + "</p>"
+
+
+def import_tax_offices(codes, update_existing):
+	"""
+	Inserts or updates JPK Tax Office documents one by one.
+
+	Returns tuple (new codes, updated codes, updated names).
+
+	Arguments:
+	- codes: dict: code -> tax office name
+	- update_existing: if True, names and codes of existing tax offices
+	  are updated
+	"""
+
+	new_codes = 0
+	updated_codes = 0
+	updated_names = 0
+
+	for code in codes:
+		# can be only one (or zero), because code is unique
+		existing_tax_office = frappe.db.get_list("JPK Tax Office", filters = {'code': code})
+
+		if len(existing_tax_office):
+			current_name = existing_tax_office[0].name
+			new_name = codes[code]
+			
+			if update_existing and current_name != new_name:
+				updated_names += 1
+				frappe.rename_doc("JPK Tax Office", current_name, new_name)
+		else:
+			if not frappe.db.exists("JPK Tax Office", codes[code]):
+				new_codes += 1
+				# create new "JPK Tax Office" type document
+				tax_office = frappe.get_doc({'doctype': 'JPK Tax Office', "code": code, "tax_office": codes[code]})
+				# save the document
+				tax_office.insert()
+			elif update_existing:
+				updated_codes += 1
+				tax_office = frappe.get_doc("JPK Tax Office", codes[code])
+				tax_office.code = code
+				tax_office.save()
+
+	return new_codes, updated_codes, updated_names
+
+
+def import_tax_offices_bulk(codes, update_existing):
+	"""
+	The same as import_tax_offices, but existing tax offices are loaded
+	with one query, and new tax offices and changed codes are written
+	with single statements. Only renames use frappe.rename_doc, because
+	links to renamed tax offices have to be updated.
+	"""
+
+	# name -> code and code -> name of existing tax offices
+	name_codes = {}
+	code_names = {}
+
+	for tax_office in frappe.get_all("JPK Tax Office", fields = ["name", "code"]):
+		name_codes[tax_office.name] = tax_office.code
+		code_names[tax_office.code] = tax_office.name
+
+	renames = []
+	code_updates = {}
+	inserts = {}
+	updated_codes = 0
+
+	# the same decisions as in import_tax_offices, with the state
+	# changed in memory
+	for code in codes:
+		new_name = codes[code]
+
+		if code in code_names:
+			current_name = code_names[code]
+
+			if update_existing and current_name != new_name:
+				renames.append((current_name, new_name))
+				del name_codes[current_name]
+				name_codes[new_name] = code
+				code_names[code] = new_name
+		else:
+			if new_name not in name_codes:
+				inserts[new_name] = code
+				name_codes[new_name] = code
+				code_names[code] = new_name
+			elif update_existing:
+				updated_codes += 1
+				# tax office added earlier in this import is inserted
+				# with the new code
+				if new_name in inserts:
+					inserts[new_name] = code
+				else:
+					code_updates[new_name] = code
+				code_names.pop(name_codes[new_name], None)
+				name_codes[new_name] = code
+				code_names[code] = new_name
+
+	for current_name, new_name in renames:
+		frappe.rename_doc("JPK Tax Office", current_name, new_name)
+
+	now_datetime = now()
+
+	if code_updates:
+		names = list(code_updates)
+		values = []
+		for name in names:
+			values += [name, code_updates[name]]
+
+		# codes can move between tax offices (e.g. B: c2 -> c3 and A: c1 ->
+		# c2), and the unique index of code is checked row by row, in order
+		# of names, not of the import. So codes of updated tax offices are
+		# cleared first (unique index allows many NULLs), and new codes,
+		# unique like after saving one by one, are set then.
+		frappe.db.sql("""
+			update `tabJPK Tax Office`
+			set code = null
+			where name in ({0})""".format(", ".join(["%s"] * len(names))),
+			names)
+
+		frappe.db.sql("""
+			update `tabJPK Tax Office`
+			set code = case name {0} end, modified = %s, modified_by = %s
+			where name in ({1})""".format(
+				" ".join(["when %s then %s"] * len(names)),
+				", ".join(["%s"] * len(names))
+				),
+			values + [now_datetime, frappe.session.user] + names)
+
+	if inserts:
+		frappe.db.bulk_insert(
+			"JPK Tax Office",
+			["name", "tax_office", "code", "owner", "modified_by", "creation", "modified", "docstatus", "idx"],
+			[(name, name, code, frappe.session.user, frappe.session.user, now_datetime, now_datetime, 0, 0) for name, code in inserts.items()]
+			)
+
+	return len(inserts), updated_codes, len(renames)
@@ -1,8 +1,81 @@
 # Copyright (c) 2021, Levitating Frog and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 import unittest
 
+from jpk_v7m.jpk_v7m.doctype.jpk_tax_office_importer.jpk_tax_office_importer import import_tax_offices, import_tax_offices_bulk
+
+# Imports: (existing tax offices: name -> code, codes from XSD: code -> name)
+imports = [
+	# codes moving between tax offices (B: T902 -> T903, then A: T901 -> T902)
+	({"_Test US A": "T901", "_Test US B": "T902"}, {"T903": "_Test US B", "T902": "_Test US A"}),
+	({"_Test US A": "T901", "_Test US B": "T902", "_Test US C": "T903"}, {"T904": "_Test US C", "T903": "_Test US B", "T902": "_Test US A"}),
+	# changed code, then new tax office with the old code
+	({"_Test US A": "T901"}, {"T902": "_Test US A", "T901": "_Test US N"}),
+	# new tax offices, renames and changed codes together
+	({"_Test US A": "T901", "_Test US B": "T902"}, {"T903": "_Test US A", "T901": "_Test US B", "T902": "_Test US D"}),
+	({"_Test US A": "T901", "_Test US B": "T902"}, {"T901": "_Test US X", "T905": "_Test US Y", "T902": "_Test US B"}),
+	({}, {"T901": "_Test US A", "T902": "_Test US B"})
+	]
+
+
 class TestJPKTaxOfficeImporter(unittest.TestCase):
-	pass
+
+	def setUp(self):
+		delete_test_tax_offices()
+
+	def tearDown(self):
+		delete_test_tax_offices()
+
+	def test_bulk_import_is_the_same_as_import(self):
+		"""
+		Bulk import gives the same numbers of changes and the same tax
+		offices as saving them one by one
+		"""
+
+		for existing_tax_offices, codes in imports:
+			for update_existing in (0, 1):
+				create_test_tax_offices(existing_tax_offices)
+				counters = import_tax_offices(codes, update_existing)
+				tax_offices = get_test_tax_offices()
+				delete_test_tax_offices()
+
+				create_test_tax_offices(existing_tax_offices)
+				bulk_counters = import_tax_offices_bulk(codes, update_existing)
+				bulk_tax_offices = get_test_tax_offices()
+				delete_test_tax_offices()
+
+				message = "{0} {1} {2}".format(existing_tax_offices, codes, update_existing)
+				self.assertEqual(bulk_counters, counters, message)
+				self.assertEqual(bulk_tax_offices, tax_offices, message)
+
+
+def create_test_tax_offices(tax_offices):
+	"""
+	Inserts test tax offices from dict: name -> code
+	"""
+
+	for name, code in tax_offices.items():
+		frappe.get_doc({"doctype": "JPK Tax Office", "tax_office": name, "code": code}).insert()
+
+
+def get_test_tax_offices():
+	"""
+	Returns sorted list of (name, tax_office, code) of test tax offices
+	"""
+
+	return sorted(tuple(tax_office) for tax_office in frappe.get_all(
+		"JPK Tax Office",
+		fields = ["name", "tax_office", "code"],
+		filters = {"name": ["like", "\\_Test US %"]},
+		as_list = True
+		))
+
+
+def delete_test_tax_offices():
+	"""
+	Deletes test tax offices (without checking links)
+	"""
+
+	frappe.db.sql("delete from `tabJPK Tax Office` where name like %s", ("\\_Test US %",))
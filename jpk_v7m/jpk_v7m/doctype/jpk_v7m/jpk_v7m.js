@@ -2,6 +2,15 @@
 // For license information, please see license.txt
 
 frappe.ui.form.on('JPK_V7M', {
+	setup(frm) {
+		// progress of background job (see JPKProgress in jpk_v7m.py);
+		// handler is registered once, not on every load of the form
+		frappe.realtime.off("jpk_v7m_progress");
+		frappe.realtime.on("jpk_v7m_progress", function(data) {
+			if (data.jpk === frm.doc.name) show_jpk_progress(frm, data);
+		});
+	},
+
 	onload(frm) {
 		if(frm.doc.year == undefined) {
 			var today = new Date();
@@ -20,6 +29,15 @@ frappe.ui.form.on('JPK_V7M', {
 			if(cur_frm.is_dirty()) frappe.msgprint("Dokument nie jest zapisany");
 			else call_jpk_creator(cur_frm);
 		})
+
+		frm.page.add_action_item("Przerwij generowanie XML", function() {
+			frm.call('cancel_jpk');
+		})
+
+		frm.page.add_action_item("Podgląd deklaracji", function() {
+			if(cur_frm.is_dirty()) frappe.msgprint("Dokument nie jest zapisany");
+			else show_declaration_preview(cur_frm);
+		})
 	},
 
 	onload_post_render(frm) {
@@ -38,12 +56,6 @@ frappe.ui.form.on('JPK_V7M', {
 			if(cur_frm.is_dirty()) frappe.msgprint("Dokument nie jest zapisany");
 			else call_jpk_creator(cur_frm);
 		})
-	},
-	
-	"company": function(frm) {
-		if(frm.doc.company) {
-			refresh_tax_accounts_tables(frm);
-		}
 	}
 });
 
@@ -82,17 +94,7 @@ function call_jpk_creator(frm)
 	var reasons_value = frm.fields_dict["amendment_reasons"].value;
 	if (reasons_value) amendment_reasons = reasons_value;
 	
-	var input_tax_accounts = frm.doc.input_tax_accounts;
-	var output_tax_accounts = frm.doc.output_tax_accounts;
-
-	var input_tax_accounts_list = [];
-	var output_tax_accounts_list = [];
-
-	input_tax_accounts.forEach(function(d) { input_tax_accounts_list.push(d.account_name);});
-	output_tax_accounts.forEach(function(d) { output_tax_accounts_list.push(d.account_name);});
-
-	console.log(input_tax_accounts_list);
-	console.log(output_tax_accounts_list);
+	// tax accounts are taken by the server from JPK Company Settings
 
 	frm.call('get_jpk', {
 	        is_guidance_accepted: is_guidance_accepted,
@@ -109,34 +111,60 @@ function call_jpk_creator(frm)
 	        email: email,
 	        phone: phone,
 	        forwarded_excess_of_input_tax: forwarded_excess_of_input_tax,
-	        amendment_reasons: amendment_reasons,
-		input_tax_accounts: input_tax_accounts_list,
-		output_tax_accounts: output_tax_accounts_list
+	        amendment_reasons: amendment_reasons
 	})
 	.then(r => {
 		if (r.message) {
-		var file_name = r.message;
-
-		// refresh attachments list
-		frm.attachments.attachment_uploaded(file_name);
-        	}
-        })	
+			frappe.show_alert("Generowanie XML rozpoczęte", 5);
+		}
+	})
 }
 
-function refresh_tax_accounts_tables(frm) {
-	refresh_tax_accounts_table(frm, "input_tax_accounts", "input_tax_accounts_list");
-	refresh_tax_accounts_table(frm, "output_tax_accounts", "output_tax_accounts_list");
+function show_declaration_preview(frm)
+{
+	// P_ fields from sums of submitted documents (without creating XML)
+	frm.call('get_declaration_preview')
+	.then(r => {
+		if (!r.message) return;
+
+		var rows = "";
+		$.each(r.message, function (field, value) {
+			if (value) rows += "<tr><td>" + field + "</td><td>" + value + "</td></tr>";
+		});
+
+		frappe.msgprint("<table class='table table-bordered'>" + rows + "</table>", "Podgląd deklaracji");
+	})
 }
 
-function refresh_tax_accounts_table(frm, target_doc_table, source_doc_table) {
+function show_jpk_progress(frm, data)
+{
+	var title = "Generowanie XML";
+
+	if (data.status == "Running") {
+		var percent = 0;
+		var description = "Dokumenty: " + data.documents_scanned + "/" + data.documents_total;
 
-	frm.clear_table(target_doc_table);
+		if (data.documents_total)
+			percent = 100 * data.documents_scanned / data.documents_total;
 
-	frappe.model.with_doc('JPK Company Settings', frm.doc.company, function () {
-		let source_doc = frappe.model.get_doc('JPK Company Settings', frm.doc.company);
-		$.each(source_doc[source_doc_table], function (index, source_row) {
-			frm.add_child(target_doc_table).account_name = source_row.account_name;
-			frm.refresh_field(target_doc_table);
-		});
-	});
+		if (data.phase != "documents")
+			description = "Wiersze XML: " + data.rows_emitted;
+
+		frm.dashboard.show_progress(title, percent, description);
+		return;
+	}
+
+	frm.dashboard.hide_progress(title);
+
+	if (data.status == "Done") {
+		frappe.show_alert("Utworzono plik " + data.file_name, 5);
+		// refresh attachments list
+		frm.reload_doc();
+	}
+	else if (data.status == "Cancelled") {
+		frappe.show_alert("Generowanie XML przerwane", 5);
+	}
+	else if (data.status == "Failed") {
+		frappe.msgprint(data.error, "Błąd generowania XML");
+	}
 }
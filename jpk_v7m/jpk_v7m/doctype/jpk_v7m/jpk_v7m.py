@@ -4,19 +4,102 @@
 
 from __future__ import unicode_literals
 import frappe
-import json
+from frappe import _
 import calendar
+import multiprocessing
+import os
 from frappe.model.document import Document
-from frappe.utils import flt
+from frappe.utils import cint, flt
 
 from jpk_v7m.external_tools.JPK_V7M_creator.jpk_v7m_creator import *
-from jpk_v7m.helpers.eu import get_eu_countries, eu_codes
-
-# Set global variables for better performance.
-# Calling get_eu_countries() would be inefficient.
-all_eu_countries = get_eu_countries()
-# Get list of EU countries without Poland
-other_eu_countries = get_eu_countries(omit_pl = True)
+from jpk_v7m.helpers.eu import eu_codes, is_eu_country
+from jpk_v7m.helpers.evidence_cache import get_cached_results, get_fingerprint, set_cached_results
+from jpk_v7m.helpers.metrics import measure_phase, start_metrics, stop_metrics
+from jpk_v7m.helpers.monthly_totals import (delete_document_totals, delete_monthly_totals, get_document_key,
+	get_document_totals, get_monthly_totals, set_document_totals)
+from jpk_v7m.helpers.profiling import run_profiled
+from jpk_v7m.helpers.tax_accounts import get_tax_accounts
+from jpk_v7m.helpers.tax_detail import get_item_wise_tax
+from jpk_v7m.helpers.party_cache import get_cached_party_values, get_party_cache_stats, reset_party_cache
+
+
+# Timeout (in seconds) of background job creating JPK file
+jpk_job_timeout = 3 * 60 * 60
+
+# Max number of parent names in single "in" filter of bulk queries
+bulk_query_size = 1000
+
+# Min number of documents to use process pool (see process_in_chunks)
+parallel_min_documents = 2000
+
+# Number of documents processed as single task
+chunk_size = 500
+
+# Tuple of function, items and arguments processed by workers of
+# process_in_chunks (set before the pool is forked)
+parallel_task = None
+
+# Tax rates of output tax and their groups in get_output_tax_details_batch
+# (NOTE: 5% is added to the same group as 7% and 8%)
+output_tax_rate_groups = {
+	22.0: "vat22",
+	23.0: "vat22",
+	7.0: "vat7",
+	8.0: "vat7",
+	5.0: "vat7"
+	}
+
+# Fields required to process invoices without loading full documents
+# (see get_invoices):
+# - fields: fields of the invoice
+# - items, taxes: child table doctype and its fields
+invoice_fields = {
+	"Purchase Invoice": {
+		"fields": [
+			"name",
+			"supplier",
+			"supplier_name",
+			"supplier_address",
+			"tax_id",
+			"bill_no",
+			"bill_date",
+			"is_split_payment",
+			"modified"
+			],
+		"items": ("Purchase Invoice Item", [
+			"item_code",
+			"item_name",
+			"net_amount",
+			"is_fixed_asset"
+			]),
+		"taxes": ("Purchase Taxes and Charges", [
+			"account_head",
+			"item_wise_tax_detail"
+			])
+		},
+	"Sales Invoice": {
+		"fields": [
+			"name",
+			"customer",
+			"customer_name",
+			"customer_address",
+			"shipping_address_name",
+			"tax_id",
+			"posting_date",
+			"is_split_payment",
+			"modified"
+			],
+		"items": ("Sales Invoice Item", [
+			"item_code",
+			"item_name",
+			"net_amount"
+			]),
+		"taxes": ("Sales Taxes and Charges", [
+			"account_head",
+			"item_wise_tax_detail"
+			])
+		}
+	}
 
 
 class JPK_V7M(Document):
@@ -32,13 +115,12 @@ class JPK_V7M(Document):
 
 		partial_name = self.abbr + "-" + self.year + "-" + "{:02d}".format(int(self.month)) + "-"
 
-		other_docs = frappe.get_all("JPK_V7M",
-			fields=['name'],
+		# prefix "like" uses primary key (name), and only the number of rows
+		# is returned
+		num_of_docs = frappe.db.count("JPK_V7M",
 			filters={'name': ['like', partial_name + "%"]}
 		)
 
-		num_of_docs = len(other_docs)
-
 		if self.is_amendment == "No":
 			self.consecutive_number = 1
 		elif num_of_docs > 1:
@@ -53,6 +135,99 @@ class JPK_V7M(Document):
 
 	@frappe.whitelist()
 	def get_jpk(self,
+		is_guidance_accepted,
+		purpose,
+		tax_office_code,
+		year,
+		month,
+		is_natural_person,
+		first_name,
+		last_name,
+		date_of_birth,
+		full_name,
+		tax_number,
+		email,
+		phone,
+		forwarded_excess_of_input_tax,
+		amendment_reasons
+	):
+		"""
+		Enqueues creation of JPK_V7M xml file as background job, so big
+		number of documents doesn't block a web worker.
+
+		Progress is published as realtime "jpk_v7m_progress" events (see
+		JPKProgress). The file is attached to the document when done.
+
+		Only one job per document can be queued or running, because every
+		job writes the same file (see acquire_jpk_job_lock).
+
+		Returns id of the background job.
+		"""
+
+		if not acquire_jpk_job_lock(self.name):
+			frappe.throw(_("JPK file of {0} is already being generated").format(self.name))
+
+		frappe.cache().delete_value(get_cancel_key(self.name))
+
+		try:
+			job = frappe.enqueue(
+				"jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m.generate_jpk",
+				queue = "long",
+				timeout = jpk_job_timeout,
+				job_name = "JPK_V7M " + self.name,
+				jpk_name = self.name,
+				arguments = {
+					"is_guidance_accepted": is_guidance_accepted,
+					"purpose": purpose,
+					"tax_office_code": tax_office_code,
+					"year": year,
+					"month": month,
+					"is_natural_person": is_natural_person,
+					"first_name": first_name,
+					"last_name": last_name,
+					"date_of_birth": date_of_birth,
+					"full_name": full_name,
+					"tax_number": tax_number,
+					"email": email,
+					"phone": phone,
+					"forwarded_excess_of_input_tax": forwarded_excess_of_input_tax,
+					"amendment_reasons": amendment_reasons
+					}
+				)
+		except Exception:
+			release_jpk_job_lock(self.name)
+			raise
+
+		if job:
+			return job.id
+
+
+	@frappe.whitelist()
+	def cancel_jpk(self):
+		"""
+		Requests cancellation of running JPK generation. The job stops at
+		the next progress check.
+		"""
+
+		frappe.cache().set_value(get_cancel_key(self.name), 1, expires_in_sec = jpk_job_timeout)
+
+
+	@frappe.whitelist()
+	def get_declaration_preview(self):
+		"""
+		Returns dict: P_ field name -> value, calculated from current sums
+		of submitted documents of the month (see get_declaration_preview)
+		"""
+
+		return get_declaration_preview(
+			self.company,
+			self.year,
+			self.month,
+			self.forwarded_excess_of_input_tax
+			)
+
+
+	def create_jpk_file(self,
 		is_guidance_accepted,
 		purpose,
 		tax_office_code,
@@ -68,126 +243,335 @@ class JPK_V7M(Document):
 		phone,
 		forwarded_excess_of_input_tax,
 		amendment_reasons,
-		input_tax_accounts,
-		output_tax_accounts
+		progress = None
 	):
 		"""
 		Main method, calling functions for gathering processed documents
 		data and creating JPK_V7M xml file.
-		"""
 
-		input_tax_documents = get_input_tax_documents(year, month, input_tax_accounts)
-		output_tax_documents = get_output_tax_documents(year, month, output_tax_accounts)
-
-		file_name = "JPK_V7M-" + self.name + ".xml"
-		file_path_short = "/private/files/" + file_name
-		file_path = frappe.local.site + file_path_short
-		app_name = "ERPNext " + frappe.get_module("erpnext").__version__
-
-		create_jpk(
-			is_guidance_accepted,
-			purpose,
-			tax_office_code,
-			year,
-			month,
-			is_natural_person,
-			first_name,
-			last_name,
-			date_of_birth,
-			full_name,
-			tax_number,
-			email,
-			phone,
-			forwarded_excess_of_input_tax,
-			input_tax_documents,
-			output_tax_documents,
-			amendment_reasons,
-			app_name,
-			file_path
-		)
+		Arguments are the same as in get_jpk, and:
+		- progress: JPKProgress object or None
+
+		Tax accounts are taken from JPK Company Settings of the company (see
+		get_tax_accounts).
+
+		Time, number of queries, rows and memory growth of every phase are
+		written to "jpk_v7m" log and to generation_phases table (see
+		save_generation_phases).
 
-		new_file = frappe.get_doc({
-			'doctype': 'File',
-			'attached_to_doctype': self.doctype,
-			'attached_to_name': self.name,
-			'file_url': file_path_short,
-			'file_name': file_name,
-			'is_private': 1
-		})
-    
-		new_file.insert()
+		Returns name of the created file.
+		"""
+
+		# metrics are stopped (and frappe.db.sql restored) also if the
+		# generation fails
+		metrics = start_metrics()
+
+		try:
+			with measure_phase("tax_accounts"):
+				input_tax_accounts, output_tax_accounts = get_tax_accounts(self.company)
+
+			# parties, addresses and countries are read from database only once
+			# per run (or once between runs if shared cache is enabled)
+			reset_party_cache(use_shared_cache = bool(frappe.conf.get("jpk_v7m_shared_party_cache")))
+
+			input_tax_documents, output_tax_documents = get_tax_documents(
+				year,
+				month,
+				input_tax_accounts,
+				output_tax_accounts,
+				progress,
+				self.company
+				)
+
+			file_name = "JPK_V7M-" + self.name + ".xml"
+			file_path_short = "/private/files/" + file_name
+			file_path = frappe.local.site + file_path_short
+			app_name = "ERPNext " + frappe.get_module("erpnext").__version__
+
+			progress_callback = None
+			if progress:
+				progress.set_phase("xml")
+				progress_callback = progress.add_rows_emitted
+
+			# set when the file is attached to the document
+			file_attached = False
+
+			try:
+				# rows are built and written element by element, so both are
+				# measured as one phase
+				with measure_phase("xml") as phase:
+					create_jpk(
+						is_guidance_accepted,
+						purpose,
+						tax_office_code,
+						year,
+						month,
+						is_natural_person,
+						first_name,
+						last_name,
+						date_of_birth,
+						full_name,
+						tax_number,
+						email,
+						phone,
+						forwarded_excess_of_input_tax,
+						input_tax_documents,
+						output_tax_documents,
+						amendment_reasons,
+						app_name,
+						file_path,
+						streaming = True,
+						progress_callback = progress_callback
+						)
+
+					phase["rows"] = len(input_tax_documents) + len(output_tax_documents)
+					phase["output_bytes"] = os.path.getsize(file_path)
+
+				with measure_phase("attach_file"):
+					new_file = frappe.get_doc({
+						'doctype': 'File',
+						'attached_to_doctype': self.doctype,
+						'attached_to_name': self.name,
+						'file_url': file_path_short,
+						'file_name': file_name,
+						'is_private': 1
+					})
+
+					new_file.insert()
+					file_attached = True
+			finally:
+				# don't leave incomplete or not attached file (cancelled or failed
+				# generation)
+				if not file_attached and os.path.exists(file_path):
+					os.remove(file_path)
+		finally:
+			stop_metrics()
+
+		frappe.logger("jpk_v7m").info({
+			"jpk": self.name,
+			"metrics": metrics.as_dict(),
+			"party_cache": get_party_cache_stats()
+			})
+
+		self.save_generation_phases(metrics.phases)
 
 		return file_name
 
 
-def get_input_tax_documents(year, month, tax_accounts):
+	def save_generation_phases(self, phases):
+		"""
+		Replaces rows of generation_phases table with metrics of the last
+		JPK generation. Rows are written directly, so the document (which can
+		be submitted) isn't saved again.
+
+		Arguments:
+		- phases: list of dicts (see PhaseMetrics)
+		"""
+
+		frappe.db.delete("JPK_V7M Phase", {"parent": self.name, "parenttype": self.doctype})
+
+		for idx, phase in enumerate(phases, 1):
+			row = frappe.get_doc({
+				"doctype": "JPK_V7M Phase",
+				"parent": self.name,
+				"parenttype": self.doctype,
+				"parentfield": "generation_phases",
+				"idx": idx,
+				"phase": phase["phase"],
+				"seconds": phase["seconds"],
+				"queries": phase["queries"],
+				"rows": phase["rows"],
+				"rss_delta_mb": phase["rss_delta_mb"],
+				"rss_mb": phase["rss_mb"]
+				})
+			row.db_insert()
+
+
+class JPKGenerationCancelled(Exception):
 	"""
-	Return processed:
-	- Purchase Invoices from Poland
-	- Purchase Invoices from other EU countries
-	- Customs clearance data for import in standard procedure
+	Raised in background job when the user cancelled JPK generation
+	"""
+	pass
 
-	WARNING! Not implemented:
-	- Internal documents
+
+class JPKProgress(object):
+	"""
+	Collects progress of JPK generation, publishes it as realtime events
+	and checks if the user requested cancellation.
+
+	Published event: "jpk_v7m_progress", message: dict with keys:
+	- jpk: name of JPK_V7M document
+	- status: "Running", "Done", "Cancelled" or "Failed"
+	- phase: "documents", "xml" (and "output_tax_rows", "input_tax_rows"
+	  reported by the creator)
+	- documents_total, documents_scanned, rows_emitted
+	- file_name (when done) or error (when failed)
 	"""
 
-	documents = []
+	def __init__(self, jpk_name, interval = 500):
+		"""
+		Arguments:
+		- jpk_name: name of JPK_V7M document
+		- interval: number of documents or rows between published events
+		  and cancellation checks
+		"""
 
-	# for calculation of month length
-	year_int = int(year)
-	month_int = int(month)
-	
-	month_days = calendar.monthrange(year_int, month_int)[1]
+		self.jpk_name = jpk_name
+		self.user = frappe.session.user
+		self.interval = interval
+		self.phase = "documents"
+		self.documents_total = 0
+		self.documents_scanned = 0
+		self.rows_emitted = 0
+		# counters at the moment of last published event
+		self.documents_published = 0
+		self.rows_published = 0
+
+	def add_documents_total(self, count):
+		self.documents_total += count
+		self.publish()
+
+	def document_scanned(self, count = 1):
+		self.documents_scanned += count
+		if self.documents_scanned - self.documents_published >= self.interval:
+			self.check_cancelled()
+			self.publish()
+
+	def set_phase(self, phase):
+		self.phase = phase
+		self.check_cancelled()
+		self.publish()
+
+	def add_rows_emitted(self, phase, count):
+		"""
+		Callback for create_jpk (progress_callback)
+		"""
 
-	# year and month in format YYYY-DD-
-	year_and_month = year + "-" + "{:02d}".format(month_int) + "-"
+		self.phase = phase
+		self.rows_emitted += count
+		if self.rows_emitted - self.rows_published >= self.interval:
+			self.check_cancelled()
+			self.publish()
 
-	start_date = year_and_month + "01"
-	end_date = year_and_month + str(month_days)
+	def check_cancelled(self):
+		if frappe.cache().get_value(get_cancel_key(self.jpk_name)):
+			raise JPKGenerationCancelled()
 
-	# find and process all purchase invoices
-	invoice_names = frappe.db.get_all(
-		"Purchase Invoice",
-		filters = [
-				['posting_date', '>=', start_date],
-				['posting_date', '<=', end_date]
-			],
-		order_by = 'creation'
-		)
+	def publish(self, status = "Running", **kwargs):
+		message = {
+			"jpk": self.jpk_name,
+			"status": status,
+			"phase": self.phase,
+			"documents_total": self.documents_total,
+			"documents_scanned": self.documents_scanned,
+			"rows_emitted": self.rows_emitted
+			}
+		message.update(kwargs)
 
-	for invoice_name in invoice_names:
-		doc = frappe.get_doc("Purchase Invoice", invoice_name)
-		document = process_input_tax_document(doc, tax_accounts)
-		# document will be None if supplier not from EU
-		if document:
-			documents.append(document)
+		self.documents_published = self.documents_scanned
+		self.rows_published = self.rows_emitted
 
-	# find and process all customs clearance journal entries
-	journal_entries = frappe.db.get_all(
-		"Journal Entry",
-		filters = [
-				['posting_date', '>=', start_date],
-				['posting_date', '<=', end_date]
-			],
-		order_by = 'creation'
-		)
+		frappe.publish_realtime("jpk_v7m_progress", message, user = self.user)
+
+
+def generate_jpk(jpk_name, arguments):
+	"""
+	Background job creating JPK_V7M xml file (see JPK_V7M.get_jpk)
+
+	If "profile_generation" is checked in the document, the generation is
+	run under cProfile and tracemalloc (see run_profiled).
+
+	Arguments:
+	- jpk_name: name of JPK_V7M document
+	- arguments: dict of arguments for JPK_V7M.create_jpk_file
+	"""
+
+	progress = JPKProgress(jpk_name)
+
+	try:
+		doc = frappe.get_doc("JPK_V7M", jpk_name)
+
+		if cint(doc.profile_generation):
+			file_name = run_profiled(doc, doc.create_jpk_file, progress = progress, **arguments)
+		else:
+			file_name = doc.create_jpk_file(progress = progress, **arguments)
+	except JPKGenerationCancelled:
+		frappe.db.rollback()
+		progress.publish("Cancelled")
+		return
+	except Exception as e:
+		progress.publish("Failed", error = str(e))
+		raise
+	finally:
+		frappe.cache().delete_value(get_cancel_key(jpk_name))
+		release_jpk_job_lock(jpk_name)
+
+	progress.publish("Done", file_name = file_name)
+
+
+def acquire_jpk_job_lock(jpk_name):
+	"""
+	Marks JPK generation of given document as queued or running. Returns
+	False if it is already marked.
+
+	The mark is set atomically (redis SET NX) and expires after
+	jpk_job_timeout, so a job killed without cleanup doesn't block the
+	document for ever.
+	"""
+
+	cache = frappe.cache()
+
+	return bool(cache.set(cache.make_key(get_job_lock_key(jpk_name)), 1, nx = True, ex = jpk_job_timeout))
+
+
+def release_jpk_job_lock(jpk_name):
+	"""
+	Removes the mark set by acquire_jpk_job_lock
+	"""
+
+	frappe.cache().delete_value(get_job_lock_key(jpk_name))
+
+
+def get_job_lock_key(jpk_name):
+	"""
+	Returns cache key marking queued or running JPK generation
+	"""
 
-	for entry_name in journal_entries:
-		entry = frappe.get_doc("Journal Entry", entry_name)
-		if entry.jpk_is_imp:
-			document = process_import_input_tax_document(entry, tax_accounts)
-			if document:
-				documents.append(document)
+	return "jpk_v7m_job:" + jpk_name
 
-	return documents
 
+def get_cancel_key(jpk_name):
+	"""
+	Returns cache key used to request cancellation of JPK generation
+	"""
 
-def get_output_tax_documents(year, month, tax_accounts):
+	return "jpk_v7m_cancel:" + jpk_name
+
+
+def get_tax_documents(year, month, input_tax_accounts, output_tax_accounts, progress = None, company = None):
 	"""
-	Returns processed:
+	Returns tuple of lists (input tax documents, output tax documents).
+
+	Input tax documents are processed:
+	- Purchase Invoices from Poland
+	- Purchase Invoices from other EU countries
+	- Customs clearance data for import in standard procedure
+
+	Output tax documents are processed:
 	- Sales Invoices for customers in Poland
 	- Purchase Invoices from suppliers from other EU contries
 
+	Purchase Invoices of the period are loaded only once. The same loaded
+	invoice is used for input tax row and (for suppliers from other EU
+	countries) for output tax row.
+
+	Only submitted documents (of given company, if set) are selected by the
+	database queries.
+
+	Arguments:
+	- progress: JPKProgress object or None
+	- company: name of the company, or None for all companies
+
 	WARNING! Not implemented:
 	- import of goods in simplified procedure
 	- internal documents
@@ -197,13 +581,53 @@ def get_output_tax_documents(year, month, tax_accounts):
 	# - import of goods in simplified procedure
 	# - internal documents
 
-	documents = []
+	start_date, end_date = get_period_dates(year, month)
+	filters = get_document_filters(company)
+
+	purchase_invoices = get_invoices("Purchase Invoice", start_date, end_date, filters)
+
+	if progress:
+		progress.add_documents_total(len(purchase_invoices))
+
+	input_tax_documents, eu_purchase_documents = process_purchase_invoices(
+		purchase_invoices,
+		start_date[:7],
+		input_tax_accounts,
+		output_tax_accounts,
+		progress
+		)
+
+	input_tax_documents += get_import_input_tax_documents(start_date, end_date, input_tax_accounts, progress, filters)
+
+	output_tax_documents = get_sales_output_tax_documents(start_date, end_date, output_tax_accounts, progress, filters)
+	output_tax_documents += eu_purchase_documents
+
+	return input_tax_documents, output_tax_documents
+
+
+def get_document_filters(company = None):
+	"""
+	Returns list of filters for documents taken into account in JPK:
+	submitted documents of given company (or all companies if None)
+	"""
+
+	filters = [['docstatus', '=', 1]]
+
+	if company:
+		filters.append(['company', '=', company])
+
+	return filters
+
+
+def get_period_dates(year, month):
+	"""
+	Returns tuple of first and last day of the month (strings YYYY-MM-DD)
+	"""
 
 	# for calculation of month length
 	year_int = int(year)
 	month_int = int(month)
-	
-	# month length
+
 	month_days = calendar.monthrange(year_int, month_int)[1]
 
 	# year and month in format YYYY-DD-
@@ -212,44 +636,539 @@ def get_output_tax_documents(year, month, tax_accounts):
 	start_date = year_and_month + "01"
 	end_date = year_and_month + str(month_days)
 
-	# find and process all sales invoices
-	invoice_names = frappe.db.get_all(
-		"Sales Invoice",
-		filters = [
-				['posting_date', '>=', start_date],
-				['posting_date', '<=', end_date]
-			],
-		order_by = 'creation'
+	return start_date, end_date
+
+
+def process_purchase_invoices(invoices, period, input_tax_accounts, output_tax_accounts, progress = None):
+	"""
+	Returns tuple of lists (input tax documents, output tax documents) for
+	given Purchase Invoices.
+
+	Party data is resolved once per invoice and used for both rows. Output
+	tax document is created only for suppliers from other EU countries
+	(intra-community acquisition of goods).
+
+	Arguments:
+	- period: month of posting date (YYYY-MM), used for evidence cache
+	"""
+
+	input_tax_documents = []
+	output_tax_documents = []
+
+	results = process_documents(
+		invoices,
+		period,
+		process_purchase_invoices_chunk,
+		(input_tax_accounts, output_tax_accounts),
+		progress
 		)
 
-	for invoice_name in invoice_names:
-		doc = frappe.get_doc("Sales Invoice", invoice_name)
-		document = process_output_tax_document(doc, tax_accounts)
-		if document:
-			documents.append(document)
-
-	# find and process purchase invoices from EU suppliers
-	purchase_invoice_names = frappe.db.get_all(
-		"Purchase Invoice",
-		filters = [
-				['posting_date', '>=', start_date],
-				['posting_date', '<=', end_date]
-			],
-		order_by = 'creation'
+	for input_tax_document, output_tax_document in results:
+		# input tax document will be None if supplier not from EU
+		if input_tax_document:
+			input_tax_documents.append(input_tax_document)
+
+		if output_tax_document:
+			output_tax_documents.append(output_tax_document)
+
+	return input_tax_documents, output_tax_documents
+
+
+def process_purchase_invoices_chunk(invoices_with_party, input_tax_accounts, output_tax_accounts):
+	"""
+	Returns list of tuples (input tax document, output tax document) for
+	given list of tuples (Purchase Invoice, party data). Any document in
+	returned tuple can be None.
+
+	Doesn't use database, so it can be called in other process.
+	"""
+
+	results = []
+
+	for invoice, party in invoices_with_party:
+		input_tax_document = process_input_tax_document(invoice, input_tax_accounts, party)
+
+		output_tax_document = None
+		if is_other_eu_country_code(party["country_code"]):
+			output_tax_document = process_eu_purchase_output_tax_document(invoice, output_tax_accounts, party)
+
+		results.append((input_tax_document, output_tax_document))
+
+	return results
+
+
+def process_sales_invoices(invoices, period, tax_accounts, progress = None):
+	"""
+	Returns list of output tax documents for given Sales Invoices
+
+	Arguments:
+	- period: month of posting date (YYYY-MM), used for evidence cache
+	"""
+
+	results = process_documents(
+		invoices,
+		period,
+		process_sales_invoices_chunk,
+		(tax_accounts,),
+		progress
+		)
+
+	return [document for document in results if document]
+
+
+def process_sales_invoices_chunk(invoices_with_party, tax_accounts):
+	"""
+	Returns list of output tax documents (or None) for given list of tuples
+	(Sales Invoice, party data).
+
+	Doesn't use database, so it can be called in other process.
+	"""
+
+	# tax details are calculated in one pass for all invoices processed
+	# further (see process_output_tax_document)
+	domestic_invoices = [invoice for invoice, party in invoices_with_party if party["country_code"] == "PL"]
+
+	tax_details = {}
+	for invoice, details in zip(domestic_invoices, get_output_tax_details_batch(domestic_invoices, tax_accounts)):
+		tax_details[invoice.name] = details
+
+	return [
+		process_output_tax_document(invoice, tax_accounts, party, tax_details.get(invoice.name))
+		for invoice, party in invoices_with_party
+		]
+
+
+def process_documents(documents, period, function, arguments, progress = None):
+	"""
+	Returns list of results of processing of given invoices, in order of
+	documents.
+
+	Results for documents not changed since last run (the same "modified",
+	arguments and party data) are taken from evidence cache. Only other
+	documents get child rows loaded and are processed, by calling
+	function(list of (document, party data), *arguments) for chunks (see
+	process_in_chunks).
+
+	Arguments:
+	- documents: list of InvoiceRecord without child rows (see get_invoices)
+	- period: month of posting date (YYYY-MM)
+	- function: function processing the chunk, returning list of results
+	- arguments: tuple of other arguments of function
+	- progress: JPKProgress object or None
+	"""
+
+	if not documents:
+		return []
+
+	doctype = documents[0].doctype
+	fingerprint = get_fingerprint(*arguments)
+
+	# party data requires database, so it's resolved before processing
+	# (which can be done in other processes)
+	with measure_phase("parties") as phase:
+		parties = [get_party_data(document) for document in documents]
+		phase["rows"] = len(parties)
+
+	with measure_phase("evidence_cache"):
+		cached_results = get_cached_results(doctype, period, documents, fingerprint, parties)
+
+	if progress and cached_results:
+		progress.document_scanned(len(cached_results))
+
+	changed = [i for i, document in enumerate(documents) if document.name not in cached_results]
+	changed_documents = [documents[i] for i in changed]
+	changed_parties = [parties[i] for i in changed]
+
+	with measure_phase("load_documents"):
+		load_invoice_child_rows(changed_documents)
+
+	# tax details and rows of evidence
+	with measure_phase("processing") as phase:
+		chunk_results = process_in_chunks(
+			function,
+			list(zip(changed_documents, changed_parties)),
+			arguments,
+			progress
+			)
+
+		changed_results = [result for chunk in chunk_results for result in chunk]
+		phase["rows"] = len(changed_results)
+
+	with measure_phase("evidence_cache"):
+		set_cached_results(doctype, period, changed_documents, changed_results, fingerprint, changed_parties)
+
+	results = cached_results
+	for document, result in zip(changed_documents, changed_results):
+		results[document.name] = result
+
+	return [results[document.name] for document in documents]
+
+
+def process_in_chunks(function, items, arguments, progress = None):
+	"""
+	Calls function(chunk, *arguments) for consecutive chunks of items and
+	returns list of results in order of chunks.
+
+	If site config contains "jpk_v7m_workers" greater than 1 and there are
+	at least parallel_min_documents items, chunks are processed in a pool of
+	processes. The function must not use database or cache in such case.
+	The order of results is the same as in sequential processing. Forking
+	and pickling of results cost more than processing of small chunks, so
+	the pool pays off only with free CPU cores (compare runs of
+	jpk-benchmark with --workers).
+
+	Arguments:
+	- function: function processing list of items
+	- items: list of items (e.g. tuples of document and party data)
+	- arguments: tuple of other arguments of function
+	- progress: JPKProgress object or None
+	"""
+
+	global parallel_task
+
+	chunk_ranges = [(i, min(i + chunk_size, len(items))) for i in range(0, len(items), chunk_size)]
+
+	workers = cint(frappe.conf.get("jpk_v7m_workers"))
+
+	results = []
+
+	if workers > 1 and len(items) >= parallel_min_documents:
+		# workers are forked after parallel_task is set, so they read items
+		# from their copy of memory; only index ranges of chunks are sent
+		# to them and only results are pickled back
+		parallel_task = (function, items, arguments)
+		try:
+			context = multiprocessing.get_context("fork")
+			with context.Pool(min(workers, len(chunk_ranges))) as pool:
+				# imap returns results in order of chunks
+				for (start, end), result in zip(chunk_ranges, pool.imap(process_chunk, chunk_ranges)):
+					results.append(result)
+					if progress:
+						progress.document_scanned(end - start)
+		finally:
+			parallel_task = None
+	else:
+		for start, end in chunk_ranges:
+			results.append(function(items[start:end], *arguments))
+			if progress:
+				progress.document_scanned(end - start)
+
+	return results
+
+
+def process_chunk(chunk_range):
+	"""
+	Calls function of parallel_task for items in chunk_range (tuple of
+	start and end index). Used by workers of process_in_chunks.
+	"""
+
+	function, items, arguments = parallel_task
+	start, end = chunk_range
+
+	return function(items[start:end], *arguments)
+
+
+def get_import_input_tax_documents(start_date, end_date, tax_accounts, progress = None, filters = None):
+	"""
+	Returns processed customs clearance Journal Entries posted in given period
+	(see process_journal_entries)
+	"""
+
+	journal_entries, results = process_journal_entries(start_date, end_date, tax_accounts, progress, filters)
+
+	return [document for document in results if document]
+
+
+def process_journal_entries(start_date, end_date, tax_accounts, progress = None, filters = None):
+	"""
+	Returns tuple (customs clearance Journal Entries posted in given period,
+	list of results of processing, in order of entries)
+
+	Only entries marked as customs clearance (jpk_is_imp) are selected.
+	Entries not found in evidence cache are processed with their accounts
+	and Purchase Invoices loaded by bulk queries, not with frappe.get_doc.
+
+	Arguments:
+	- filters: optional list of additional filters
+	"""
+
+	# find and process all customs clearance journal entries
+	with measure_phase("load_documents") as phase:
+		journal_entries = frappe.db.get_all(
+			"Journal Entry",
+			fields = ["name", "modified", "jpk_purchase_invoice", "bill_no", "bill_date", "jpk_imp_net"],
+			filters = [
+					['posting_date', '>=', start_date],
+					['posting_date', '<=', end_date],
+					['jpk_is_imp', '=', 1]
+				] + (filters or []),
+			order_by = 'creation'
+			)
+		phase["rows"] = len(journal_entries)
+
+		# result depends on the linked Purchase Invoice and its party, so
+		# invoices (without child rows) are loaded for all entries
+		invoices = get_journal_entry_invoices(journal_entries)
+
+	if progress:
+		progress.add_documents_total(len(journal_entries))
+
+	with measure_phase("parties") as phase:
+		parties = [get_journal_entry_party_data(entry, invoices) for entry in journal_entries]
+		phase["rows"] = len(parties)
+
+	linked = [get_linked_modified(entry, invoices) for entry in journal_entries]
+
+	period = start_date[:7]
+	fingerprint = get_fingerprint(tax_accounts)
+
+	# entries not changed since last run (with the same invoice and party)
+	# are not loaded again
+	with measure_phase("evidence_cache"):
+		cached_results = get_cached_results("Journal Entry", period, journal_entries, fingerprint, parties, linked)
+
+	changed = [i for i, entry in enumerate(journal_entries) if entry.name not in cached_results]
+	changed_entries = [journal_entries[i] for i in changed]
+	changed_results = []
+
+	with measure_phase("load_documents"):
+		load_journal_entry_rows(changed_entries)
+
+	results = []
+
+	with measure_phase("processing") as phase:
+		for entry in journal_entries:
+			if entry.name in cached_results:
+				document = cached_results[entry.name]
+			else:
+				invoice = invoices.get(entry.jpk_purchase_invoice)
+				document = process_import_input_tax_document(entry, tax_accounts, invoice)
+				changed_results.append(document)
+
+			results.append(document)
+
+			if progress:
+				progress.document_scanned()
+
+		phase["rows"] = len(changed_results)
+
+	with measure_phase("evidence_cache"):
+		set_cached_results(
+			"Journal Entry",
+			period,
+			changed_entries,
+			changed_results,
+			fingerprint,
+			[parties[i] for i in changed],
+			[linked[i] for i in changed]
+			)
+
+	return journal_entries, results
+
+
+def load_journal_entry_rows(journal_entries):
+	"""
+	Fills "accounts" list of given Journal Entries (records from get_all)
+	with account rows
+	"""
+
+	entries_by_name = {}
+
+	for entry in journal_entries:
+		entry.accounts = []
+		entries_by_name[entry.name] = entry
+
+	account_rows = get_child_rows(
+		"Journal Entry Account",
+		"Journal Entry",
+		list(entries_by_name),
+		["account", "debit", "credit"]
 		)
 
-	for invoice_name in purchase_invoice_names:
+	for account in account_rows:
+		entries_by_name[account.parent].accounts.append(account)
+
+
+def get_journal_entry_invoices(journal_entries):
+	"""
+	Returns dict: name -> Purchase Invoice record (InvoiceRecord without
+	child rows) for invoices linked to given Journal Entries by
+	jpk_purchase_invoice
+	"""
+
+	invoice_names = list({entry.jpk_purchase_invoice for entry in journal_entries if entry.jpk_purchase_invoice})
+	invoices = {}
+
+	for i in range(0, len(invoice_names), bulk_query_size):
+		records = frappe.get_all(
+			"Purchase Invoice",
+			fields = invoice_fields["Purchase Invoice"]["fields"],
+			filters = {"name": ["in", invoice_names[i:i + bulk_query_size]]}
+			)
+
+		for record in records:
+			invoices[record.name] = InvoiceRecord("Purchase Invoice", record)
+
+	return invoices
+
+
+def get_journal_entry_party_data(entry, invoices):
+	"""
+	Returns party data of Purchase Invoice linked to given Journal Entry
+	(see get_party_data), or None if the invoice is not loaded
+	"""
+
+	invoice = invoices.get(entry.jpk_purchase_invoice)
+
+	if invoice is None:
+		return None
+
+	return get_party_data(invoice)
+
+
+def get_linked_modified(entry, invoices):
+	"""
+	Returns "modified" of Purchase Invoice linked to given Journal Entry, or
+	None if the invoice is not loaded
+	"""
+
+	invoice = invoices.get(entry.jpk_purchase_invoice)
+
+	if invoice is None:
+		return None
+
+	return invoice.modified
+
+
+def get_invoices(doctype, start_date, end_date, filters = None):
+	"""
+	Returns Purchase or Sales Invoices posted in given period, ordered by
+	creation.
+
+	Instead of loading every invoice with frappe.get_doc (separate queries
+	for the invoice and each of its child tables), parent fields of all
+	invoices are fetched with one query, and child rows with a few
+	set-based queries (see load_invoice_child_rows) - only for invoices
+	that need processing.
+
+	Every returned record is InvoiceRecord with fields listed in
+	invoice_fields, so it can be used in place of the invoice document.
+
+	Arguments:
+	- doctype: "Purchase Invoice" or "Sales Invoice"
+	- filters: optional list of additional filters
+	"""
+
+	with measure_phase("load_documents") as phase:
+		invoices = frappe.get_all(
+			doctype,
+			fields = invoice_fields[doctype]["fields"],
+			filters = [
+					['posting_date', '>=', start_date],
+					['posting_date', '<=', end_date]
+				] + (filters or []),
+			order_by = 'creation'
+			)
+		phase["rows"] = len(invoices)
+
+	return [InvoiceRecord(doctype, invoice) for invoice in invoices]
+
+
+def load_invoice_child_rows(invoices):
+	"""
+	Fills "items" and "taxes" lists of given InvoiceRecords (of the same
+	doctype) with child rows, fetched with a few set-based queries.
+	"""
+
+	if not invoices:
+		return
+
+	doctype = invoices[0].doctype
+	fields = invoice_fields[doctype]
+
+	invoices_by_name = {}
+
+	for invoice in invoices:
+		invoices_by_name[invoice.name] = invoice
+
+	invoice_names = list(invoices_by_name)
+
+	items_doctype, items_fields = fields["items"]
+	for item in get_child_rows(items_doctype, doctype, invoice_names, items_fields):
+		invoices_by_name[item.parent].items.append(item)
+
+	taxes_doctype, taxes_fields = fields["taxes"]
+	for tax in get_child_rows(taxes_doctype, doctype, invoice_names, taxes_fields):
+		invoices_by_name[tax.parent].taxes.append(tax)
+
+
+class InvoiceRecord(object):
+	"""
+	Lightweight replacement of invoice document, created by get_invoices.
+	Child rows are empty until load_invoice_child_rows is called.
+
+	Values are available as attributes, like in Document. frappe._dict
+	can't be used, because "items" would return dict.items method instead
+	of child rows.
+	"""
+
+	def __init__(self, doctype, values):
+		self.__dict__.update(values)
+		self.doctype = doctype
+		self.items = []
+		self.taxes = []
+
+	def get(self, key, default = None):
+		return self.__dict__.get(key, default)
+
+
+def get_child_rows(child_doctype, parent_doctype, parent_names, fields):
+	"""
+	Returns child table rows of all given parents, in order of parents chunks
+	and row index.
+
+	Parent names are split into chunks, so the number of queries depends on
+	the number of documents divided by bulk_query_size, and the queries stay
+	small enough for the database.
+
+	Arguments:
+	- child_doctype: name of child table doctype, e.g. "Purchase Invoice Item"
+	- parent_doctype: name of parent doctype, e.g. "Purchase Invoice"
+	- parent_names: list of names of parent documents
+	- fields: list of child table fields to fetch ("parent" is always added)
+	"""
+
+	rows = []
+
+	for i in range(0, len(parent_names), bulk_query_size):
+		rows += frappe.get_all(
+			child_doctype,
+			fields = ["parent"] + fields,
+			filters = {
+				"parenttype": parent_doctype,
+				"parent": ["in", parent_names[i:i + bulk_query_size]]
+				},
+			order_by = "idx"
+			)
+
+	return rows
+
+
+def get_sales_output_tax_documents(start_date, end_date, tax_accounts, progress = None, filters = None):
+	"""
+	Returns processed Sales Invoices posted in given period
 
-		doc = frappe.get_doc("Purchase Invoice", invoice_name)
+	Arguments:
+	- filters: optional list of additional filters
+	"""
 
-		country = get_supplier_country(doc)
+	# find and process all sales invoices
+	invoices = get_invoices("Sales Invoice", start_date, end_date, filters)
 
-		if country.name in other_eu_countries:
-			document = process_eu_purchase_output_tax_document(doc, tax_accounts)
-			if document:
-				documents.append(document)
+	if progress:
+		progress.add_documents_total(len(invoices))
 
-	return documents
+	return process_sales_invoices(invoices, start_date[:7], tax_accounts, progress)
 
 
 def get_output_tax_details(invoice, tax_accounts):
@@ -260,53 +1179,72 @@ def get_output_tax_details(invoice, tax_accounts):
 	not implemented.
 	"""
 
-	vat0 = 0.0
-	vat5 = {"net": 0.0, "amount": 0.0}
-	vat7 = {"net": 0.0, "amount": 0.0}
-	vat22 = {"net": 0.0, "amount": 0.0}
-	item_net = {}
+	return get_output_tax_details_batch([invoice], tax_accounts)[0]
 
-	for item in invoice.items:
-		item_name = item.item_code or item.item_name
-		item_net[item_name] = item.net_amount
 
-	for tax in invoice.taxes:
-		if tax.account_head in tax_accounts:
-			item_wise_tax = json.loads(tax.item_wise_tax_detail)
+def get_output_tax_details_batch(invoices, tax_accounts):
+	"""
+	Returns list of tax details (see get_output_tax_details) for given
+	invoices, in the same order.
+
+	Tax accounts are converted to a set once for all invoices, and items are
+	grouped by rate with a dict lookup (output_tax_rate_groups) instead of
+	comparing the rate with every group.
+	"""
+
+	tax_accounts = frozenset(tax_accounts)
+
+	details = []
+
+	for invoice in invoices:
+		groups = {"vat5": [0.0, 0.0], "vat7": [0.0, 0.0], "vat22": [0.0, 0.0]}
+
+		# net of items not taxed yet (item with the same name as previous
+		# one replaces its net)
+		item_net = {}
+
+		for item in invoice.items:
+			item_net[item.item_code or item.item_name] = item.net_amount
+
+		for tax in invoice.taxes:
+			if tax.account_head not in tax_accounts:
+				continue
 
-			for i in item_wise_tax:
-				i_tax = item_wise_tax[i]
+			for i, rate, amount in get_item_wise_tax(tax):
 				# important: if tax is 0: omit
 				# because item can have other tax rate
-				if i_tax and i_tax[0]:
-					net = item_net.pop(i, None)
-					if net:
-						rate = i_tax[0]
-						amount = i_tax[1]
-						# base rate
-						if rate == 22.0 or rate == 23.0:
-							vat22["net"] += net
-							vat22["amount"] += amount
-						elif rate == 7.0 or rate == 8.0:
-							vat7["net"] += net
-							vat7["amount"] += amount
-						elif rate == 5.0:
-							vat7["net"] += net
-							vat7["amount"] += amount
-						elif rate:
-							frappe.throw(("Wrong tax rate: " + str(rate) + " in: " + i))
-				
-	# TODO: check if it's correct!
-	# Probably only items with rate 0 are left,
-	# because items with other rates are already "popped",
-	# but it can be wrong
-	for name in item_net:
-		vat0 += item_net[name]
-
-	return {"vat0": vat0, "vat5": vat5, "vat7": vat7, "vat22": vat22}
-
-
-def process_output_tax_document(document, tax_accounts):
+				if not rate:
+					continue
+
+				net = item_net.pop(i, None)
+				if not net:
+					continue
+
+				group = output_tax_rate_groups.get(rate)
+				if group is None:
+					frappe.throw(("Wrong tax rate: " + str(rate) + " in: " + i))
+
+				sums = groups[group]
+				sums[0] += net
+				sums[1] += amount
+
+		# TODO: check if it's correct!
+		# Probably only items with rate 0 are left,
+		# because items with other rates are already "popped",
+		# but it can be wrong
+		vat0 = 0.0
+		for name in item_net:
+			vat0 += item_net[name]
+
+		invoice_details = {"vat0": vat0}
+		for group, (net, amount) in groups.items():
+			invoice_details[group] = {"net": net, "amount": amount}
+		details.append(invoice_details)
+
+	return details
+
+
+def process_output_tax_document(document, tax_accounts, party = None, tax_details = None):
 	"""
 	Should return processed Sales Invoice, but is only partially implemented.
 
@@ -314,9 +1252,15 @@ def process_output_tax_document(document, tax_accounts):
 	- processing of sales invoices to countries other than Poland.
 	Due to above, output tax can be lower (underestimated), causing
 	troubles for the taxpayer!
+
+	Arguments:
+	- party: party data (see get_party_data) if already resolved
+	- tax_details: tax details (see get_output_tax_details) if already
+	  calculated
 	"""
 
-	party = get_party_data(document)
+	if party is None:
+		party = get_party_data(document)
 
 	if party["country_code"] != "PL":
 		# TODO: process sales invoices for other countries
@@ -374,7 +1318,8 @@ def process_output_tax_document(document, tax_accounts):
 	b_spv_dostawa = None
 	b_mpv_prowizja = None
 
-	tax_details = get_output_tax_details(document, tax_accounts)
+	if tax_details is None:
+		tax_details = get_output_tax_details(document, tax_accounts)
 	
 	# TODO: Bad debt relief
 	tax_base_amendment = None
@@ -522,12 +1467,16 @@ def process_output_tax_document(document, tax_accounts):
 
 	return doc
 
-def process_eu_purchase_output_tax_document(document, tax_accounts):
+def process_eu_purchase_output_tax_document(document, tax_accounts, party = None):
 	"""
 	Returns processed Purchase Invoice from EU countries for output tax
+
+	Arguments:
+	- party: party data (see get_party_data) if already resolved
 	"""
 
-	party = get_party_data(document)
+	if party is None:
+		party = get_party_data(document)
 
 	document_number = document.bill_no
 	document_date = document.bill_date
@@ -561,10 +1510,8 @@ def process_eu_purchase_output_tax_document(document, tax_accounts):
 	# get sum of taxes
 	for tax in document.taxes:
 		if tax.account_head in tax_accounts:
-			item_wise_tax = json.loads(tax.item_wise_tax_detail)
-
-			for item_name in item_wise_tax:
-				sum_of_tax += item_wise_tax[item_name][1]
+			for item_name, rate, amount in get_item_wise_tax(tax):
+				sum_of_tax += amount
 
 	# Net amount purchase of goods from EU
 	k_23 = sum_of_net
@@ -598,15 +1545,19 @@ def process_eu_purchase_output_tax_document(document, tax_accounts):
 	return doc
 
 
-def process_input_tax_document(document, tax_accounts):
+def process_input_tax_document(document, tax_accounts, party = None):
 	"""
 	Returns processed document for purchase invoices from EU and Poland,
 	or None if supplier is not from EU
+
+	Arguments:
+	- party: party data (see get_party_data) if already resolved
 	"""
 
 	# ----- get required data ------
 
-	party = get_party_data(document)
+	if party is None:
+		party = get_party_data(document)
 
 	if party["country_code"] not in eu_codes:
 		# import tax documents are processed in other place
@@ -653,13 +1604,11 @@ def process_input_tax_document(document, tax_accounts):
 	# get sums of input taxes
 	for tax in document.taxes:
 		if tax.account_head in tax_accounts:
-			item_wise_tax = json.loads(tax.item_wise_tax_detail)
-
-			for item_name in item_wise_tax:
+			for item_name, rate, amount in get_item_wise_tax(tax):
 				if item_name in fixed_assets:
-					tax_fixed_assets += item_wise_tax[item_name][1]
+					tax_fixed_assets += amount
 				else:
-					tax_other += item_wise_tax[item_name][1]
+					tax_other += amount
 					
 	# TODO: purchase with "VAT margin" invoice
 	vat_margin = None
@@ -706,14 +1655,19 @@ def process_input_tax_document(document, tax_accounts):
 	return doc
 
 
-def process_import_input_tax_document(document, tax_accounts):
+def process_import_input_tax_document(document, tax_accounts, invoice = None):
 	"""
 	Process Journal Entry for SAD/PZC (customs declaration)
+
+	Arguments:
+	- invoice: linked Purchase Invoice (jpk_purchase_invoice) if already
+	  loaded
 	"""
 
 	# ----- get required data ------
 
-	invoice = frappe.get_doc("Purchase Invoice", document.jpk_purchase_invoice)
+	if invoice is None:
+		invoice = frappe.get_doc("Purchase Invoice", document.jpk_purchase_invoice)
 
 	party = get_party_data(invoice)
 
@@ -799,12 +1753,14 @@ def get_party_data(document):
 	country = ""
 	country_code = ""
 
-	if hasattr(document, "customer_name"):
+	# document can be InvoiceRecord (see get_invoices) without all fields
+	# of the document, so the doctype is checked instead of hasattr
+	if document.doctype == "Sales Invoice":
 		party_name = document.customer_name
 		country = get_customer_country(document)
 		if (not tax_id) and is_tax_id_obligatory(country):
 			tax_id = get_obligatory_tax_id(document.customer_name, "Customer")
-	elif hasattr(document, "supplier_name"):
+	elif document.doctype == "Purchase Invoice":
 		party_name = document.supplier_name
 		country = get_supplier_country(document)
 		if (not tax_id) and is_tax_id_obligatory(country):
@@ -841,7 +1797,7 @@ def get_customer_country(document):
 
 	# if customer address is not set on document, too
 	if not address_name:
-		customer = frappe.get_doc("Customer", document.customer)
+		customer = get_cached_party_values("Customer", document.customer)
 		address_name = customer.customer_primary_address
 
 	return get_country_from_address(address_name, return_default = True)
@@ -861,13 +1817,14 @@ def get_supplier_country(document):
 	if address_name:
 		return get_country_from_address(address_name)
 
-	supplier = frappe.get_doc("Supplier", document.supplier)
-	return frappe.get_doc("Country", supplier.country)
+	supplier = get_cached_party_values("Supplier", document.supplier)
+	return get_cached_party_values("Country", supplier.country)
 
 
 def get_country_from_address(address_name, return_default = False):
 	"""
-	Returns Country (doctype) according to country set in address.
+	Returns Country (name and code, see get_cached_party_values) according
+	to country set in address.
 
 	Arguments:
 	- address_name: name of Address doctype
@@ -878,16 +1835,16 @@ def get_country_from_address(address_name, return_default = False):
 	country_name = None
 	
 	if address_name:
-		address = frappe.get_doc("Address", address_name)
+		address = get_cached_party_values("Address", address_name)
 		country_name = address.country
 
 	if (not country_name) and return_default:
 		default_company_name = frappe.defaults.get_user_default("Company")
-		default_company = frappe.get_doc("Company", default_company_name)
+		default_company = get_cached_party_values("Company", default_company_name)
 		country_name = default_company.country
 	
 	if country_name:
-		return frappe.get_doc("Country", country_name)
+		return get_cached_party_values("Country", country_name)
 	else:
 		frappe.throw(_("Country name missing."))
 
@@ -899,14 +1856,14 @@ def get_obligatory_tax_id(party_name, party_doctype_name):
 	If the party is a company, but the Tax ID is not set, it throws an error.
 	"""
 
-	party = frappe.get_doc(party_doctype_name, party_name)
+	party = get_cached_party_values(party_doctype_name, party_name)
 
 	is_company = False
 
-	if hasattr(party, "customer_type"):
+	if party_doctype_name == "Customer":
 		if party.customer_type == "Company":
 			is_company = True
-	elif hasattr(party, "supplier_type"):
+	elif party_doctype_name == "Supplier":
 		if party.supplier_type == "Company":
 			is_company = True
 
@@ -919,12 +1876,205 @@ def get_obligatory_tax_id(party_name, party_doctype_name):
 		return None
 
 
+def is_other_eu_country_code(country_code):
+	"""
+	Returns True if country code belongs to EU country other than Poland.
+
+	Use case: purchase of goods from EU to PL
+	"""
+
+	return country_code in eu_codes and country_code != "PL"
+
+
 def is_tax_id_obligatory(country):
 	"""
 	Returns True if country is in EU or is Poland. Returns False for others.
 	"""
 
-	if country.name in all_eu_countries:
+	if is_eu_country(country.name):
 		return True
 
 	return False
+
+
+def get_declaration_preview(company, year, month, forwarded_excess_of_input_tax = 0):
+	"""
+	Returns dict: P_ field name -> value, for submitted documents of given
+	company and month.
+
+	Uses sums of K_ fields maintained per company and month (see
+	update_monthly_totals), so documents are not processed again (except
+	the first call after clearing cache).
+	"""
+
+	start_date, end_date = get_period_dates(year, month)
+
+	sum_of_field_k, sum_of_bad_debt_relief = get_monthly_totals(
+		company,
+		start_date[:7],
+		lambda: build_monthly_totals(company, start_date, end_date)
+		)
+
+	p_value = calculate_declaration_fields(
+		sum_of_field_k,
+		sum_of_bad_debt_relief,
+		str(cint(forwarded_excess_of_input_tax))
+		)
+
+	return {"P_" + str(number): value for number, value in sorted(p_value.items())}
+
+
+def build_monthly_totals(company, start_date, end_date):
+	"""
+	Returns dict: document key -> totals of the document, for all submitted
+	documents of given company posted in given period
+	"""
+
+	input_tax_accounts, output_tax_accounts = get_tax_accounts(company)
+
+	period = start_date[:7]
+	filters = get_document_filters(company)
+	totals = {}
+
+	purchase_invoices = get_invoices("Purchase Invoice", start_date, end_date, filters)
+	results = process_documents(
+		purchase_invoices,
+		period,
+		process_purchase_invoices_chunk,
+		(input_tax_accounts, output_tax_accounts)
+		)
+
+	for invoice, (input_tax_document, output_tax_document) in zip(purchase_invoices, results):
+		totals[get_document_key(invoice.doctype, invoice.name)] = get_evidence_totals(
+			[input_tax_document],
+			[output_tax_document]
+			)
+
+	sales_invoices = get_invoices("Sales Invoice", start_date, end_date, filters)
+	results = process_documents(
+		sales_invoices,
+		period,
+		process_sales_invoices_chunk,
+		(output_tax_accounts,)
+		)
+
+	for invoice, output_tax_document in zip(sales_invoices, results):
+		totals[get_document_key(invoice.doctype, invoice.name)] = get_evidence_totals([], [output_tax_document])
+
+	journal_entries, results = process_journal_entries(start_date, end_date, input_tax_accounts, filters = filters)
+
+	for entry, input_tax_document in zip(journal_entries, results):
+		totals[get_document_key("Journal Entry", entry.name)] = get_evidence_totals([input_tax_document], [])
+
+	return totals
+
+
+def update_monthly_totals(doc, method = None):
+	"""
+	Updates sums of K_ fields of the document's company and month, after
+	the transaction is committed.
+
+	Used as doc_events hook for Sales Invoice, Purchase Invoice and Journal
+	Entry. Sums are kept in redis, which is not rolled back with the
+	database, so they are updated by background job enqueued after commit
+	(see update_document_monthly_totals), and not at all if the
+	transaction is rolled back.
+	"""
+
+	if not doc.get("company") or not doc.get("posting_date"):
+		return
+
+	frappe.enqueue(
+		"jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m.update_document_monthly_totals",
+		queue = "short",
+		enqueue_after_commit = True,
+		doctype = doc.doctype,
+		name = doc.name,
+		company = doc.company,
+		period = str(doc.posting_date)[:7]
+		)
+
+
+def update_document_monthly_totals(doctype, name, company, period):
+	"""
+	Updates sums of K_ fields of given company and month with committed
+	state of the document. Submitted document is processed with tax
+	accounts from JPK Company Settings, cancelled or deleted document is
+	removed from sums.
+
+	Arguments:
+	- doctype, name: Sales Invoice, Purchase Invoice or Journal Entry
+	- company, period: company and month (YYYY-MM) of the document (it can
+	  be already deleted)
+	"""
+
+	key = get_document_key(doctype, name)
+
+	if not frappe.db.exists(doctype, name):
+		delete_document_totals(company, period, key)
+		return
+
+	doc = frappe.get_doc(doctype, name)
+
+	if doc.docstatus != 1:
+		delete_document_totals(company, period, key)
+		return
+
+	if not frappe.db.exists("JPK Company Settings", company):
+		return
+
+	input_tax_accounts, output_tax_accounts = get_tax_accounts(company)
+
+	try:
+		input_tax_documents, output_tax_documents = get_document_evidence(doc, input_tax_accounts, output_tax_accounts)
+	except Exception:
+		# sums of the month are built again on next preview, where the
+		# error is shown
+		delete_monthly_totals(company, period)
+		return
+
+	set_document_totals(company, period, key, get_evidence_totals(input_tax_documents, output_tax_documents))
+
+
+def get_document_evidence(doc, input_tax_accounts, output_tax_accounts):
+	"""
+	Returns tuple of lists (input tax documents, output tax documents) for
+	single Sales Invoice, Purchase Invoice or Journal Entry
+	"""
+
+	input_tax_documents = []
+	output_tax_documents = []
+
+	if doc.doctype == "Sales Invoice":
+		output_tax_documents.append(process_output_tax_document(doc, output_tax_accounts, get_party_data(doc)))
+
+	elif doc.doctype == "Purchase Invoice":
+		party = get_party_data(doc)
+		input_tax_documents.append(process_input_tax_document(doc, input_tax_accounts, party))
+		if is_other_eu_country_code(party["country_code"]):
+			output_tax_documents.append(process_eu_purchase_output_tax_document(doc, output_tax_accounts, party))
+
+	elif doc.doctype == "Journal Entry" and doc.get("jpk_is_imp"):
+		input_tax_documents.append(process_import_input_tax_document(doc, input_tax_accounts))
+
+	return input_tax_documents, output_tax_documents
+
+
+def get_evidence_totals(input_tax_documents, output_tax_documents):
+	"""
+	Returns totals of given evidence documents (see get_document_totals).
+	Documents can be None.
+	"""
+
+	sum_of_field_k = []
+	initialize_list(sum_of_field_k, 48, 0.0)
+	sum_of_bad_debt_relief = {"net": 0, "tax": 0}
+
+	add_jpk_evidence_sums(
+		[document for document in input_tax_documents if document],
+		[document for document in output_tax_documents if document],
+		sum_of_field_k,
+		sum_of_bad_debt_relief
+		)
+
+	return get_document_totals(sum_of_field_k, sum_of_bad_debt_relief)
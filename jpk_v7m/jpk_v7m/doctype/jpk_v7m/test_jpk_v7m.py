@@ -3,8 +3,42 @@
 # See license.txt
 from __future__ import unicode_literals
 
-# import frappe
+import frappe
 import unittest
+from unittest.mock import patch
+
+from jpk_v7m.jpk_v7m.doctype.jpk_v7m.jpk_v7m import get_invoices, load_invoice_child_rows
 
 class TestJPK_V7M(unittest.TestCase):
-	pass
+
+	def test_bulk_loaded_invoices_have_child_rows(self):
+		"""
+		Records of bulk loaded invoices keep child rows in "items" and
+		"taxes" lists (with frappe._dict "items" would be dict.items)
+		"""
+
+		rows = {
+			"Purchase Invoice": [frappe._dict(name = "PINV-1"), frappe._dict(name = "PINV-2")],
+			"Purchase Invoice Item": [
+				frappe._dict(parent = "PINV-1", item_code = "A", net_amount = 100),
+				frappe._dict(parent = "PINV-2", item_code = "B", net_amount = 50),
+				frappe._dict(parent = "PINV-1", item_code = "C", net_amount = 10)
+				],
+			"Purchase Taxes and Charges": [
+				frappe._dict(parent = "PINV-2", account_head = "VAT", item_wise_tax_detail = "{}")
+				]
+			}
+
+		def get_all(doctype, **kwargs):
+			return rows[doctype]
+
+		with patch.object(frappe, "get_all", side_effect = get_all):
+			invoices = get_invoices("Purchase Invoice", "2021-07-01", "2021-07-31")
+			load_invoice_child_rows(invoices)
+
+		self.assertEqual([invoice.name for invoice in invoices], ["PINV-1", "PINV-2"])
+		self.assertEqual([item.item_code for item in invoices[0].items], ["A", "C"])
+		self.assertEqual([item.item_code for item in invoices[1].items], ["B"])
+		self.assertEqual(invoices[0].taxes, [])
+		self.assertEqual(len(invoices[1].taxes), 1)
+		self.assertEqual(invoices[1].get("doctype"), "Purchase Invoice")
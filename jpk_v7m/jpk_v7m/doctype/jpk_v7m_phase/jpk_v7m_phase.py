@@ -0,0 +1,8 @@
+# Copyright (c) 2021, Levitating Frog and contributors
+# For license information, please see license.txt
+
+# import frappe
+from frappe.model.document import Document
+
+class JPK_V7MPhase(Document):
+	pass
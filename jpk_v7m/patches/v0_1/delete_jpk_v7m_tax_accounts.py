@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import frappe
+
+
+def execute():
+	"""
+	Deletes rows of tax accounts tables removed from JPK_V7M. Tax accounts
+	are taken from JPK Company Settings during generation.
+	"""
+
+	frappe.db.sql("""
+		delete from `tabJPK Tax Accounts Table Item`
+		where parenttype = 'JPK_V7M'
+		""")